@@ -21,7 +21,7 @@ import firefly.domain as ffd
 import firefly.infrastructure as ffi
 import firefly.infrastructure.repository.rdb_storage_interfaces as rsi
 import firefly_di as di
-from firefly.infrastructure.jinja2 import is_attribute, is_criteria, is_uuid, is_list
+from firefly.infrastructure.jinja2 import is_attribute, is_criteria, is_uuid, is_list, is_id_table
 from jinja2 import Environment, FileSystemLoader
 from jinjasql import JinjaSql
 
@@ -32,6 +32,7 @@ def build_jinja(self):
     env.tests['criteria'] = is_criteria
     env.tests['uuid'] = is_uuid
     env.tests['list'] = is_list
+    env.tests['id_table'] = is_id_table
 
     def serialized(entity):
         return self.serializer.serialize(entity)
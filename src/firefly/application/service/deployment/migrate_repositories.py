@@ -30,12 +30,14 @@ import firefly.domain as ff
 import firefly.infrastructure as ffi
 
 
-@ff.cli('firefly migrate-repositories')
+@ff.cli('firefly migrate-repositories', args_help={
+    'force': 'Migrate every table, even when its schema fingerprint is unchanged',
+})
 class MigrateRepositories(ff.ApplicationService):
     _registry: ff.Registry = None
     _context_map: ff.ContextMap = None
 
-    def __call__(self, **kwargs):
+    def __call__(self, force: bool = False, **kwargs):
         for context in self._context_map.contexts:
             if context.is_extension:
                 continue
@@ -53,5 +55,7 @@ class MigrateRepositories(ff.ApplicationService):
                         continue
 
                 if isinstance(repository, ffi.RdbRepository):
-                    print(f'Migrating {repository.__class__.__name__}')
-                    repository.migrate_schema()
+                    if repository.migrate_schema(force=force):
+                        print(f'Migrated {repository.__class__.__name__}')
+                    else:
+                        print(f'{repository.__class__.__name__} is up to date')
@@ -12,6 +12,8 @@
 #  You should have received a copy of the GNU General Public License along with Firefly. If not, see
 #  <http://www.gnu.org/licenses/>.
 
+from .advise_indexes import AdviseIndexes
 from .generate_api_spec import GenerateApiSpec
 from .get_dto_schema import GetDtoSchema
 from .initialize_project import InitializeProject
+from .show_query_stats import ShowQueryStats
@@ -0,0 +1,57 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import json
+
+import firefly.domain as ffd
+from firefly.infrastructure.repository.index_advisor import DEFAULT_MIN_USES
+
+from .rdb_interfaces import rdb_interfaces
+
+
+@ffd.cli('firefly index-advisor', alias={'file': ['f']}, args_help={
+    'file': 'Read usage from a snapshot saved by a storage interface configured with profile_file',
+    'apply': 'Create the suggested indexes',
+    'min_uses': 'Ignore fields used fewer times than this',
+})
+class AdviseIndexes(ffd.ApplicationService):
+    """
+    Suggests indexes for the fields that criteria filter and sort on, based on what the storage interfaces have
+    recorded, and optionally creates them.
+    """
+    _registry: ffd.Registry = None
+    _context_map: ffd.ContextMap = None
+
+    def __call__(self, file: str = None, apply: bool = False, min_uses: int = DEFAULT_MIN_USES, **kwargs):
+        usage = None
+        if file is not None:
+            with open(file) as fp:
+                usage = json.load(fp).get('index_usage', {})
+
+        ret = []
+        for entity, interface in rdb_interfaces(self._context_map, self._registry):
+            entity_usage = usage.get(entity.get_fqn(), {}) if usage is not None else None
+            suggestions = interface.suggest_indexes(entity, entity_usage, min_uses=int(min_uses))
+            if apply:
+                existing = interface.get_table_indexes(entity)
+                for suggestion in suggestions:
+                    if suggestion['action'] == 'create' and suggestion['index'] not in existing:
+                        interface.create_index(entity, suggestion['index'])
+                        suggestion['applied'] = True
+            ret.extend(suggestions)
+
+        print(json.dumps([{k: v.name if k == 'index' else v for k, v in s.items()} for s in ret], indent=2))
+        return ret
@@ -0,0 +1,46 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import Iterator, Tuple, Type
+
+import firefly.domain as ffd
+import firefly.infrastructure as ffi
+
+
+def rdb_interfaces(context_map: ffd.ContextMap, registry: ffd.Registry) \
+        -> Iterator[Tuple[Type[ffd.AggregateRoot], ffi.RdbStorageInterface]]:
+    """
+    Each aggregate root in the non-extension contexts that is stored by a relational storage interface, along with
+    that interface. Aggregates with no repository configured are skipped.
+    """
+    for context in context_map.contexts:
+        if context.is_extension:
+            continue
+
+        for entity in context.entities:
+            if not issubclass(entity, ffd.AggregateRoot):
+                continue
+
+            try:
+                repository = registry(entity)
+            except ffd.FrameworkError as e:
+                if 'No registry found' not in str(e):
+                    raise e
+                continue
+
+            interface = getattr(repository, '_interface', None)
+            if isinstance(interface, ffi.RdbStorageInterface):
+                yield entity, interface
@@ -0,0 +1,61 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import json
+
+import firefly.domain as ffd
+
+from .rdb_interfaces import rdb_interfaces
+
+
+@ffd.cli('firefly query-stats', alias={'file': ['f'], 'limit': ['l']}, args_help={
+    'file': 'Read a snapshot saved by a storage interface configured with profile_file',
+    'slow': 'Include the slow query log',
+    'limit': 'Number of statements to show',
+})
+class ShowQueryStats(ffd.ApplicationService):
+    """
+    Per-statement timings from the storage interfaces' statement profilers, slowest total first.
+    """
+    _registry: ffd.Registry = None
+    _context_map: ffd.ContextMap = None
+
+    def __call__(self, file: str = None, slow: bool = False, limit: int = 20, **kwargs):
+        if file is not None:
+            with open(file) as fp:
+                snapshots = [json.load(fp)]
+        else:
+            snapshots = [p.snapshot() for p in self._profilers()]
+
+        ret = {'statements': [], 'slow_queries': []}
+        for snapshot in snapshots:
+            ret['statements'].extend(snapshot['statements'])
+            if slow:
+                ret['slow_queries'].extend(snapshot['slow_queries'])
+        ret['statements'] = sorted(ret['statements'], key=lambda s: s['total_ms'], reverse=True)[:int(limit)]
+        if not slow:
+            del ret['slow_queries']
+
+        print(json.dumps(ret, indent=2, default=str))
+        return ret
+
+    def _profilers(self):
+        ret = []
+        for _, interface in rdb_interfaces(self._context_map, self._registry):
+            if interface.profiler not in ret:
+                ret.append(interface.profiler)
+
+        return ret
@@ -32,7 +32,9 @@ class MultipleResultsFound(RepositoryError):
 
 
 class ConcurrentUpdateDetected(RepositoryError):
-    pass
+    def __init__(self, *args, ids: list = None):
+        super().__init__(*args)
+        self.ids = ids or []
 
 
 class FrameworkError(Exception):
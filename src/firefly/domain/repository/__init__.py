@@ -12,7 +12,9 @@
 #  You should have received a copy of the GNU General Public License along with Firefly. If not, see
 #  <http://www.gnu.org/licenses/>.
 
+from .aggregate_function import AggregateFunction, Count, Sum, Avg, Min, Max, evaluate_aggregates
 from .connection_factory import ConnectionFactory
+from .identity_map import IdentityMap
 from .registry import Registry
 from .repository import Repository
 from .repository_factory import RepositoryFactory
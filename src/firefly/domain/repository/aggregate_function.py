@@ -0,0 +1,121 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class AggregateFunction(ABC):
+    """
+    An aggregate over one field (or over rows, for Count()). sql is the function name storage interfaces compile to,
+    and step()/result() evaluate it in python when a query can't be pushed down.
+    """
+    sql: str = None
+
+    def __init__(self, field: Optional[str] = None):
+        self.field = field
+
+    def initial(self):
+        return None
+
+    @abstractmethod
+    def step(self, acc, value):
+        pass
+
+    def result(self, acc):
+        return acc
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.field == self.field
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({repr(self.field) if self.field is not None else ''})"
+
+
+class Count(AggregateFunction):
+    sql = 'count'
+
+    def initial(self):
+        return 0
+
+    def step(self, acc, value):
+        return acc + 1 if self.field is None or value is not None else acc
+
+
+class Sum(AggregateFunction):
+    sql = 'sum'
+
+    def step(self, acc, value):
+        if value is None:
+            return acc
+        return value if acc is None else acc + value
+
+
+class Avg(AggregateFunction):
+    sql = 'avg'
+
+    def initial(self):
+        return 0, 0
+
+    def step(self, acc, value):
+        return acc if value is None else (acc[0] + value, acc[1] + 1)
+
+    def result(self, acc):
+        return acc[0] / acc[1] if acc[1] else None
+
+
+class Min(AggregateFunction):
+    sql = 'min'
+
+    def step(self, acc, value):
+        return acc if value is None or (acc is not None and acc <= value) else value
+
+
+class Max(AggregateFunction):
+    sql = 'max'
+
+    def step(self, acc, value):
+        return acc if value is None or (acc is not None and acc >= value) else value
+
+
+def evaluate_aggregates(rows: Iterable[Any], functions: Dict[str, AggregateFunction],
+                        group_by: List[str] = None) -> List[dict]:
+    """
+    Aggregates entities or raw documents one at a time, so the rows can come from a stream.
+    """
+    def read(row, name):
+        return row.get(name) if isinstance(row, dict) else getattr(row, name, None)
+
+    group_by = group_by or []
+    groups = {}
+    for row in rows:
+        key = tuple(read(row, name) for name in group_by)
+        if key not in groups:
+            groups[key] = {alias: f.initial() for alias, f in functions.items()}
+        acc = groups[key]
+        for alias, f in functions.items():
+            acc[alias] = f.step(acc[alias], read(row, f.field) if f.field is not None else None)
+
+    if not groups and not group_by:
+        groups[()] = {alias: f.initial() for alias, f in functions.items()}
+
+    ret = []
+    for key, acc in groups.items():
+        row = dict(zip(group_by, key))
+        row.update({alias: f.result(acc[alias]) for alias, f in functions.items()})
+        ret.append(row)
+
+    return ret
@@ -0,0 +1,68 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import Dict, Generic, Iterable, Iterator, List, Optional, TypeVar
+
+import firefly.domain as ffd
+
+T = TypeVar('T')
+
+
+class IdentityMap(Generic[T]):
+    """
+    The entities checked out by a repository, keyed by id. Membership, lookup and removal are O(1) and iteration
+    follows insertion order, so it can stand in for the list repositories used to keep.
+    """
+
+    def __init__(self, entities: Iterable[T] = None):
+        self._entities: Dict[object, T] = {}
+        for entity in entities or []:
+            self.append(entity)
+
+    def append(self, entity: T):
+        self._entities.setdefault(entity.id_value(), entity)
+
+    def remove(self, entity: T):
+        del self._entities[entity.id_value()]
+
+    def get(self, id_) -> Optional[T]:
+        return self._entities.get(id_)
+
+    def items(self):
+        return self._entities.items()
+
+    def clear(self):
+        self._entities.clear()
+
+    def __contains__(self, entity):
+        if isinstance(entity, ffd.Entity):
+            return entity.id_value() in self._entities
+        return entity in self._entities
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._entities.values())
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __getitem__(self, item) -> T:
+        return list(self._entities.values())[item]
+
+    def __repr__(self):
+        return f'IdentityMap({list(self._entities.values())!r})'
+
+    def to_list(self) -> List[T]:
+        return list(self._entities.values())
@@ -14,6 +14,7 @@
 
 from __future__ import annotations
 
+from contextvars import ContextVar
 from typing import TypeVar, Type
 
 import firefly.domain as ffd
@@ -30,6 +31,8 @@ class Registry(LoggerAware):
         self._cache = {}
         self._factories = {}
         self._default_factory = {}
+        # Each thread and each asyncio task runs its own unit of work.
+        self._in_transaction = ContextVar(f'registry_in_transaction_{id(self)}', default=False)
 
     def __call__(self, entity) -> Repository:
         if not issubclass(entity, ffd.AggregateRoot):
@@ -58,6 +61,11 @@ class Registry(LoggerAware):
                     f'No registry found for entity {entity}. Have you configured a persistence mechanism or extension?'
                 )
 
+        # Only a newly created repository gets here. It joins the open unit of work, once. Cached repositories were
+        # begun by begin_transaction().
+        if self._in_transaction.get():
+            self._cache[entity].begin_transaction()
+
         return self._cache[entity]
 
     def register_factory(self, type_: Type[AR], factory: ffd.RepositoryFactory):
@@ -82,3 +90,18 @@ class Registry(LoggerAware):
             ret.append(v)
         self.debug(ret)
         return ret
+
+    def begin_transaction(self):
+        self._in_transaction.set(True)
+        for repository in self.get_repositories():
+            repository.begin_transaction()
+
+    def commit_transaction(self):
+        self._in_transaction.set(False)
+        for repository in self.get_repositories():
+            repository.commit_transaction()
+
+    def rollback_transaction(self):
+        self._in_transaction.set(False)
+        for repository in self.get_repositories():
+            repository.rollback_transaction()
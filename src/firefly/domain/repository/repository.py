@@ -20,6 +20,7 @@ from typing import List, TypeVar, Generic, Union, Callable, Optional, Tuple
 
 import firefly.domain as ffd
 
+from .identity_map import IdentityMap
 from ..service.logging.logger import LoggerAware
 from ..value_object import GenericBase
 
@@ -31,7 +32,7 @@ class Repository(Generic[T], GenericBase, LoggerAware, ABC):
 
     def __init__(self):
         self._entity_hashes = {}
-        self._entities = []
+        self._entities = IdentityMap()
         self._deletions = []
         self._parent = None
 
@@ -47,6 +48,24 @@ class Repository(Generic[T], GenericBase, LoggerAware, ABC):
     def find(self, x: Union[str, Callable, ffd.BinaryOp], **kwargs) -> Optional[T]:
         pass
 
+    def find_many(self, ids: List[str], **kwargs) -> List[T]:
+        """
+        The entities with the given ids, in the order the ids are given. Ids that aren't found are skipped.
+        """
+        ret = []
+        for id_ in ids:
+            entity = self.find(id_)
+            if entity is not None:
+                ret.append(entity)
+
+        return ret
+
+    def find_ids(self, ids: List[str]) -> List[str]:
+        """
+        The given ids that belong to an existing entity, in the order they are given.
+        """
+        return [e.id_value() for e in self.find_many(ids)]
+
     @abstractmethod
     def filter(self, x: Union[Callable, ffd.BinaryOp], **kwargs) -> Repository:
         pass
@@ -55,6 +74,60 @@ class Repository(Generic[T], GenericBase, LoggerAware, ABC):
     def commit(self, **kwargs):
         pass
 
+    def stream(self, criteria: Union[Callable, ffd.BinaryOp] = None, batch_size: int = 1000,
+               read_only: bool = False):
+        if criteria is not None:
+            criteria = self._get_search_criteria(criteria)
+
+        for entity in self:
+            if criteria is None or criteria.matches(entity):
+                yield entity
+
+    def page(self, offset: int = 0, limit: int = None, count: Union[bool, int] = True) -> Tuple[List[T], Optional[int]]:
+        """
+        A page of results and the total number of matches. count=False skips the total. An int caps it: counting
+        stops after count + 1 matches, so a total above count means "more than count".
+        """
+        entities = list(self)
+        total = None
+        if count is True:
+            total = len(entities)
+        elif count is not False:
+            total = min(len(entities), int(count) + 1)
+
+        return entities[offset:None if limit is None else offset + limit], total
+
+    def aggregate(self, group_by: List[str] = None, **functions: ffd.AggregateFunction) -> Union[dict, List[dict]]:
+        """
+        e.g. aggregate(group_by=['status'], total=ffd.Sum('amount'), n=ffd.Count()). Returns a dict per group, or a
+        single dict without group_by.
+        """
+        ret = ffd.evaluate_aggregates(iter(self), functions, group_by)
+        return ret if group_by else ret[0]
+
+    def update_where(self, criteria: Union[Callable, ffd.BinaryOp], values: dict) -> int:
+        """
+        Sets the given fields on every match, returning how many were changed.
+        """
+        criteria = self._get_search_criteria(criteria)
+        matches = [entity for entity in self if criteria.matches(entity)]
+        for entity in matches:
+            for k, v in values.items():
+                setattr(entity, k, v)
+
+        return len(matches)
+
+    def delete_where(self, criteria: Union[Callable, ffd.BinaryOp], **kwargs) -> int:
+        """
+        Removes every match, returning how many were removed.
+        """
+        criteria = self._get_search_criteria(criteria)
+        matches = [entity for entity in self if criteria.matches(entity)]
+        for entity in matches:
+            self.remove(entity)
+
+        return len(matches)
+
     @abstractmethod
     def sort(self, cb: Optional[Union[Callable, Tuple[Union[str, Tuple[str, bool]]]]], **kwargs):
         pass
@@ -69,9 +142,18 @@ class Repository(Generic[T], GenericBase, LoggerAware, ABC):
 
     def reset(self):
         self._deletions = []
-        self._entities = []
+        self._entities = IdentityMap()
         self._entity_hashes = {}
 
+    def begin_transaction(self):
+        pass
+
+    def commit_transaction(self):
+        pass
+
+    def rollback_transaction(self):
+        pass
+
     def touch(self, entity: ffd.Entity):
         if entity.id_value() in self._entity_hashes:
             self._entity_hashes[entity.id_value()] = ''
@@ -108,7 +190,7 @@ class Repository(Generic[T], GenericBase, LoggerAware, ABC):
         return self._get_hash(entity) != self._entity_hashes[entity.id_value()]
 
     def _new_entities(self):
-        return [e for e in self._entities if e.id_value() not in self._entity_hashes]
+        return [e for id_, e in self._entities.items() if id_ not in self._entity_hashes]
 
     def _changed_entities(self):
         return [e for e in self._entities if self._has_changed(e)]
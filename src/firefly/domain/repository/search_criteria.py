@@ -18,7 +18,7 @@ import inspect
 from dataclasses import is_dataclass, fields
 from datetime import datetime, date
 from pprint import pprint
-from typing import Union, List, Type, get_type_hints
+from typing import Union, List, Type, get_type_hints, Tuple
 
 import firefly.domain as ffd
 import regex
@@ -323,8 +323,8 @@ class BinaryOp:
     def __or__(self, other):
         return BinaryOp(self, 'or', other)
 
-    def prune(self, fields: list):
-        data = self._prune(fields, self.to_dict())
+    def prune(self, fields: list, ops: list = None):
+        data = self._prune(fields, self.to_dict(), ops)
         if data is INVALID:
             return None
         if data['l'] is INVALID:
@@ -334,9 +334,12 @@ class BinaryOp:
 
         return BinaryOp.from_dict(data)
 
-    def _prune(self, fields: list, data: dict):
+    def _prune(self, fields: list, data: dict, ops: list = None):
+        if ops is not None and data['o'] not in ('and', 'or') and data['o'] not in ops:
+            return INVALID
+
         if isinstance(data['l'], dict):
-            data['l'] = self._prune(fields, data['l'])
+            data['l'] = self._prune(fields, data['l'], ops)
         elif isinstance(data['l'], str) and len(data['l']) > 2:
             prop = data['l']
             if '(' in prop:
@@ -345,7 +348,7 @@ class BinaryOp:
                 return INVALID
 
         if isinstance(data['r'], dict):
-            data['r'] = self._prune(fields, data['r'])
+            data['r'] = self._prune(fields, data['r'], ops)
         elif isinstance(data['r'], str) and len(data['r']) > 2:
             prop = data['r']
             if '(' in prop:
@@ -353,6 +356,9 @@ class BinaryOp:
             if prop.startswith('a:') and prop[2:] not in fields:
                 return INVALID
 
+        # Dropping one side of an "or" would narrow the results instead of widening them.
+        if data['o'] == 'or' and (data['l'] is INVALID or data['r'] is INVALID):
+            return INVALID
         if data['l'] is INVALID and data['r'] is not INVALID:
             return data['r']
         if data['l'] is not INVALID and data['r'] is INVALID:
@@ -362,6 +368,26 @@ class BinaryOp:
 
         return data
 
+    def attributes(self) -> List[Tuple[str, str]]:
+        """
+        (field, operator) for every attribute the criteria compares, e.g. [('name', '=='), ('size', '>')].
+        """
+        return self._attributes(self.to_dict())
+
+    def _attributes(self, data: dict):
+        ret = []
+        for side in ('l', 'r'):
+            value = data[side]
+            if isinstance(value, dict):
+                ret.extend(self._attributes(value))
+            elif isinstance(value, str) and value.startswith('a:'):
+                prop = value[2:]
+                if '(' in prop:
+                    prop = self._remove_function_calls(prop)
+                ret.append((prop, data['o']))
+
+        return ret
+
     def to_sql(self, prefix: str = None):
         sql, params, counter = self._to_sql(prefix=prefix)
         return sql, params
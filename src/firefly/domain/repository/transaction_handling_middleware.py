@@ -41,6 +41,7 @@ class TransactionHandlingMiddleware(Middleware, LoggerAware, SystemBusAware):
                     self.debug('Level 0 - Resetting repositories')
                     self.debug(message)
                     self._reset()
+                    self._registry.begin_transaction()
                 elif self._level > 0:
                     message.headers['nested_request'] = True
                     if isinstance(message, ffd.Event):
@@ -59,8 +60,8 @@ class TransactionHandlingMiddleware(Middleware, LoggerAware, SystemBusAware):
                     self.debug('Level 0 - Committing changes')
                     self._commit()
                 return ret
-            except ffd.ConcurrentUpdateDetected:
-                self.info('Concurrent update detected. Retrying the operation.')
+            except ffd.ConcurrentUpdateDetected as e:
+                self.info('Concurrent update detected for %s. Retrying the operation.', e.ids)
                 self.reset_level()
                 self._reset()
             except Exception as e:
@@ -75,6 +76,7 @@ class TransactionHandlingMiddleware(Middleware, LoggerAware, SystemBusAware):
                 raise
 
     def _reset(self):
+        self._registry.rollback_transaction()
         for repository in self._registry.get_repositories():
             repository.reset()
         self._event_buffer = []
@@ -83,5 +85,6 @@ class TransactionHandlingMiddleware(Middleware, LoggerAware, SystemBusAware):
         for repository in self._registry.get_repositories():
             self.debug('Committing repository %s', repository)
             repository.commit()
+        self._registry.commit_transaction()
         self.debug('Dispatching events %s', [{e: e.to_dict() for e in self._event_buffer}])
         list(map(lambda e: self.dispatch(e), self._event_buffer))
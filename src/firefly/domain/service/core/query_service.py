@@ -14,6 +14,8 @@
 
 from __future__ import annotations
 
+import base64
+import binascii
 from typing import Generic, TypeVar
 
 import firefly.domain as ffd
@@ -58,22 +60,54 @@ class QueryService(Generic[T], GenericBase, ApplicationService):
             criteria = ffd.Attr('deleted_on').is_none()
             entities = self._registry(self._type()).filter(criteria)
 
-        paginated = False
-        count = None
-        if limit is not None and offset is not None:
-            count = len(entities)
-            entities = entities[offset:(offset + limit - 1)]
-            paginated = True
-
         if 'sort' in kwargs:
-            entities = entities.sort(lambda x: kwargs.get('sort'))
+            sort = kwargs.get('sort')
+            if isinstance(sort, list):
+                sort = tuple(tuple(s) if isinstance(s, (list, tuple)) else (s,) for s in sort)
+            entities = entities.sort(lambda x: sort)
 
-        if paginated:
-            return {
+        if limit is not None and offset is not None:
+            # count=false skips the total, max_count=N stops counting past N (reported as count_capped).
+            max_count = kwargs.get('max_count')
+            if max_count is not None:
+                count = int(max_count)
+            else:
+                count = str(kwargs.get('count', True)).lower() != 'false'
+            page, total = entities.page(offset, limit, count=count)
+            ret = {
                 'offset': offset,
                 'limit': limit,
-                'count': count,
-                'data': list(map(lambda e: e.to_dict(force_all=self._kernel.is_admin(self._context)), entities)),
+                'count': total,
+                'data': self._to_dicts(page),
             }
+            if max_count is not None:
+                ret['count'] = min(total, count)
+                ret['count_capped'] = total > count
+            return ret
 
+        # Keyset pages are opt-in: pass cursor (empty for the first page) along with limit.
+        if 'limit' in kwargs and 'cursor' in kwargs:
+            limit = int(kwargs.get('limit'))
+            cursor = kwargs.get('cursor')
+            entities = entities.after(self._decode_cursor(cursor) if cursor else None)
+            page = entities[:limit]
+            return {
+                'limit': limit,
+                'cursor': cursor,
+                'next_cursor': self._encode_cursor(entities.cursor(page[-1])) if page and len(page) == limit else None,
+                'data': self._to_dicts(page),
+            }
+
+        return self._to_dicts(entities)
+
+    def _to_dicts(self, entities):
         return list(map(lambda e: e.to_dict(force_all=self._kernel.is_admin(self._context)), entities))
+
+    def _encode_cursor(self, values: dict) -> str:
+        return base64.urlsafe_b64encode(self._serializer.serialize(values).encode('utf-8')).decode('utf-8')
+
+    def _decode_cursor(self, token: str) -> dict:
+        try:
+            return self._serializer.deserialize(base64.urlsafe_b64decode(token.encode('utf-8')).decode('utf-8'))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ffd.InvalidArgument('Invalid cursor')
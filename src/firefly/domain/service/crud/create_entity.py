@@ -36,6 +36,7 @@ class CreateEntity(Generic[T], ApplicationService, GenericBase, CrudOperation, S
         type_ = self._type()
 
         hints = get_type_hints(type_)
+        self._prefetch_aggregate_references(type_, hints, kwargs)
         for field_ in fields(type_):
             if ffd.is_aggregate_reference(hints[field_.name]):
                 value = ffd.apply_aggregate(kwargs[field_.name], hints[field_.name], self._load_aggregate_reference)
@@ -53,6 +54,23 @@ class CreateEntity(Generic[T], ApplicationService, GenericBase, CrudOperation, S
 
         return entity
 
+    def _prefetch_aggregate_references(self, type_: Type[ffd.Entity], hints: dict, kwargs: dict):
+        # Loads every referenced id of a type in one query, so resolving them one by one hits the identity map.
+        ids = {}
+
+        def collect(data, t):
+            if isinstance(data, str):
+                ids.setdefault(t, []).append(data)
+            return data
+
+        for field_ in fields(type_):
+            if ffd.is_aggregate_reference(hints[field_.name]) and field_.name in kwargs:
+                ffd.apply_aggregate(kwargs[field_.name], hints[field_.name], collect)
+
+        for t, references in ids.items():
+            if len(references) > 1:
+                self._registry(t).find_many(references)
+
     def _load_aggregate_reference(self, data, type_):
         if isinstance(data, str):
             return self._registry(type_).find(data)
@@ -14,6 +14,7 @@
 import uuid
 
 import firefly.domain as ffd
+from firefly.infrastructure.repository.in_lists import IdTable
 
 
 def is_attribute(x):
@@ -34,3 +35,7 @@ def is_uuid(x):
 
 def is_list(x):
     return isinstance(x, list)
+
+
+def is_id_table(x):
+    return isinstance(x, IdTable)
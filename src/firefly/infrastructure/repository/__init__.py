@@ -17,11 +17,14 @@ from .abstract_storage_interface import AbstractStorageInterface
 from .document_repository import DocumentRepository
 from .document_repository_factory import DocumentRepositoryFactory
 from .document_storage_interface import DocumentStorageInterface
+from .index_advisor import IndexAdvisor, ADVISED_INDEX_PREFIX
 from .memory_repository import MemoryRepository
 from .memory_repository_factory import MemoryRepositoryFactory
+from .query_cache import QueryCache
 from .rdb_connection_factory import RdbConnectionFactory
 from .rdb_repository import RdbRepository
 from .rdb_repository_factory import RdbRepositoryFactory
 from .rdb_storage_interface import RdbStorageInterface
 from .rdb_storage_interface_registry import RdbStorageInterfaceRegistry
 from .rdb_storage_interfaces import *
+from .statement_profiler import StatementProfiler
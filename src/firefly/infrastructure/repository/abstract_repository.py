@@ -81,36 +81,255 @@ class AbstractRepository(ffd.Repository[T]):
 
         return ret
 
+    def find_many(self, ids: List[str], **kwargs) -> List[T]:
+        """
+        Entities that are already checked out are returned as they are. The rest are loaded with a single query.
+        """
+        if isinstance(self._entity_type.id_name(), list):
+            return super().find_many(ids, **kwargs)
+
+        ids = list(ids)
+        found = {}
+        missing = []
+        for id_ in dict.fromkeys(ids):
+            entity = self._find_checked_out_entity(id_)
+            if entity is not None:
+                found[id_] = entity
+            else:
+                missing.append(id_)
+
+        if len(missing) > 0:
+            loaded = self._interface.all(self._entity_type, ffd.Attr(self._entity_type.id_name()).is_in(missing))
+            for entity in self._merge(loaded):
+                found[entity.id_value()] = entity
+
+        return [found[id_] for id_ in ids if id_ in found]
+
+    def find_ids(self, ids: List[str]) -> List[str]:
+        """
+        Ids of checked out entities are found as they are. The rest are looked up with a query that selects only ids.
+        """
+        id_name = self._entity_type.id_name()
+        if isinstance(id_name, list):
+            return super().find_ids(ids)
+
+        ids = list(ids)
+        found = set()
+        missing = []
+        for id_ in dict.fromkeys(ids):
+            if self._find_checked_out_entity(id_) is not None:
+                found.add(id_)
+            else:
+                missing.append(id_)
+
+        if len(missing) > 0:
+            rows = self._interface.project(self._entity_type, (id_name,), ffd.Attr(id_name).is_in(missing))
+            found.update(row[id_name] for row in rows)
+
+        return [id_ for id_ in ids if id_ in found]
+
+    def stream(self, criteria: Union[Callable, ffd.BinaryOp] = None, batch_size: int = 1000,
+               read_only: bool = False):
+        """
+        Yields entities as they are read from storage instead of loading the whole result set. With read_only=True,
+        entities are not registered with the repository, so memory stays flat but changes to them are not committed.
+        """
+        if criteria is None:
+            criteria = self._query_details.get('criteria')
+        if criteria is not None and not isinstance(criteria, ffd.BinaryOp):
+            criteria = self._get_search_criteria(criteria)
+
+        for entity in self._interface.stream(
+                self._entity_type, criteria, sort=self._query_details.get('sort'), batch_size=batch_size):
+            if entity.id_value() in self._entity_hashes:
+                yield self._find_checked_out_entity(entity.id_value()) or entity
+                continue
+
+            if not read_only:
+                self.register_entity(entity)
+                if self._state == 'empty':
+                    self._state = 'partial'
+            yield entity
+
     def filter(self, x: Union[Callable, ffd.BinaryOp], **kwargs) -> AbstractRepository:
         self._query_details.update(kwargs)
         self._query_details['criteria'] = x
 
         return self.copy()
 
+    def after(self, cursor: Union[T, dict, None]) -> AbstractRepository:
+        """
+        Keyset pagination. Restricts the results to those that sort after the given entity, or after a dict of its
+        sort column values (see cursor()). Pass None for the first page. The id is always used as the final sort key.
+        """
+        self._query_details['after'] = cursor
+
+        return self.copy()
+
+    def only(self, *fields_: str) -> AbstractRepository:
+        """
+        Selects just the given fields. Results are dicts of stored values, as with raw=True; no entities are built or
+        checked out.
+        """
+        self._query_details['only'] = fields_
+        self._query_details['raw'] = True
+
+        return self.copy()
+
+    def cursor(self, entity: T) -> dict:
+        return {name: getattr(entity, name) for name, _ in self._keyset(self._query_details.get('sort'))}
+
+    def _keyset(self, sort) -> List[Tuple[str, bool]]:
+        ret = [(str(s[0]), len(s) == 2 and bool(s[1])) for s in (sort or [])]
+        if self._entity_type.id_name() not in [name for name, _ in ret]:
+            ret.append((self._entity_type.id_name(), False))
+
+        return ret
+
+    def _seek(self, query_details: dict) -> dict:
+        ret = query_details.copy()
+        if ret.get('sort') is None and 'after' not in ret:
+            return ret
+
+        # The id breaks ties so that consecutive pages neither skip nor repeat rows.
+        keyset = self._keyset(ret.get('sort'))
+        ret['sort'] = tuple(keyset)
+        after = ret.pop('after', None)
+        if after is None:
+            return ret
+
+        try:
+            values = {name: after[name] if isinstance(after, dict) else getattr(after, name) for name, _ in keyset}
+        except (KeyError, AttributeError) as e:
+            raise ffd.InvalidArgument(f'Cursor is missing the sort key {e}')
+
+        # (a, b, id) > (x, y, z) expanded so the leading column can still use an index range scan.
+        seek = None
+        for name, desc in reversed(keyset):
+            op = ffd.Attr(name) < values[name] if desc else ffd.Attr(name) > values[name]
+            seek = op if seek is None else op | ((ffd.Attr(name) == values[name]) & seek)
+        if len(keyset) > 1:
+            name, desc = keyset[0]
+            seek = (ffd.Attr(name) <= values[name] if desc else ffd.Attr(name) >= values[name]) & seek
+
+        criteria = ret.get('criteria')
+        if criteria is not None and not isinstance(criteria, ffd.BinaryOp):
+            criteria = self._get_search_criteria(criteria)
+        ret['criteria'] = seek if criteria is None else criteria & seek
+
+        return ret
+
+    def page(self, offset: int = 0, limit: int = None, count: Union[bool, int] = True) -> Tuple[List[T], Optional[int]]:
+        if self._state == 'full' or self._query_details.get('raw') is True:
+            return super().page(offset, limit, count)
+
+        query_details = self._seek(self._query_details)
+        criteria = query_details.get('criteria')
+        if criteria is not None and not isinstance(criteria, ffd.BinaryOp):
+            criteria = self._get_search_criteria(criteria)
+
+        entities, total = self._interface.page(
+            self._entity_type, criteria=criteria, limit=DEFAULT_LIMIT if limit is None else limit,
+            offset=offset or None, sort=query_details.get('sort'), count=count
+        )
+
+        return self._merge(entities), total
+
+    def aggregate(self, group_by: List[str] = None, **functions: ffd.AggregateFunction) -> Union[dict, List[dict]]:
+        if self._state == 'full':
+            return super().aggregate(group_by, **functions)
+
+        criteria = self._query_details.get('criteria')
+        if criteria is not None and not isinstance(criteria, ffd.BinaryOp):
+            criteria = self._get_search_criteria(criteria)
+
+        ret = self._interface.aggregate(self._entity_type, functions, group_by=group_by, criteria=criteria)
+        return ret if group_by else ret[0]
+
+    def update_where(self, criteria: Union[Callable, ffd.BinaryOp], values: dict) -> int:
+        """
+        Sets fields on every stored match in one statement, without loading them. Returns the number of rows changed.
+        """
+        criteria = self._where(criteria)
+        ret = self._interface.update_where(self._entity_type, criteria, values)
+        self._evict(criteria)
+
+        return ret
+
+    def delete_where(self, criteria: Union[Callable, ffd.BinaryOp], force: bool = False, **kwargs) -> int:
+        """
+        Removes every stored match in one statement, without loading them. Entities with deleted_on are soft deleted
+        unless force is True. Returns the number of rows removed.
+        """
+        criteria = self._where(criteria)
+        ret = self._interface.delete_where(self._entity_type, criteria, force=force)
+        self._evict(criteria)
+
+        return ret
+
+    def _where(self, criteria: Union[Callable, ffd.BinaryOp]) -> ffd.BinaryOp:
+        criteria = self._get_search_criteria(criteria) if not isinstance(criteria, ffd.BinaryOp) else criteria
+        current = self._query_details.get('criteria')
+        if current is not None:
+            current = self._get_search_criteria(current) if not isinstance(current, ffd.BinaryOp) else current
+            criteria = current & criteria
+
+        return criteria
+
+    def _evict(self, criteria: ffd.BinaryOp):
+        # Checked out copies of the rows a statement changed are stale. Dropping them makes the next read load them
+        # again, and keeps commit() from writing them back over the change.
+        repository = self
+        while repository is not None:
+            for entity in [e for e in repository._entities if e.id_value() in repository._entity_hashes]:
+                if criteria.matches(entity):
+                    repository._entities.remove(entity)
+                    del repository._entity_hashes[entity.id_value()]
+            repository = repository._parent
+
     def _do_filter(self, criteria: Union[Callable, ffd.BinaryOp], limit: int = None, offset: int = None,
-                   raw: bool = False, sort: tuple = None) -> List[T]:
+                   raw: bool = False, sort: tuple = None, only: Tuple[str] = None) -> List[T]:
         if criteria is not None:
             criteria = self._get_search_criteria(criteria) if not isinstance(criteria, ffd.BinaryOp) else criteria
+        if only is not None:
+            return self._project(criteria, only, limit, offset, sort)
         if self._state == 'full':
             entities = list(filter(lambda e: criteria.matches(e), self._entities))
         else:
             entities = self._interface.all(
                 self._entity_type, criteria=criteria, limit=limit, offset=offset, raw=raw, sort=sort
             )
-
-            merged = []
-            for entity in entities:
-                if entity in self._entities:
-                    merged.append(next(e for e in self._entities if e == entity))
-                else:
-                    merged.append(entity)
-                    if raw is False:
-                        self.register_entity(entity)
-            if self._state == 'empty':
+            if raw is False:
+                entities = self._merge(entities)
+            elif self._state == 'empty':
                 self._state = 'partial'
-            entities = merged
         return entities
 
+    def _project(self, criteria: Optional[ffd.BinaryOp], fields_: Tuple[str], limit: int = None, offset: int = None,
+                 sort: tuple = None) -> List[dict]:
+        if self._state == 'full':
+            entities = [e for e in self._entities if criteria is None or criteria.matches(e)]
+            return [{name: getattr(e, name) for name in fields_} for e in entities]
+
+        return self._interface.project(
+            self._entity_type, fields_, criteria=criteria, limit=limit, offset=offset, sort=sort
+        )
+
+    def _merge(self, entities: List[T]) -> List[T]:
+        # Entities that are already checked out win over freshly loaded copies.
+        merged = []
+        for entity in entities:
+            checked_out = self._entities.get(entity.id_value())
+            if checked_out is not None:
+                merged.append(checked_out)
+            else:
+                merged.append(entity)
+                self.register_entity(entity)
+        if self._state == 'empty':
+            self._state = 'partial'
+
+        return merged
+
     def sort(self, cb: Optional[Union[Callable, Tuple[Union[str, Tuple[str, bool]]]]] = None, **kwargs):
         if cb is None and 'key' in kwargs:
             return list(self).sort(**kwargs)
@@ -125,14 +344,17 @@ class AbstractRepository(ffd.Repository[T]):
 
     def clear(self):
         self._interface.clear(self._entity_type)
+        # Nothing that was checked out exists anymore.
+        self.reset()
 
     def destroy(self):
         self._interface.destroy(self._entity_type)
+        self.reset()
 
     def copy(self):
         ret = self.__class__()
         ret._query_details = self._query_details.copy()
-        ret._entities = []
+        ret._entities = ffd.IdentityMap()
         ret._entity_hashes = {}
         ret._deletions = []
         ret._parent = self
@@ -141,7 +363,7 @@ class AbstractRepository(ffd.Repository[T]):
         entities = self._new_entities()
         self.reset()
         self._deletions = deletions
-        self._entities = entities
+        self._entities = ffd.IdentityMap(entities)
 
         return ret
 
@@ -153,6 +375,8 @@ class AbstractRepository(ffd.Repository[T]):
 
     def __len__(self):
         params = self._query_details.copy()
+        params.pop('after', None)
+        params.pop('only', None)
         if 'criteria' in params and not isinstance(params['criteria'], ffd.BinaryOp):
             params['criteria'] = self._get_search_criteria(params['criteria'])
         return self._interface.all(self._entity_type, count=True, **params)
@@ -162,7 +386,7 @@ class AbstractRepository(ffd.Repository[T]):
             if item.start is not None:
                 self._query_details['offset'] = item.start
             if item.stop is not None:
-                self._query_details['limit'] = (item.stop - item.start) + 1
+                self._query_details['limit'] = item.stop - (item.start or 0)
             else:
                 self._query_details['limit'] = DEFAULT_LIMIT
         else:
@@ -177,7 +401,7 @@ class AbstractRepository(ffd.Repository[T]):
         self._load_data()
 
         if isinstance(item, slice):
-            return self._entities
+            return self._entities.to_list()
         elif len(self._entities) > 0:
             return self._entities[-1]
 
@@ -187,7 +411,7 @@ class AbstractRepository(ffd.Repository[T]):
         if 'criteria' not in query_details:
             query_details['criteria'] = None
 
-        results = self._do_filter(**query_details)
+        results = self._do_filter(**self._seek(query_details))
         if 'raw' in query_details and query_details['raw'] is True:
             return results
 
@@ -217,15 +441,22 @@ class AbstractRepository(ffd.Repository[T]):
         return f'RdbRepository[{self._entity_type}]'
 
     def _find_checked_out_entity(self, id_: str):
-        for entity in self._entities:
-            if entity.id_value() == id_:
-                return entity
+        return self._entities.get(id_)
 
     def reset(self):
         super().reset()
         self._query_details = {}
         self._state = 'empty'
 
+    def begin_transaction(self):
+        self._interface.begin()
+
+    def commit_transaction(self):
+        self._interface.commit()
+
+    def rollback_transaction(self):
+        self._interface.rollback()
+
     def migrate_schema(self):
         self._interface.create_schema(self._entity_type)
         self._interface.create_table(self._entity_type)
@@ -244,7 +475,8 @@ class AbstractRepository(ffd.Repository[T]):
             if ei not in table_indexes:
                 self._interface.create_index(self._entity_type, ei)
         for ti in table_indexes:
-            if ti not in entity_indexes:
+            # Indexes created from the index advisor's suggestions aren't declared on the entity.
+            if ti not in entity_indexes and not ti.name.startswith(ffi.ADVISED_INDEX_PREFIX):
                 self._interface.drop_index(self._entity_type, ti)
 
 
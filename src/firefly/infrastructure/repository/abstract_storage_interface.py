@@ -16,15 +16,18 @@ from __future__ import annotations
 
 import inspect
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import fields
 from datetime import datetime
-from typing import Type, get_type_hints, List, Union, Callable, Dict, Tuple, Any
+from typing import Type, get_type_hints, List, Union, Callable, Dict, Tuple, Any, Optional, Set
 
 import firefly.domain as ffd
 import inflection
 # noinspection PyDataclass
 from jinjasql import JinjaSql
 
+from .entity_mapper import EntityMapper
 from .rdb_repository import Index, Column
 
 
@@ -32,7 +35,13 @@ from .rdb_repository import Index, Column
 class AbstractStorageInterface(ffd.LoggerAware, ABC):
     _serializer: ffd.Serializer = None
     _registry: ffd.Registry = None
-    _cache: dict = {}
+    _mappers: dict = None
+    _relationship_batch_size = 500
+
+    def __init__(self, **kwargs):
+        # Ids of referenced aggregates known to exist, by type, for the current unit of work (or, outside of one, the
+        # write in progress).
+        self._references = ContextVar('known_references', default=None)
 
     def disconnect(self):
         self._disconnect()
@@ -40,9 +49,33 @@ class AbstractStorageInterface(ffd.LoggerAware, ABC):
     def _disconnect(self):
         pass
 
+    def begin(self):
+        self._begin()
+
+    def _begin(self):
+        pass
+
+    def commit(self):
+        self._references.set(None)
+        self._commit()
+
+    def _commit(self):
+        pass
+
+    def rollback(self):
+        self._references.set(None)
+        self._rollback()
+
+    def _rollback(self):
+        pass
+
+    def _in_unit_of_work(self) -> bool:
+        return False
+
     def add(self, entity: Union[ffd.Entity, List[ffd.Entity]]):
         self._check_prerequisites(entity.__class__)
-        return self._add(entity)
+        with self._checked_references(entity if isinstance(entity, list) else [entity]):
+            return self._add(entity)
 
     @abstractmethod
     def _add(self, entity: Union[ffd.Entity, List[ffd.Entity]]):
@@ -58,6 +91,70 @@ class AbstractStorageInterface(ffd.LoggerAware, ABC):
              sort: Tuple[Union[str, Tuple[str, bool]]] = None, raw: bool = False, count: bool = False):
         pass
 
+    def page(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None,
+             offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, raw: bool = False,
+             count: Union[bool, int] = True):
+        self._check_prerequisites(entity_type)
+        return self._page(entity_type, criteria, limit, offset, sort=sort, raw=raw, count=count)
+
+    def _page(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None,
+              offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, raw: bool = False,
+              count: Union[bool, int] = True):
+        entities = self._all(entity_type, criteria, limit, offset, sort=sort, raw=raw)
+        total = None
+        if count is True:
+            total = self._all(entity_type, criteria, count=True)
+        elif count is not False:
+            total = self._count_up_to(entity_type, criteria, int(count) + 1)
+
+        return entities, total
+
+    def _count_up_to(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp, n: int):
+        return min(self._all(entity_type, criteria, count=True), n)
+
+    def project(self, entity_type: Type[ffd.Entity], fields_: Tuple[str], criteria: ffd.BinaryOp = None,
+                limit: int = None, offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None) -> List[dict]:
+        self._check_prerequisites(entity_type)
+        self._check_fields(entity_type, fields_)
+
+        return self._project(entity_type, tuple(fields_), criteria, limit, offset, sort)
+
+    def _project(self, entity_type: Type[ffd.Entity], fields_: Tuple[str], criteria: ffd.BinaryOp = None,
+                 limit: int = None, offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None):
+        rows = self._all(entity_type, criteria, limit, offset, sort=sort, raw=True)
+        return [{name: row.get(name) for name in fields_} for row in rows]
+
+    def aggregate(self, entity_type: Type[ffd.Entity], functions: Dict[str, ffd.AggregateFunction],
+                  group_by: List[str] = None, criteria: ffd.BinaryOp = None) -> List[dict]:
+        self._check_prerequisites(entity_type)
+        for alias, function in functions.items():
+            if not isinstance(function, ffd.AggregateFunction):
+                raise ffd.InvalidArgument(f'{alias} is not an aggregate function')
+        group_by = list(group_by or [])
+        self._check_fields(entity_type, group_by + [f.field for f in functions.values() if f.field is not None])
+
+        return self._aggregate(entity_type, functions, group_by, criteria)
+
+    def _aggregate(self, entity_type: Type[ffd.Entity], functions: Dict[str, ffd.AggregateFunction],
+                   group_by: List[str], criteria: ffd.BinaryOp = None) -> List[dict]:
+        return ffd.evaluate_aggregates(self._all(entity_type, criteria, raw=True), functions, group_by)
+
+    @staticmethod
+    def _check_fields(entity_type: Type[ffd.Entity], names: List[str]):
+        fields_ = [f.name for f in fields(entity_type)]
+        for name in names:
+            if name not in fields_:
+                raise ffd.InvalidArgument(f'{entity_type.__name__} has no field {name}')
+
+    def stream(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None,
+               sort: Tuple[Union[str, Tuple[str, bool]]] = None, batch_size: int = 1000, raw: bool = False):
+        self._check_prerequisites(entity_type)
+        return self._stream(entity_type, criteria, sort=sort, batch_size=batch_size, raw=raw)
+
+    def _stream(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None,
+                sort: Tuple[Union[str, Tuple[str, bool]]] = None, batch_size: int = 1000, raw: bool = False):
+        return iter(self._all(entity_type, criteria, sort=sort, raw=raw))
+
     def find(self, uuid: str, entity_type: Type[ffd.Entity]):
         self._check_prerequisites(entity_type)
         return self._find(uuid, entity_type)
@@ -67,23 +164,74 @@ class AbstractStorageInterface(ffd.LoggerAware, ABC):
         pass
 
     def remove(self, entity: Union[ffd.Entity, List[ffd.Entity], Callable], force: bool = False):
-        self._check_prerequisites(entity.__class__)
-        deletions = []
-
         entities = entity
         if not isinstance(entity, list):
             entities = [entity]
+        if len(entities) == 0:
+            return
 
+        self._check_prerequisites(entities[0].__class__)
+        soft_deletions = []
+        deletions = []
         for entity in entities:
             if hasattr(entity, 'deleted_on') and not force:
-                entity.deleted_on = datetime.now()
-                self.update(entity)
+                soft_deletions.append(entity)
             else:
                 deletions.append(entity)
 
+        if len(soft_deletions) > 0:
+            now = datetime.now()
+            for entity in soft_deletions:
+                entity.deleted_on = now
+                if hasattr(entity, 'updated_on'):
+                    entity.updated_on = now
+            self._soft_remove(soft_deletions)
+
         if len(deletions) > 0:
             self._remove(deletions)
 
+    def _soft_remove(self, entities: List[ffd.Entity]):
+        for entity in entities:
+            self._update(entity)
+
+    def update_where(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp], values: dict) -> int:
+        self._check_prerequisites(entity_type)
+        self._check_fields(entity_type, list(values.keys()))
+        ids = entity_type.id_name() if isinstance(entity_type.id_name(), list) else [entity_type.id_name()]
+        for name in values.keys():
+            if name in ids:
+                raise ffd.InvalidArgument(f'{name} is an id and can not be updated')
+
+        values = dict(values)
+        if 'updated_on' in [f.name for f in fields(entity_type)] and 'updated_on' not in values:
+            values['updated_on'] = datetime.now()
+
+        return self._update_where(entity_type, criteria, values)
+
+    def _update_where(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp], values: dict) -> int:
+        entities = self._all(entity_type, criteria)
+        for entity in entities:
+            for k, v in values.items():
+                setattr(entity, k, v)
+
+        return len(entities) - len(self._update_many(entities)) if len(entities) > 0 else 0
+
+    def delete_where(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp, force: bool = False) -> int:
+        if criteria is None:
+            raise ffd.InvalidArgument('delete_where() needs criteria. Use clear() to remove everything.')
+        if 'deleted_on' in [f.name for f in fields(entity_type)] and not force:
+            return self.update_where(entity_type, criteria, {'deleted_on': datetime.now()})
+
+        self._check_prerequisites(entity_type)
+        return self._delete_where(entity_type, criteria)
+
+    def _delete_where(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp) -> int:
+        entities = self._all(entity_type, criteria)
+        if len(entities) > 0:
+            self._remove(entities)
+
+        return len(entities)
+
     @abstractmethod
     def _remove(self, entity: Union[ffd.Entity, List[ffd.Entity], Callable]):
         pass
@@ -97,12 +245,38 @@ class AbstractStorageInterface(ffd.LoggerAware, ABC):
         self._check_prerequisites(entity.__class__)
         if hasattr(entity, 'updated_on'):
             entity.updated_on = datetime.now()
-        return self._update(entity)
+        with self._checked_references([entity]):
+            return self._update(entity)
 
     @abstractmethod
     def _update(self, entity: ffd.Entity):
         pass
 
+    def update_many(self, entities: List[ffd.Entity]) -> List[str]:
+        """
+        Writes all of the given entities, returning the ids of any that lost the optimistic concurrency check. Entities
+        that were written have their version bumped.
+        """
+        if len(entities) == 0:
+            return []
+
+        self._check_prerequisites(entities[0].__class__)
+        now = datetime.now()
+        for entity in entities:
+            if hasattr(entity, 'updated_on'):
+                entity.updated_on = now
+
+        with self._checked_references(entities):
+            lost = self._update_many(entities)
+        for entity in entities:
+            if entity.id_value() not in lost and hasattr(entity, '__ff_version'):
+                setattr(entity, '__ff_version', getattr(entity, '__ff_version') + 1)
+
+        return lost
+
+    def _update_many(self, entities: List[ffd.Entity]) -> List[str]:
+        return [entity.id_value() for entity in entities if self._update(entity) == 0]
+
     @abstractmethod
     def _ensure_connected(self):
         pass
@@ -122,7 +296,23 @@ class AbstractStorageInterface(ffd.LoggerAware, ABC):
     def _build_entity(self, entity: Type[ffd.Entity], data, raw: bool = False):
         pass
 
+    def _get_mapper(self, entity: Type[ffd.Entity]) -> EntityMapper:
+        if self._mappers is None:
+            self._mappers = {}
+        if entity not in self._mappers:
+            self._mappers[entity] = self._build_mapper(entity)
+
+        return self._mappers[entity]
+
+    def _build_mapper(self, entity: Type[ffd.Entity]) -> EntityMapper:
+        return EntityMapper(
+            entity, self._find_relationships(entity), serializer=self._serializer, document=self._serialize_entity
+        )
+
     def _get_relationships(self, entity: Type[ffd.Entity]):
+        return self._get_mapper(entity).relationships
+
+    def _find_relationships(self, entity: Type[ffd.Entity]):
         relationships = {}
         annotations_ = get_type_hints(entity)
         for k, v in annotations_.items():
@@ -168,38 +358,64 @@ class AbstractStorageInterface(ffd.LoggerAware, ABC):
                 return v
 
     def _load_relationships(self, entity: Type[ffd.Entity], data: dict):
-        for k, v in self._get_relationships(entity).items():
-            if v['this_side'] == 'one':
-                if k in data and data[k] is not None:
-                    data[k] = self._registry(v['target']).find(data[k])
-            elif v['this_side'] == 'many':
-                data[k] = list(self._registry(v['target']).filter(
-                    lambda ee: getattr(ee, v['target'].id_name()).is_in(data[k])
-                ))
+        return self._load_relationships_batch(entity, [data])[0]
+
+    def _load_relationships_batch(self, entity: Type[ffd.Entity], documents: List[dict]):
+        """
+        Replaces the referenced ids in a page of documents with the aggregates they point to. Each target type is
+        fetched with "in" queries over the ids that aren't already checked out, rather than a query per reference.
+        """
+        relationships = self._get_relationships(entity)
+        if len(relationships) == 0:
+            return documents
+
+        ids = {}
+        for k, v in relationships.items():
+            wanted = ids.setdefault(v['target'], {})
+            for data in documents:
+                if v['this_side'] == 'one':
+                    if data.get(k) is not None:
+                        wanted[data[k]] = None
+                elif v['this_side'] == 'many':
+                    for id_ in data.get(k) or []:
+                        wanted[id_] = None
 
-        return data
+        loaded = {target: self._load_aggregates(target, list(wanted.keys())) for target, wanted in ids.items()}
+
+        for k, v in relationships.items():
+            aggregates = loaded[v['target']]
+            for data in documents:
+                if v['this_side'] == 'one':
+                    if data.get(k) is not None:
+                        data[k] = aggregates.get(data[k])
+                elif v['this_side'] == 'many':
+                    data[k] = [aggregates[id_] for id_ in data.get(k) or [] if id_ in aggregates]
+
+        return documents
+
+    def _load_aggregates(self, entity: Type[ffd.Entity], ids: list) -> dict:
+        # find_many() answers from the identity map where it can and merges what it loads, so aggregates that are
+        # already checked out, and possibly changed, are the ones that get referenced.
+        repository = self._registry(entity)
+        ret = {}
+        for batch in ffd.chunk(ids, self._relationship_batch_size):
+            for aggregate in repository.find_many(batch):
+                ret[aggregate.id_value()] = aggregate
+
+        return ret
 
     def _serialize_entity(self, entity: ffd.Entity, add_new: bool = False):
-        relationships = self._get_relationships(entity.__class__)
+        mapper = self._get_mapper(entity.__class__)
+        relationships = mapper.relationships
+        obj = mapper.to_dict(entity)
         if len(relationships.keys()) > 0:
-            obj = entity.to_dict(force_all=True, skip=list(relationships.keys()))
             for k, v in relationships.items():
                 if v['this_side'] == 'one':
                     try:
                         sub_entity = getattr(entity, k)
                         if sub_entity is not None:
                             if add_new:
-                                exists = self._cache_get(
-                                    f'aggregate_references.{sub_entity.__class__}.{sub_entity.id_value()}'
-                                )
-                                if exists is None:
-                                    e = self._registry(v['target']).find(sub_entity.id_value())
-                                    if e is not None:
-                                        self._cache_set(
-                                            f'aggregate_references.{sub_entity.__class__}.{sub_entity.id_value()}', True
-                                        )
-                                    else:
-                                        self._registry(v['target']).append(sub_entity)
+                                self._ensure_reference(v['target'], sub_entity)
                             obj[k] = sub_entity.id_value()
                     except AttributeError:
                         obj[k] = None
@@ -208,45 +424,57 @@ class AbstractStorageInterface(ffd.LoggerAware, ABC):
                     for f in getattr(entity, k):
                         try:
                             if add_new:
-                                exists = self._cache_get(f'aggregate_references.{f.__class__}.{f.id_value()}')
-                                if exists is None:
-                                    e = self._registry(v['target']).find(f.id_value())
-                                    if e is not None:
-                                        self._cache_set(
-                                            f'aggregate_references.{f.__class__}.{f.id_value()}', True
-                                        )
-                                    else:
-                                        self._registry(v['target']).append(f)
+                                self._ensure_reference(v['target'], f)
                             obj[k].append(f.id_value())
                         except AttributeError:
                             obj[k].append(None)
-        else:
-            obj = entity.to_dict(force_all=True)
 
         return self._serializer.serialize(obj)
 
-    def _cache_set(self, key: str, value: Any):
-        if not isinstance(self._cache, dict):
-            self._cache = {}
-
-        parts = key.split('.')
-        cache = self._cache
-        while len(parts) > 0:
-            p = parts.pop(0)
-            if p not in cache and len(parts) > 0:
-                cache[p] = {}
-                cache = cache[p]
-            elif len(parts) == 0:
-                cache[p] = value
-
-    def _cache_get(self, key: str):
-        parts = key.split('.')
-        cache = self._cache
-        while len(parts) > 0:
-            p = parts.pop(0)
-            if len(parts) > 0:
-                if not isinstance(cache, dict) or p not in cache:
-                    return None
-                cache = cache[p]
-            else:
-                return cache[p] if p in cache else None
+    @contextmanager
+    def _checked_references(self, entities: List[ffd.Entity]):
+        """
+        Checks that the aggregates referenced by a batch of entities being written exist, with one lookup per target
+        type, and appends any that don't to their repositories. Serializing the batch then finds them already known.
+        The ids are kept until the unit of work ends, or outside of one, until the outermost write finishes.
+        """
+        known = self._references.get()
+        token = self._references.set({}) if known is None else None
+        try:
+            self._check_references(entities, self._references.get())
+            yield
+        finally:
+            # commit() and rollback() drop the ids gathered during a unit of work.
+            if token is not None and not self._in_unit_of_work():
+                self._references.reset(token)
+
+    def _check_references(self, entities: List[ffd.Entity], known: Dict[Type[ffd.AggregateRoot], Set[str]]):
+        wanted = {}
+        for entity in entities:
+            for k, v in self._get_relationships(entity.__class__).items():
+                value = getattr(entity, k, None)
+                for reference in ([value] if v['this_side'] == 'one' else value or []):
+                    if isinstance(reference, ffd.AggregateRoot) and \
+                            reference.id_value() not in known.get(v['target'], ()):
+                        wanted.setdefault(v['target'], {})[reference.id_value()] = reference
+
+        for target, references in wanted.items():
+            repository = self._registry(target)
+            found = set()
+            for batch in ffd.chunk(list(references.keys()), self._relationship_batch_size):
+                found.update(repository.find_ids(batch))
+            for id_, reference in references.items():
+                if id_ not in found:
+                    repository.append(reference)
+            known.setdefault(target, set()).update(references.keys())
+
+    def _ensure_reference(self, target: Type[ffd.AggregateRoot], reference: ffd.AggregateRoot):
+        known = self._references.get()
+        if known is not None and reference.id_value() in known.get(target, ()):
+            return
+
+        repository = self._registry(target)
+        if repository.find(reference.id_value()) is None:
+            repository.append(reference)
+        if known is not None:
+            known.setdefault(target, set()).add(reference.id_value())
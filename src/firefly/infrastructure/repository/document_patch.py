@@ -0,0 +1,50 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import Any, List, Tuple
+
+Path = Tuple[Any, ...]
+
+
+def diff_documents(old: Any, new: Any, path: Path = ()) -> Tuple[List[Tuple[Path, Any]], List[Path]]:
+    """
+    Compares two deserialized documents and returns the values to set and the paths to remove to turn one into the
+    other. A path is a tuple of object keys and list indexes. Lists of the same length are compared item by item, any
+    other change to a list replaces it.
+    """
+    sets = []
+    removes = []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                removes.append(path + (key,))
+        for key, value in new.items():
+            if key not in old:
+                sets.append((path + (key,), value))
+            else:
+                s, r = diff_documents(old[key], value, path + (key,))
+                sets.extend(s)
+                removes.extend(r)
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        for i, (a, b) in enumerate(zip(old, new)):
+            s, r = diff_documents(a, b, path + (i,))
+            sets.extend(s)
+            removes.extend(r)
+    elif type(old) is not type(new) or old != new:
+        sets.append((path, new))
+
+    return sets, removes
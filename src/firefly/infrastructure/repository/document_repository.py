@@ -88,9 +88,11 @@ class DocumentRepository(AbstractRepository[T]):
         return self.copy()
 
     def _do_filter(self, criteria: Union[Callable, ffd.BinaryOp], limit: int = None, offset: int = None,
-                   raw: bool = False, sort: tuple = None) -> List[T]:
+                   raw: bool = False, sort: tuple = None, only: Tuple[str] = None) -> List[T]:
         if criteria is not None:
             criteria = self._get_search_criteria(criteria) if not isinstance(criteria, ffd.BinaryOp) else criteria
+        if only is not None:
+            return self._project(criteria, only, limit, offset, sort)
         if self._state == 'full':
             entities = list(filter(lambda e: criteria.matches(e), self._entities))
         else:
@@ -100,8 +102,9 @@ class DocumentRepository(AbstractRepository[T]):
 
             merged = []
             for entity in entities:
-                if entity in self._entities:
-                    merged.append(next(e for e in self._entities if e == entity))
+                checked_out = self._entities.get(entity.id_value()) if raw is False else None
+                if checked_out is not None:
+                    merged.append(checked_out)
                 else:
                     merged.append(entity)
                     if raw is False:
@@ -132,7 +135,7 @@ class DocumentRepository(AbstractRepository[T]):
     def copy(self):
         ret = self.__class__()
         ret._query_details = self._query_details.copy()
-        ret._entities = []
+        ret._entities = ffd.IdentityMap()
         ret._entity_hashes = {}
         ret._deletions = []
         ret._parent = self
@@ -141,7 +144,7 @@ class DocumentRepository(AbstractRepository[T]):
         entities = self._new_entities()
         self.reset()
         self._deletions = deletions
-        self._entities = entities
+        self._entities = ffd.IdentityMap(entities)
 
         return ret
 
@@ -153,6 +156,8 @@ class DocumentRepository(AbstractRepository[T]):
 
     def __len__(self):
         params = self._query_details.copy()
+        params.pop('after', None)
+        params.pop('only', None)
         if 'criteria' in params and not isinstance(params['criteria'], ffd.BinaryOp):
             params['criteria'] = self._get_search_criteria(params['criteria'])
         return self._interface.all(self._entity_type, count=True, **params)
@@ -162,7 +167,7 @@ class DocumentRepository(AbstractRepository[T]):
             if item.start is not None:
                 self._query_details['offset'] = item.start
             if item.stop is not None:
-                self._query_details['limit'] = (item.stop - item.start) + 1
+                self._query_details['limit'] = item.stop - (item.start or 0)
             else:
                 self._query_details['limit'] = DEFAULT_LIMIT
         else:
@@ -177,7 +182,7 @@ class DocumentRepository(AbstractRepository[T]):
         self._load_data()
 
         if isinstance(item, slice):
-            return self._entities
+            return self._entities.to_list()
         elif len(self._entities) > 0:
             return self._entities[-1]
 
@@ -187,7 +192,7 @@ class DocumentRepository(AbstractRepository[T]):
         if 'criteria' not in query_details:
             query_details['criteria'] = None
 
-        results = self._do_filter(**query_details)
+        results = self._do_filter(**self._seek(query_details))
         if 'raw' in query_details and query_details['raw'] is True:
             return results
 
@@ -217,9 +222,7 @@ class DocumentRepository(AbstractRepository[T]):
         return f'RdbRepository[{self._entity_type}]'
 
     def _find_checked_out_entity(self, id_: str):
-        for entity in self._entities:
-            if entity.id_value() == id_:
-                return entity
+        return self._entities.get(id_)
 
     def reset(self):
         super().reset()
@@ -26,9 +26,9 @@ from .abstract_storage_interface import AbstractStorageInterface
 class DocumentStorageInterface(AbstractStorageInterface, ABC):
     _serializer: ffd.Serializer = None
     _registry: ffd.Registry = None
-    _cache: dict = {}
 
     def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         self._tables_checked = []
 
     def disconnect(self):
@@ -0,0 +1,151 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import inspect
+from dataclasses import fields
+from typing import Type, List, Dict, Callable, Any, get_type_hints
+
+import firefly.domain as ffd
+
+from .rdb_repository import Column
+
+SKIP = object()
+
+
+def _skip(entity: ffd.Entity, add_new: bool):
+    return SKIP
+
+
+class EntityMapper:
+    """
+    How one aggregate type is persisted: its relationships, mapped columns and a reader for every field. It is worked
+    out once from the type hints and field metadata, so writing an entity is a loop over precomputed accessors.
+    """
+
+    def __init__(self, entity_type: Type[ffd.Entity], relationships: dict, columns: List[Column] = None,
+                 serializer: ffd.Serializer = None, document: Callable[[ffd.Entity, bool], str] = None):
+        self.entity_type = entity_type
+        self.relationships = relationships
+        self.columns = columns or []
+        self._serializer = serializer
+        self._document = document
+        self._types = get_type_hints(entity_type)
+
+        # Aggregates that override to_dict() keep control of their own serialization.
+        self._custom_to_dict = entity_type.to_dict is not ffd.ValueObject.to_dict
+        self._readers = [
+            (f.name, self._field_reader(f.name, self._types[f.name]))
+            for f in fields(entity_type) if not f.name.startswith('_') and f.name not in relationships
+        ]
+        self.writers = [(c.name, self._column_writer(c)) for c in self.columns]
+        # The columns data_fields() writes for every entity of the type, for callers that need them without serializing
+        # one. Columns with no field behind them, other than document and version, are only written when present.
+        names = {f.name for f in fields(entity_type)} | {'document', 'version'}
+        self.written_columns = tuple(name for name, write in self.writers if write is not _skip and name in names)
+
+    def to_dict(self, entity: ffd.Entity) -> dict:
+        """
+        The same as entity.to_dict(force_all=True, skip=<relationship fields>).
+        """
+        if self._custom_to_dict:
+            return entity.to_dict(force_all=True, skip=list(self.relationships.keys()))
+
+        return {name: read(entity) for name, read in self._readers}
+
+    def data_fields(self, entity: ffd.Entity, add_new: bool = False) -> Dict[str, Any]:
+        ret = {}
+        for name, write in self.writers:
+            value = write(entity, add_new)
+            if value is not SKIP:
+                ret[name] = value
+
+        return ret
+
+    @staticmethod
+    def _field_reader(name: str, type_) -> Callable[[ffd.Entity], Any]:
+        if inspect.isclass(type_) and issubclass(type_, ffd.ValueObject):
+            def read(entity):
+                value = getattr(entity, name)
+                return value.to_dict() if isinstance(value, ffd.ValueObject) else None
+            return read
+
+        if ffd.is_type_hint(type_):
+            origin = ffd.get_origin(type_)
+            args = ffd.get_args(type_)
+            if origin is List and ffd.can_be_type(args[0], ffd.ValueObject):
+                def read(entity):
+                    value = getattr(entity, name)
+                    if value is None:
+                        return None
+                    return [v.to_dict() if isinstance(v, ffd.ValueObject) else None for v in value]
+                return read
+            if origin is Dict and ffd.can_be_type(args[1], ffd.ValueObject):
+                def read(entity):
+                    value = getattr(entity, name)
+                    if value is None:
+                        return None
+                    return {k: v.to_dict() for k, v in value.items()}
+                return read
+
+        return lambda entity: getattr(entity, name)
+
+    def _column_writer(self, column: Column) -> Callable[[ffd.Entity, bool], Any]:
+        name = column.name
+        serialize = self._serializer.serialize if self._serializer is not None else None
+
+        if name == 'document':
+            def write(entity, add_new):
+                if hasattr(entity, 'document'):
+                    return serialize(entity.document)
+                return self._document(entity, add_new)
+            return write
+
+        if name == 'version':
+            return lambda entity, add_new: getattr(entity, '__ff_version', 1)
+
+        type_ = column.type
+        if inspect.isclass(type_) and issubclass(type_, ffd.AggregateRoot):
+            def write(entity, add_new):
+                try:
+                    return getattr(entity, name).id_value()
+                except AttributeError:
+                    if column.is_required:
+                        raise ffd.RepositoryError(f"{name} is a required field, but no value is present.")
+                    return None
+            return write
+
+        if ffd.is_type_hint(type_):
+            origin = ffd.get_origin(type_)
+            args = ffd.get_args(type_)
+            if origin is List:
+                if issubclass(args[0], ffd.AggregateRoot):
+                    return lambda entity, add_new: serialize([e.id_value() for e in getattr(entity, name)])
+                return lambda entity, add_new: serialize(getattr(entity, name))
+            if origin is Dict:
+                if issubclass(args[1], ffd.AggregateRoot):
+                    return lambda entity, add_new: {k: v.id_value() for k, v in getattr(entity, name).items()}
+                return lambda entity, add_new: serialize(getattr(entity, name))
+            return _skip
+
+        if type_ is list or type_ is dict:
+            return lambda entity, add_new: serialize(getattr(entity, name)) if hasattr(entity, name) else SKIP
+
+        def write(entity, add_new):
+            value = getattr(entity, name)
+            if isinstance(value, ffd.ValueObject):
+                return serialize(value)
+            return value
+        return write
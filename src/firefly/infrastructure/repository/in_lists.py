@@ -0,0 +1,74 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional
+
+import firefly.domain as ffd
+
+
+class IdTable(frozenset):
+    """
+    The values of an IN list that were written to a temporary table. Templates select from the table instead of
+    binding each value, while criteria evaluated in python still test membership against the values.
+    """
+    name: str = None
+
+    def __new__(cls, values: Iterable, name: str):
+        ret = super().__new__(cls, values)
+        ret.name = name
+        return ret
+
+
+def in_lists(criteria: Optional[ffd.BinaryOp], min_size: int = 0) -> List[ffd.BinaryOp]:
+    """
+    Every "in" comparison of an attribute to more than min_size values, not counting lists already in a table.
+    """
+    if not isinstance(criteria, ffd.BinaryOp):
+        return []
+
+    if criteria.op == 'in':
+        values = criteria.rhv
+        if isinstance(criteria.lhv, (ffd.Attr, ffd.AttributeString)) and not isinstance(values, (str, IdTable)) and \
+                isinstance(values, (list, tuple, set, frozenset)) and len(values) > min_size:
+            return [criteria]
+        return []
+
+    return in_lists(criteria.lhv, min_size) + in_lists(criteria.rhv, min_size)
+
+
+def replace_values(criteria: ffd.BinaryOp, values: Dict[int, Any]) -> ffd.BinaryOp:
+    """
+    A copy of the criteria with new values for the comparisons in values, which is keyed by id() of the comparison.
+    """
+    if not isinstance(criteria, ffd.BinaryOp):
+        return criteria
+
+    if id(criteria) in values:
+        return ffd.BinaryOp(criteria.lhv, criteria.op, values[id(criteria)])
+
+    return ffd.BinaryOp(replace_values(criteria.lhv, values), criteria.op, replace_values(criteria.rhv, values))
+
+
+def is_conjunct(criteria: ffd.BinaryOp, target: ffd.BinaryOp) -> bool:
+    """
+    Whether the target comparison is only ever and-ed with the rest of the criteria, in which case rows matching
+    different parts of its values are different rows.
+    """
+    if criteria is target:
+        return True
+
+    return isinstance(criteria, ffd.BinaryOp) and criteria.op == 'and' and \
+        (is_conjunct(criteria.lhv, target) or is_conjunct(criteria.rhv, target))
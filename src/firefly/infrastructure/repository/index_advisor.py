@@ -0,0 +1,84 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from typing import Callable, Iterable, Optional, Tuple, Union
+
+import firefly.domain as ffd
+
+ADVISED_INDEX_PREFIX = 'adv_'
+DEFAULT_MIN_USES = 10
+
+
+class IndexAdvisor:
+    """
+    Counts, per aggregate and field, how often criteria filter and sort on it, and how often those predicates could
+    not be pushed down to the database so the rows had to be filtered or sorted in python.
+    """
+
+    def __init__(self, attributes: Callable[[Optional[ffd.BinaryOp]], Iterable[str]] = None):
+        self._usage = {}
+        self._lock = threading.Lock()
+        self._attributes = attributes or self._criteria_attributes
+
+    def record(self, entity_type: type, criteria: Optional[ffd.BinaryOp], pruned: Optional[ffd.BinaryOp],
+               sort: Optional[Tuple[Union[str, Tuple[str, bool]]]] = None, sorted_fields: list = None):
+        filtered = Counter(self._attributes(criteria))
+        in_db = filtered if pruned is criteria else Counter(self._attributes(pruned))
+        in_python = filtered - in_db
+        sorted_fields = [str(s[0]) for s in sorted_fields or []]
+
+        with self._lock:
+            usage = self._usage.setdefault(entity_type.get_fqn(), {'queries': 0, 'in_python': 0, 'fields': {}})
+            usage['queries'] += 1
+            if in_python or len(sorted_fields) < len(sort or []):
+                usage['in_python'] += 1
+            for name in filtered:
+                self._field(usage, name)['filter'] += 1
+                if name in in_python:
+                    self._field(usage, name)['in_python'] += 1
+            for s in sort or []:
+                self._field(usage, str(s[0]))['sort'] += 1
+                if str(s[0]) not in sorted_fields:
+                    self._field(usage, str(s[0]))['in_python'] += 1
+
+    @staticmethod
+    def _criteria_attributes(criteria: Optional[ffd.BinaryOp]):
+        return [name for name, _ in criteria.attributes()] if criteria is not None else []
+
+    @staticmethod
+    def _field(usage: dict, name: str):
+        return usage['fields'].setdefault(name, {'filter': 0, 'sort': 0, 'in_python': 0})
+
+    def usage(self, entity_type: type = None) -> dict:
+        """
+        Usage keyed by aggregate fqn, or the usage of one aggregate.
+        """
+        with self._lock:
+            ret = {fqn: {
+                'queries': usage['queries'],
+                'in_python': usage['in_python'],
+                'fields': {name: counts.copy() for name, counts in usage['fields'].items()},
+            } for fqn, usage in self._usage.items()}
+
+        if entity_type is not None:
+            return ret.get(entity_type.get_fqn(), {'queries': 0, 'in_python': 0, 'fields': {}})
+        return ret
+
+    def clear(self):
+        with self._lock:
+            self._usage.clear()
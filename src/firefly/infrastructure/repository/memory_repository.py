@@ -15,11 +15,13 @@
 from __future__ import annotations
 
 from functools import reduce
-from typing import List, Callable, Optional, Union
+from typing import List, Callable, Optional, Union, Tuple
 
 import firefly.domain as ffd
 from firefly.domain.repository.repository import T
 
+from .sorting import sort_rows
+
 
 class MemoryRepository(ffd.Repository[T]):
     def __init__(self):
@@ -47,9 +49,30 @@ class MemoryRepository(ffd.Repository[T]):
                 raise ffd.NoResultFound()
             return results[0]
 
-    def filter(self, cb: Callable) -> List[T]:
+    def find_many(self, ids: List[str], **kwargs) -> List[T]:
+        entities = {e.id_value(): e for e in self.entities}
+        return [entities[id_] for id_ in ids if id_ in entities]
+
+    def filter(self, cb: Union[Callable, ffd.BinaryOp], **kwargs) -> MemoryRepository:
         criteria = self._get_search_criteria(cb)
-        return list(filter(lambda i: criteria.matches(i), self.entities))
+        return self._view(list(filter(lambda i: criteria.matches(i), self.entities)))
+
+    def sort(self, cb: Optional[Union[Callable, Tuple[Union[str, Tuple[str, bool]]]]] = None, **kwargs):
+        if cb is None and 'key' in kwargs:
+            return self._view(sorted(self.entities, **kwargs))
+
+        if not isinstance(cb, tuple):
+            cb = cb(ffd.EntityAttributeSpy(self._type()))
+            if not isinstance(cb, tuple):
+                cb = [(cb,)]
+
+        return self._view(sort_rows(self.entities, cb))
+
+    def clear(self):
+        self.entities = []
+
+    def destroy(self):
+        self.clear()
 
     def reduce(self, cb: Callable) -> Optional[T]:
         return reduce(cb, self.entities)
@@ -72,3 +95,10 @@ class MemoryRepository(ffd.Repository[T]):
 
     def commit(self):
         pass
+
+    def _view(self, entities: List[T]) -> MemoryRepository:
+        ret = self.__class__()
+        ret.entities = entities
+        ret._parent = self
+
+        return ret
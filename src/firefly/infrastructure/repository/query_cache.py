@@ -0,0 +1,267 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Tuple, Optional
+
+import firefly.domain as ffd
+from firefly.infrastructure.jinja2 import is_uuid
+
+from .in_lists import IdTable
+
+DEFAULT_QUERY_CACHE_SIZE = 1000
+
+
+class Uncacheable(Exception):
+    pass
+
+
+class Placeholder(str):
+    """
+    Stand-in for a bound value while probing a template. It renders like the value it replaces (a uuid for a uuid, an
+    opaque token for anything else), so the probe produces the same sql text as the real render.
+    """
+    slot: int = None
+
+    def __new__(cls, slot: int, looks_like_uuid: bool = False):
+        ret = super().__new__(cls, str(uuid.uuid4()) if looks_like_uuid else f'__ff_bind_{slot}__')
+        ret.slot = slot
+        return ret
+
+
+UNCACHEABLE = object()
+
+
+class QueryCache:
+    """
+    Caches rendered sql keyed by the *shape* of a query: entity type, template and every parameter that changes the sql
+    text. Values that are only bound as parameters are excluded from the key, so a repeated query only has to bind the
+    new values.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._attributes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, entity: type, template: str, params: dict, render: Callable[[dict], Tuple[str, dict]]):
+        if self.max_size <= 0:
+            return render(params)
+
+        try:
+            leaves = []
+            key = (entity, template, self._shape(params, leaves))
+        except Uncacheable:
+            return render(params)
+
+        entry = self._get(key)
+        if entry is UNCACHEABLE:
+            return render(params)
+        if entry is not None:
+            sql, bindings = entry
+            return sql, {name: leaves[slot] if slot is not None else value for name, slot, value in bindings}
+
+        sql, bound = render(params)
+        self._set(key, self._compile(sql, bound, params, leaves, render))
+
+        return sql, bound
+
+    def attributes(self, criteria: Optional[ffd.BinaryOp]) -> Tuple[str, ...]:
+        """
+        The fields criteria compare, one per comparison. They only depend on the shape of the criteria, so they are
+        kept by shape rather than walking every query's criteria again.
+        """
+        if criteria is None:
+            return ()
+        if self.max_size <= 0:
+            return tuple(name for name, _ in criteria.attributes())
+
+        try:
+            key = self._criteria_shape(criteria, [])
+        except Uncacheable:
+            return tuple(name for name, _ in criteria.attributes())
+
+        with self._lock:
+            ret = self._attributes.get(key)
+            if ret is not None:
+                self._attributes.move_to_end(key)
+                return ret
+
+        ret = tuple(name for name, _ in criteria.attributes())
+        with self._lock:
+            self._attributes[key] = ret
+            while len(self._attributes) > self.max_size:
+                self._attributes.popitem(last=False)
+
+        return ret
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._attributes.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                entry = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _compile(self, sql: str, bound: dict, params: dict, leaves: list, render: Callable):
+        """
+        Render the template a second time with placeholders in place of the bound values, and record which value ends up
+        in which sql parameter. If the template did anything with a value beyond binding it, the texts won't match and
+        the shape is marked as uncacheable.
+        """
+        try:
+            probe_sql, probe_bound = render(self._substitute(params, leaves))
+        except Exception:
+            return UNCACHEABLE
+
+        if probe_sql != sql or list(probe_bound.keys()) != list(bound.keys()):
+            return UNCACHEABLE
+
+        bindings = []
+        for name, value in probe_bound.items():
+            if isinstance(value, Placeholder):
+                bindings.append((name, value.slot, None))
+            elif value == bound[name]:
+                bindings.append((name, None, value))
+            else:
+                return UNCACHEABLE
+
+        return sql, tuple(bindings)
+
+    def _shape(self, params: dict, leaves: list):
+        ret = []
+        for k, v in params.items():
+            if k == 'criteria':
+                ret.append((k, self._criteria_shape(v, leaves)))
+            elif k == 'data':
+                ret.append((k, self._data_shape(v, leaves)))
+            elif k in ('limit', 'offset') and v:
+                ret.append((k, self._leaf(v, leaves)))
+            else:
+                ret.append((k, self._freeze(v)))
+        return tuple(ret)
+
+    def _criteria_shape(self, c, leaves: list, is_operand: bool = False):
+        if isinstance(c, ffd.BinaryOp):
+            if c.op == '==' and bool(c.lhv == 1) and bool(c.rhv == 1):
+                return 'true'
+            lhv = self._criteria_shape(c.lhv, leaves, True)
+            if c.op == 'is':
+                rhv = self._freeze(c.rhv)
+            else:
+                rhv = self._criteria_shape(c.rhv, leaves, True)
+            return lhv, c.op, rhv
+        if not is_operand:
+            return self._freeze(c)
+        if isinstance(c, (ffd.Attr, ffd.AttributeString)):
+            return 'a', repr(c)
+        if isinstance(c, IdTable):
+            return 't', c.name
+        if isinstance(c, (list, tuple, set, frozenset)):
+            return 'i', tuple(self._leaf(i, leaves) for i in c)
+        if isinstance(c, (dict, bytes)):
+            raise Uncacheable()
+        return self._leaf(c, leaves)
+
+    def _data_shape(self, data, leaves: list):
+        if isinstance(data, dict):
+            return tuple((k, self._leaf(v, leaves)) for k, v in data.items())
+        if isinstance(data, (list, tuple)):
+            return tuple(self._data_shape(row, leaves) for row in data)
+        raise Uncacheable()
+
+    def _substitute(self, params: dict, leaves: list):
+        counter = iter(range(len(leaves)))
+
+        def placeholder():
+            slot = next(counter)
+            value = leaves[slot]
+            return Placeholder(slot, isinstance(value, str) and len(value) == 36 and is_uuid(value))
+
+        def criteria(c, is_operand: bool = False):
+            if isinstance(c, ffd.BinaryOp):
+                if c.op == '==' and bool(c.lhv == 1) and bool(c.rhv == 1):
+                    return c
+                return ffd.BinaryOp(criteria(c.lhv, True), c.op, c.rhv if c.op == 'is' else criteria(c.rhv, True))
+            if not is_operand or isinstance(c, (ffd.Attr, ffd.AttributeString, IdTable)):
+                return c
+            if isinstance(c, (list, tuple, set, frozenset)):
+                return [placeholder() for _ in c]
+            return placeholder()
+
+        def data(d):
+            if isinstance(d, dict):
+                return {k: placeholder() for k in d.keys()}
+            return [data(row) for row in d]
+
+        ret = {}
+        for k, v in params.items():
+            if k == 'criteria':
+                ret[k] = criteria(v)
+            elif k == 'data':
+                ret[k] = data(v)
+            elif k in ('limit', 'offset') and v:
+                ret[k] = placeholder()
+            else:
+                ret[k] = v
+        return ret
+
+    @staticmethod
+    def _leaf(value, leaves: list):
+        leaves.append(value)
+        if isinstance(value, str):
+            return str, len(value) == 36 and is_uuid(value)
+        return value.__class__
+
+    def _freeze(self, value):
+        if value is None or isinstance(value, (str, int, float, bool, type)):
+            return value
+        if isinstance(value, (ffd.Attr, ffd.AttributeString)):
+            return 'a', repr(value)
+        if isinstance(value, (list, tuple)):
+            return tuple(self._freeze(v) for v in value)
+        if isinstance(value, dict):
+            return tuple((k, self._freeze(v)) for k, v in value.items())
+        raise Uncacheable()
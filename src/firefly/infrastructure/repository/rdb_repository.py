@@ -96,9 +96,11 @@ class RdbRepository(AbstractRepository[T]):
         return self.copy()
 
     def _do_filter(self, criteria: Union[Callable, ffd.BinaryOp], limit: int = None, offset: int = None,
-                   raw: bool = False, sort: tuple = None) -> List[T]:
+                   raw: bool = False, sort: tuple = None, only: Tuple[str] = None) -> List[T]:
         if criteria is not None:
             criteria = self._get_search_criteria(criteria) if not isinstance(criteria, ffd.BinaryOp) else criteria
+        if only is not None:
+            return self._project(criteria, only, limit, offset, sort)
         if self._state == 'full':
             entities = list(filter(lambda e: criteria.matches(e), self._entities))
         else:
@@ -108,8 +110,9 @@ class RdbRepository(AbstractRepository[T]):
 
             merged = []
             for entity in entities:
-                if entity in self._entities:
-                    merged.append(next(e for e in self._entities if e == entity))
+                checked_out = self._entities.get(entity.id_value()) if raw is False else None
+                if checked_out is not None:
+                    merged.append(checked_out)
                 else:
                     merged.append(entity)
                     if raw is False:
@@ -133,14 +136,17 @@ class RdbRepository(AbstractRepository[T]):
 
     def clear(self):
         self._interface.clear(self._entity_type)
+        # Nothing that was checked out exists anymore.
+        self.reset()
 
     def destroy(self):
         self._interface.destroy(self._entity_type)
+        self.reset()
 
     def copy(self):
         ret = self.__class__()
         ret._query_details = self._query_details.copy()
-        ret._entities = []
+        ret._entities = ffd.IdentityMap()
         ret._entity_hashes = {}
         ret._deletions = []
         ret._parent = self
@@ -149,7 +155,7 @@ class RdbRepository(AbstractRepository[T]):
         entities = self._new_entities()
         self.reset()
         self._deletions = deletions
-        self._entities = entities
+        self._entities = ffd.IdentityMap(entities)
 
         return ret
 
@@ -161,6 +167,8 @@ class RdbRepository(AbstractRepository[T]):
 
     def __len__(self):
         params = self._query_details.copy()
+        params.pop('after', None)
+        params.pop('only', None)
         if 'criteria' in params and not isinstance(params['criteria'], ffd.BinaryOp):
             params['criteria'] = self._get_search_criteria(params['criteria'])
         return self._interface.all(self._entity_type, count=True, **params)
@@ -170,7 +178,7 @@ class RdbRepository(AbstractRepository[T]):
             if item.start is not None:
                 self._query_details['offset'] = item.start
             if item.stop is not None:
-                self._query_details['limit'] = (item.stop - item.start) + 1
+                self._query_details['limit'] = item.stop - (item.start or 0)
             else:
                 self._query_details['limit'] = DEFAULT_LIMIT
         else:
@@ -185,7 +193,7 @@ class RdbRepository(AbstractRepository[T]):
         self._load_data()
 
         if isinstance(item, slice):
-            return self._entities
+            return self._entities.to_list()
         elif len(self._entities) > 0:
             return self._entities[-1]
 
@@ -195,7 +203,7 @@ class RdbRepository(AbstractRepository[T]):
         if 'criteria' not in query_details:
             query_details['criteria'] = None
 
-        results = self._do_filter(**query_details)
+        results = self._do_filter(**self._seek(query_details))
         if 'raw' in query_details and query_details['raw'] is True:
             return results
 
@@ -212,35 +220,46 @@ class RdbRepository(AbstractRepository[T]):
             self._interface.remove(self._deletions, force=force_delete)
 
         new_entities = self._new_entities()
+        changed_entities = self._changed_entities()
         if len(new_entities) > 0:
             self.debug('Adding %s', new_entities)
-            for batch in ffd.chunk(new_entities, 250):
-                if self._interface.add(batch) != len(batch):
-                    raise ffd.ConcurrentUpdateDetected()
-
-        for entity in self._changed_entities():
-            self.debug('Updating %s', entity)
-            if self._interface.update(entity) == 0:
+            if self._interface.add(new_entities) != len(new_entities):
                 raise ffd.ConcurrentUpdateDetected()
+            for entity in new_entities:
+                setattr(entity, '__ff_version', 1)
+                self._entity_hashes[entity.id_value()] = self._get_hash(entity)
+
+        if len(changed_entities) > 0:
+            self.debug('Updating %s', changed_entities)
+            lost = self._interface.update_many(changed_entities)
+            for entity in changed_entities:
+                if entity.id_value() not in lost:
+                    self._entity_hashes[entity.id_value()] = self._get_hash(entity)
+            if len(lost) > 0:
+                raise ffd.ConcurrentUpdateDetected(f'Version check failed for {lost}', ids=lost)
         self.debug('Done in commit()')
 
     def __repr__(self):
         return f'RdbRepository[{self._entity_type}]'
 
     def _find_checked_out_entity(self, x: Union[str, ffd.BinaryOp]):
+        if isinstance(x, str):
+            return self._entities.get(x)
+
         for entity in self._entities:
-            if isinstance(x, str) and entity.id_value() == x:
-                return entity
-            elif isinstance(x, ffd.BinaryOp) and x.matches(entity):
+            if isinstance(x, ffd.BinaryOp) and x.matches(entity):
                 return entity
 
     def reset(self):
         super().reset()
         self._query_details = {}
         self._state = 'empty'
-        self._interface._cache = {}
 
-    def migrate_schema(self):
+    def migrate_schema(self, force: bool = False) -> bool:
+        fingerprint = self._interface.schema_fingerprint(self._entity_type)
+        if not force and self._interface.get_schema_fingerprint(self._entity_type) == fingerprint:
+            return False
+
         self._interface.create_functions()
         self._interface.create_schema(self._entity_type)
         self._interface.create_table(self._entity_type)
@@ -259,9 +278,13 @@ class RdbRepository(AbstractRepository[T]):
             if ei not in table_indexes:
                 self._interface.create_index(self._entity_type, ei)
         for ti in table_indexes:
-            if ti not in entity_indexes:
+            # Indexes created from the index advisor's suggestions aren't declared on the entity.
+            if ti not in entity_indexes and not ti.name.startswith(ffi.ADVISED_INDEX_PREFIX):
                 self._interface.drop_index(self._entity_type, ti)
 
+        self._interface.set_schema_fingerprint(self._entity_type, fingerprint)
+        return True
+
 
 class Index(ffd.ValueObject):
     name: str = ffd.optional()
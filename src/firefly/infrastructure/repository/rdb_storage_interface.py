@@ -14,11 +14,16 @@
 
 from __future__ import annotations
 
+import hashlib
 import inspect
+import json
+import threading
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from dataclasses import fields
 from pprint import pprint
-from typing import Type, get_type_hints, List, Union, Callable, Dict, Tuple
+from typing import Type, get_type_hints, List, Union, Callable, Dict, Tuple, Optional
 
 import firefly.domain as ffd
 import inflection
@@ -27,6 +32,11 @@ import jinja2
 from jinjasql import JinjaSql
 
 from .abstract_storage_interface import AbstractStorageInterface
+from .entity_mapper import EntityMapper
+from .in_lists import IdTable, in_lists, replace_values
+from .index_advisor import IndexAdvisor, ADVISED_INDEX_PREFIX, DEFAULT_MIN_USES
+from .query_cache import QueryCache, DEFAULT_QUERY_CACHE_SIZE
+from .statement_profiler import StatementProfiler, DEFAULT_SLOW_QUERY_MS, DEFAULT_PROFILER_SAMPLES
 from .rdb_repository import Index, Column
 
 
@@ -35,35 +45,161 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
     _serializer: ffd.Serializer = None
     _registry: ffd.Registry = None
     _j: JinjaSql = None
-    _cache: dict = {}
     _sql_prefix = 'sql'
     _map_indexes = False
     _map_all = False
     _identifier_quote_char = '"'
+    _cacheable_templates = ('select.sql', 'insert.sql', 'update.sql', 'delete.sql')
+    _insert_batch_size = 250
+    _delete_batch_size = 500
+    _window_functions = True
+    _schema_table = '__ff_schema'
+    # IN lists up to this size are bound inline. Larger ones are split into queries of this many values, up to
+    # _in_list_table_size, past which the values are written to a temporary table that the query selects from.
+    _in_list_chunk_size = 500
+    _in_list_table_size = 5000
+    _id_table_prefix = '__ff_ids_'
 
     def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         self._tables_checked = []
+        self._query_cache = QueryCache(int(kwargs.get('query_cache_size', DEFAULT_QUERY_CACHE_SIZE)))
+        self._in_list_chunk_size = int(kwargs.get('in_list_chunk_size', self._in_list_chunk_size))
+        self._in_list_table_size = int(kwargs.get('in_list_table_size', self._in_list_table_size))
+        slow_query_ms = kwargs.get('slow_query_ms', DEFAULT_SLOW_QUERY_MS)
+        self._profiler = StatementProfiler(
+            slow_query_threshold=float(slow_query_ms) / 1000 if slow_query_ms is not None else None,
+            max_samples=int(kwargs.get('profiler_samples', DEFAULT_PROFILER_SAMPLES)),
+        )
+        self._profile_file = kwargs.get('profile_file')
+        self._index_advisor = IndexAdvisor(attributes=self._query_cache.attributes)
+        self._schema_fingerprints = None
+        self._id_tables_in_use = threading.local()
+
+    @property
+    def query_cache(self) -> QueryCache:
+        return self._query_cache
+
+    @property
+    def profiler(self) -> StatementProfiler:
+        return self._profiler
+
+    @property
+    def index_advisor(self) -> IndexAdvisor:
+        return self._index_advisor
+
+    def disconnect(self):
+        super().disconnect()
+        if self._profile_file is not None:
+            self._profiler.save(self._profile_file, index_usage=self._index_advisor.usage())
+
+    @contextmanager
+    def _profile(self, sql: str, params: dict = None):
+        # Statements that fail, after waiting out a lock for instance, are recorded too.
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(sql, params, time.perf_counter() - start)
+
+    @contextmanager
+    def _session(self):
+        """
+        Keeps every statement issued inside it on one connection, for state such as temporary tables that only that
+        connection can see.
+        """
+        yield
+
+    def _in_list_inline_size(self) -> int:
+        return min(self._in_list_chunk_size, self._max_ids_per_statement())
+
+    def _in_list_strategy(self, size: int) -> str:
+        if size <= self._in_list_inline_size():
+            return 'inline'
+        if size <= self._in_list_table_size:
+            return 'chunk'
+        return 'table'
+
+    @contextmanager
+    def _id_tables(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp], max_inline: int):
+        """
+        Writes the values of every IN list longer than max_inline to a temporary table and yields the criteria with
+        those lists replaced by the tables. The tables are dropped on exit.
+        """
+        targets = in_lists(criteria, max_inline)
+        if len(targets) == 0:
+            yield criteria
+            return
+
+        in_use = getattr(self._id_tables_in_use, 'names', None)
+        if in_use is None:
+            in_use = self._id_tables_in_use.names = set()
+        names = []
+        tables = {}
+        with self._session():
+            try:
+                for target in targets:
+                    n = 0
+                    while f'{self._id_table_prefix}{n}' in in_use:
+                        n += 1
+                    name = f'{self._id_table_prefix}{n}'
+                    in_use.add(name)
+                    names.append(name)
+                    self._create_id_table(entity_type, name, list(dict.fromkeys(target.rhv)))
+                    tables[id(target)] = IdTable(target.rhv, name)
+                yield replace_values(criteria, tables)
+            finally:
+                for name in names:
+                    self._execute(*self._generate_query(
+                        entity_type, f'{self._sql_prefix}/drop_id_table.sql', {'name': name}
+                    ))
+                    in_use.discard(name)
+
+    def _create_id_table(self, entity_type: Type[ffd.Entity], name: str, values: list):
+        self._execute(*self._generate_query(
+            entity_type, f'{self._sql_prefix}/drop_id_table.sql', {'name': name}
+        ))
+        self._execute(*self._generate_query(
+            entity_type, f'{self._sql_prefix}/create_id_table.sql', {'name': name}
+        ))
+        for batch in ffd.chunk(values, self._max_ids_per_statement()):
+            self._execute(*self._generate_query(
+                entity_type, f'{self._sql_prefix}/insert_ids.sql', {'name': name, 'values': batch}
+            ))
+
+    def _record(self, sql: str, params, duration: float):
+        if self._profiler.record(sql, duration):
+            self.warning('Slow query (%.1f ms): %s', duration * 1000, sql)
+            self._profiler.log_slow_query(sql, params, duration, self._explain(sql, params))
+
+    def _explain(self, sql: str, params: dict = None) -> Optional[List[str]]:
+        return None
 
     def _add(self, entity: Union[ffd.Entity, List[ffd.Entity]]):
         entities = entity
         if not isinstance(entity, list):
             entities = [entity]
 
-        data = []
-        for e in entities:
-            data.append(self._data_fields(e, add_new=True))
-        return self._execute(*self._generate_query(
-            entity,
-            f'{self._sql_prefix}/insert.sql',
-            {'data': data}
-        ))
+        ret = 0
+        for batch in ffd.chunk(entities, self._insert_batch_size):
+            data = []
+            for e in batch:
+                data.append(self._data_fields(e, add_new=True))
+            ret += self._execute(*self._generate_query(
+                batch,
+                f'{self._sql_prefix}/insert.sql',
+                {'data': data}
+            ))
+
+        return ret
 
     def _generate_select(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None,
-                         offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, count: bool = False):
+                         offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, count: bool = False,
+                         total: bool = False, columns: List[str] = None):
         indexes = [f.name for f in fields(entity_type)
                    if f.metadata.get('index') is True or f.metadata.get('id') is True]
         data = {
-                'columns': self._select_list(entity_type),
+                'columns': columns or self._select_list(entity_type),
                 'count': count,
             }
         if criteria is not None:
@@ -82,27 +218,116 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
         if offset is not None:
             data['offset'] = offset
 
+        if total:
+            data['total'] = True
+
+        self._index_advisor.record(entity_type, criteria, criteria, sort, data.get('sort'))
         data['relationships'] = self._get_relationships(entity_type)
 
         return self._generate_query(entity_type, f'{self._sql_prefix}/select.sql', data)
 
     def _all(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None, offset: int = None,
              sort: Tuple[Union[str, Tuple[str, bool]]] = None, raw: bool = False, count: bool = False):
-        self._cache = {}
         sql, params = self._generate_select(
             entity_type, criteria, limit=limit, offset=offset, sort=sort, count=count
         )
         results = self._execute(sql, params)
 
-        ret = []
         if count:
             return results[0]['c']
 
-        for row in results:
-            self.debug('Result row: %s', dict(row))
-            ret.append(self._build_entity(entity_type, row, raw=raw))
+        return self._build_entities(entity_type, results, raw=raw)
 
-        return ret
+    def _page(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None,
+              offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, raw: bool = False,
+              count: Union[bool, int] = True):
+        if count is not True or not self._window_functions:
+            return super()._page(entity_type, criteria, limit, offset, sort=sort, raw=raw, count=count)
+
+        sql, params = self._generate_select(entity_type, criteria, limit=limit, offset=offset, sort=sort, total=True)
+        return self._counted_page(entity_type, sql, params, criteria, offset, raw)
+
+    def _counted_page(self, entity_type: Type[ffd.Entity], sql: str, params: dict, criteria: ffd.BinaryOp,
+                      offset: int, raw: bool):
+        rows = self._execute(sql, params)
+        if len(rows) == 0:
+            # An offset past the last match leaves no row to read the total from.
+            return [], self._all(entity_type, criteria, count=True) if offset else 0
+
+        total = rows[0]['__ff_total']
+        if self._map_all:
+            rows = [{k: v for k, v in dict(row).items() if k != '__ff_total'} for row in rows]
+
+        return self._build_entities(entity_type, rows, raw=raw), total
+
+    def _count_up_to(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp, n: int):
+        # The limit goes on a subquery, so the database stops after n matches and still returns a single number.
+        return self._execute(*self._generate_query(entity_type, f'{self._sql_prefix}/select.sql', {
+            'columns': ['1 as __ff_match'],
+            'criteria': criteria,
+            'count': False,
+            'limit': n,
+            'count_up_to': True,
+        }))[0]['c']
+
+    def _project(self, entity_type: Type[ffd.Entity], fields_: Tuple[str], criteria: ffd.BinaryOp = None,
+                 limit: int = None, offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None):
+        columns = [self._projection_column(entity_type, name) for name in fields_]
+        if None in columns:
+            return super()._project(entity_type, fields_, criteria, limit, offset, sort)
+
+        sql, params = self._generate_select(entity_type, criteria, limit, offset, sort, columns=columns)
+        return self._projected_rows(entity_type, fields_, self._execute(sql, params))
+
+    def _aggregate(self, entity_type: Type[ffd.Entity], functions: Dict[str, ffd.AggregateFunction],
+                   group_by: List[str], criteria: ffd.BinaryOp = None) -> List[dict]:
+        names = group_by + [f.field for f in functions.values() if f.field is not None]
+        expressions = {name: self._field_expression(entity_type, name) for name in names}
+        if None in expressions.values() or not self._pushed_down(entity_type, criteria, None):
+            return super()._aggregate(entity_type, functions, group_by, criteria)
+
+        q = self._identifier_quote_char
+        columns = [f'{expressions[name]} as {q}{name}{q}' for name in group_by]
+        for alias, f in functions.items():
+            columns.append(f'{f.sql}({1 if f.field is None else expressions[f.field]}) as {q}{alias}{q}')
+
+        with self._id_tables(entity_type, criteria, self._in_list_inline_size()) as criteria:
+            rows = self._execute(*self._generate_query(entity_type, f'{self._sql_prefix}/select.sql', {
+                'columns': columns,
+                'criteria': criteria,
+                'count': False,
+                'group_by': [expressions[name] for name in group_by],
+            }))
+
+        return [{name: row[name] for name in group_by + list(functions.keys())} for row in rows]
+
+    def _pushed_down(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp],
+                     sort: Optional[Tuple[Union[str, Tuple[str, bool]]]]) -> bool:
+        return True
+
+    def _projection_column(self, entity_type: Type[ffd.Entity], name: str) -> Optional[str]:
+        """
+        The select list entry that reads a field without loading the document, or None if there isn't one.
+        """
+        expression = self._field_expression(entity_type, name)
+        if expression is not None:
+            return f'{expression} as {self._identifier_quote_char}{name}{self._identifier_quote_char}'
+
+    def _field_expression(self, entity_type: Type[ffd.Entity], name: str) -> Optional[str]:
+        if name in [c.name for c in self._get_mapper(entity_type).columns]:
+            return f'{self._identifier_quote_char}{name}{self._identifier_quote_char}'
+
+    def _projected_rows(self, entity_type: Type[ffd.Entity], fields_: Tuple[str], rows: list) -> List[dict]:
+        return [{name: row[name] for name in fields_} for row in rows]
+
+    def _stream(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None,
+                sort: Tuple[Union[str, Tuple[str, bool]]] = None, batch_size: int = 1000, raw: bool = False):
+        sql, params = self._generate_select(entity_type, criteria, sort=sort)
+        for rows in self._fetch_batches(sql, params, batch_size):
+            yield from self._build_entities(entity_type, rows, raw=raw)
+
+    def _fetch_batches(self, sql: str, params: dict, batch_size: int):
+        yield self._execute(sql, params)
 
     def _find(self, uuid: str, entity_type: Type[ffd.Entity]):
         results = self._execute(*self._generate_query(
@@ -124,38 +349,104 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
         return self._build_entity(entity_type, results[0])
 
     def _remove(self, entity: Union[ffd.Entity, List[ffd.Entity], Callable]):
-        criteria = entity
-        relationships = {}
-        if isinstance(entity, list):
-            criteria = ffd.Attr(entity[0].id_name()).is_in([e.id_value() for e in entity])
-            relationships = self._get_relationships(entity[0].__class__)
-        elif not isinstance(entity, ffd.BinaryOp):
-            criteria = ffd.Attr(entity.id_name()) == entity.id_value()
-            relationships = self._get_relationships(entity.__class__)
-
-        entities = entity
-        if not isinstance(entity, ffd.BinaryOp):
-            if not isinstance(entity, list):
-                entities = [entity]
+        if isinstance(entity, ffd.BinaryOp):
+            return self._execute(*self._generate_query(entity, f'{self._sql_prefix}/delete.sql', {
+                'criteria': entity
+            }))
+
+        entities = entity if isinstance(entity, list) else [entity]
+        entity_type = entities[0].__class__
+        self._remove_cascades(entity_type, entities)
+
+        for batch in ffd.chunk(entities, self._max_ids_per_statement()):
+            self._execute(*self._generate_query(entity_type, f'{self._sql_prefix}/delete.sql', {
+                'criteria': ffd.Attr(entity_type.id_name()).is_in([e.id_value() for e in batch])
+            }))
+
+    def _remove_cascades(self, entity_type: Type[ffd.Entity], entities: List[ffd.Entity]):
+        """
+        Removes the aggregates that the given entities reference through on_delete='cascade' relationships, with one
+        remove and commit per target type.
+        """
+        cascades = {}
+        for k, v in self._cascades(entity_type).items():
+            targets = cascades.setdefault(v['target'], {})
             for e in entities:
-                for k, v in relationships.items():
-                    if v['this_side'] == 'one':
-                        sub_entity = getattr(e, k)
-                        if sub_entity is not None and \
-                                self._get_field_definition(e.__class__, k).metadata.get('on_delete') == 'cascade':
-                            self._registry(v['target']).remove(sub_entity)
-                            self._registry(v['target']).commit()
-                    elif v['this_side'] == 'many':
-                        for sub_entity in getattr(e, k):
-                            if sub_entity is not None and \
-                                    self._get_field_definition(e.__class__, k)\
-                                    .metadata.get('on_delete') == 'cascade':
-                                self._registry(v['target']).remove(sub_entity)
-                                self._registry(v['target']).commit()
-
-        self._execute(*self._generate_query(entity, f'{self._sql_prefix}/delete.sql', {
-            'criteria': criteria
-        }))
+                sub_entities = [getattr(e, k)] if v['this_side'] == 'one' else getattr(e, k)
+                for sub_entity in sub_entities or []:
+                    if sub_entity is not None:
+                        targets[sub_entity.id_value()] = sub_entity
+
+        for target, sub_entities in cascades.items():
+            if len(sub_entities) > 0:
+                self._registry(target).remove(list(sub_entities.values()))
+                self._registry(target).commit()
+
+    def _cascades(self, entity_type: Type[ffd.Entity]) -> dict:
+        return {
+            k: v for k, v in self._get_relationships(entity_type).items()
+            if self._get_field_definition(entity_type, k).metadata.get('on_delete') == 'cascade'
+        }
+
+    def _soft_remove(self, entities: List[ffd.Entity]):
+        entity_type = entities[0].__class__
+        if not self._update_in_sql() or isinstance(entity_type.id_name(), list):
+            return super()._soft_remove(entities)
+
+        values = {'deleted_on': entities[0].deleted_on}
+        if hasattr(entities[0], 'updated_on'):
+            values['updated_on'] = entities[0].updated_on
+        # Versioned entities keep the version check that _update() applies, so they are written a version at a time.
+        by_version = {}
+        for entity in entities:
+            by_version.setdefault(getattr(entity, '__ff_version', None), []).append(entity)
+
+        for version, group in by_version.items():
+            for batch in ffd.chunk(group, self._max_ids_per_statement()):
+                criteria = ffd.Attr(entity_type.id_name()).is_in([e.id_value() for e in batch])
+                if version is None:
+                    self._set_where(entity_type, criteria, values)
+                    continue
+
+                if self._set_where(entity_type, criteria & (ffd.Attr('version') == version), values) < len(batch):
+                    raise ffd.ConcurrentUpdateDetected(f'Version check failed soft deleting {entity_type.__name__}')
+                for entity in batch:
+                    setattr(entity, '__ff_version', version + 1)
+
+    def _update_where(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp], values: dict) -> int:
+        if not self._update_in_sql() or not self._pushed_down(entity_type, criteria, None):
+            return super()._update_where(entity_type, criteria, values)
+
+        return self._set_where(entity_type, criteria, values)
+
+    def _set_where(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp], values: dict) -> int:
+        columns = [c.name for c in self._get_mapper(entity_type).columns]
+        with self._id_tables(entity_type, criteria, self._max_ids_per_statement()) as criteria:
+            return self._execute(*self._generate_query(entity_type, f'{self._sql_prefix}/update_where.sql', {
+                'values': {
+                    k: self._serializer.serialize(v) if isinstance(v, (list, dict, ffd.ValueObject)) else v
+                    for k, v in values.items() if k in columns
+                },
+                'serialized_values': {k: self._serializer.serialize(v) for k, v in values.items()},
+                'criteria': criteria,
+            }))
+
+    def _update_in_sql(self) -> bool:
+        # Without a way to patch documents, fields that only live in the document have to be written entity by entity.
+        return self._map_all
+
+    def _delete_where(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp) -> int:
+        # Cascades need the references held by each entity, so those still have to be loaded.
+        if len(self._cascades(entity_type)) > 0 or not self._pushed_down(entity_type, criteria, None):
+            return super()._delete_where(entity_type, criteria)
+
+        with self._id_tables(entity_type, criteria, self._max_ids_per_statement()) as criteria:
+            return self._execute(*self._generate_query(entity_type, f'{self._sql_prefix}/delete.sql', {
+                'criteria': criteria
+            }))
+
+    def _max_ids_per_statement(self) -> int:
+        return self._delete_batch_size
 
     def _update(self, entity: ffd.Entity):
         criteria = ffd.Attr(entity.id_name()) == entity.id_value()
@@ -164,14 +455,26 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
         except AttributeError:
             pass
 
-        return self._execute(*self._generate_query(
-            entity,
-            f'{self._sql_prefix}/update.sql',
-            {
-                'data': self._data_fields(entity, add_new=True),
-                'criteria': criteria
-            }
-        ))
+        data = self._data_fields(entity, add_new=True)
+        template = f'{self._sql_prefix}/update.sql'
+        params = {'data': data, 'criteria': criteria}
+        patch = self._document_patch(entity, data)
+        if patch is not None:
+            template = f'{self._sql_prefix}/update_document.sql'
+            params.update(patch)
+
+        ret = self._execute(*self._generate_query(entity, template, params))
+        if ret and hasattr(entity, '__ff_document'):
+            setattr(entity, '__ff_document', data.get('document'))
+
+        return ret
+
+    def _document_patch(self, entity: ffd.Entity, data: dict) -> Optional[dict]:
+        """
+        Parameters for update_document.sql when only part of the stored document needs to be written, or None to
+        rewrite the whole document.
+        """
+        return None
 
     @abstractmethod
     def _ensure_connected(self):
@@ -182,6 +485,7 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
 
     def destroy(self, entity: Type[ffd.Entity]):
         self.execute(*self._generate_query(entity, f'{self._sql_prefix}/drop_table.sql'))
+        self.clear_schema_fingerprint(entity)
 
     @staticmethod
     def _fqtn(entity: Type[ffd.Entity]):
@@ -191,6 +495,9 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
         self._ensure_connected()
 
     def get_entity_columns(self, entity: Type[ffd.Entity]):
+        """
+        Builds the mapped columns from the type hints. Queries read them from the entity's mapper, which keeps them.
+        """
         ret = []
         annotations_ = get_type_hints(entity)
         for f in fields(entity):
@@ -278,6 +585,34 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
             *self._generate_query(entity, f'{self._sql_prefix}/add_index.sql', {'index': index})
         )
 
+    def suggest_indexes(self, entity: Type[ffd.Entity], usage: dict = None,
+                        min_uses: int = DEFAULT_MIN_USES) -> List[dict]:
+        """
+        Fields without an index that criteria used at least min_uses times, those most often filtered in python first.
+        'create' suggestions carry an Index (an expression index for document fields where the backend supports
+        one). 'declare' means the field can only be indexed by giving it a column with index=True.
+        """
+        usage = usage if usage is not None else self._index_advisor.usage(entity)
+        ids = entity.id_name() if isinstance(entity.id_name(), list) else [entity.id_name()]
+        indexed = set(ids + [index.columns[0] for index in self.get_entity_indexes(entity) if index.columns])
+        names = [f.name for f in fields(entity)]
+        table = self._fqtn(entity).replace('.', '_')
+
+        ret = []
+        for name, counts in usage.get('fields', {}).items():
+            uses = counts['filter'] + counts['sort']
+            if name in indexed or name not in names or uses < min_uses:
+                continue
+            suggestion = {'entity': entity.get_fqn(), 'field': name, 'uses': uses, 'in_python': counts['in_python']}
+            if self._field_expression(entity, name) is not None:
+                suggestion['action'] = 'create'
+                suggestion['index'] = Index(name=f'{ADVISED_INDEX_PREFIX}{table}_{name}', table=table, columns=[name])
+            else:
+                suggestion['action'] = 'declare'
+            ret.append(suggestion)
+
+        return sorted(ret, key=lambda s: (s['in_python'], s['uses']), reverse=True)
+
     def drop_index(self, entity: Type[ffd.Entity], index: Index):
         self.execute(
             *self._generate_query(entity, f'{self._sql_prefix}/drop_index.sql', {'index': index})
@@ -317,14 +652,13 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
 
         return ret
 
-    def _cache_aggregate(self, type_: type, id_: str, value: ffd.AggregateRoot):
-        if not isinstance(self._cache, dict):
-            self._cache = {}
-        if 'aggregates' not in self._cache:
-            self._cache['aggregates'] = {}
-        if type_ not in self._cache['aggregates']:
-            self._cache['aggregates'][type_] = {}
-        self._cache['aggregates'][type_][id_] = value
+    def _build_entities(self, entity: Type[ffd.Entity], rows: list, raw: bool = False):
+        ret = []
+        for row in rows:
+            self.debug('Result row: %s', dict(row))
+            ret.append(self._build_entity(entity, row, raw=raw))
+
+        return ret
 
     @staticmethod
     def _generate_index(name: str):
@@ -344,8 +678,14 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
         if not inspect.isclass(entity):
             entity = entity.__class__
 
+        if template.split('/')[-1] in self._cacheable_templates:
+            return self._query_cache(entity, template, params, lambda p: self._render_query(entity, template, p))
+
+        return self._render_query(entity, template, params)
+
+    def _render_query(self, entity: Type[ffd.Entity], template: str, params: dict):
         def mapped_fields(e):
-            return self.get_entity_columns(e)
+            return self._get_mapper(e).columns
 
         template = self._j.env.select_template([template, '/'.join(['sql', template.split('/')[1]])])
         data = {
@@ -381,48 +721,57 @@ class RdbStorageInterface(AbstractStorageInterface, ABC):
             )
         )
 
+    def schema_fingerprint(self, entity: Type[ffd.Entity]) -> str:
+        definition = {
+            'interface': self.__class__.__name__,
+            'table': self._fqtn(entity),
+            'columns': [
+                (c.name, str(c.type), c.length, c.is_id, c.is_indexed, c.is_required, c.default)
+                for c in self.get_entity_columns(entity)
+            ],
+            'indexes': sorted((i.name, i.columns, i.unique) for i in self.get_entity_indexes(entity)),
+        }
+
+        return hashlib.md5(json.dumps(definition, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get_schema_fingerprint(self, entity: Type[ffd.Entity]) -> Optional[str]:
+        if self._schema_fingerprints is None:
+            self.execute(*self._generate_query(
+                entity, f'{self._sql_prefix}/create_schema_table.sql', {'schema_table': self._schema_table}
+            ))
+            self._schema_fingerprints = dict(self._execute(*self._generate_query(
+                entity, f'{self._sql_prefix}/get_schema_fingerprints.sql', {'schema_table': self._schema_table}
+            )))
+
+        return self._schema_fingerprints.get(self._fqtn(entity))
+
+    def set_schema_fingerprint(self, entity: Type[ffd.Entity], fingerprint: str):
+        self.get_schema_fingerprint(entity)
+        self.execute(*self._generate_query(entity, f'{self._sql_prefix}/set_schema_fingerprint.sql', {
+            'schema_table': self._schema_table,
+            'table_name': self._fqtn(entity),
+            'fingerprint': fingerprint,
+        }))
+        self._schema_fingerprints[self._fqtn(entity)] = fingerprint
+
+    def clear_schema_fingerprint(self, entity: Type[ffd.Entity]):
+        self.get_schema_fingerprint(entity)
+        self.execute(*self._generate_query(entity, f'{self._sql_prefix}/delete_schema_fingerprint.sql', {
+            'schema_table': self._schema_table,
+            'table_name': self._fqtn(entity),
+        }))
+        self._schema_fingerprints.pop(self._fqtn(entity), None)
+
     def _data_fields(self, entity: ffd.Entity, add_new: bool = False):
-        ret = {}
-        for f in self.get_entity_columns(entity.__class__):
-            if f.name == 'document' and not hasattr(entity, 'document'):
-                ret[f.name] = self._serialize_entity(entity, add_new=add_new)
-            elif f.name == 'version':
-                try:
-                    ret['version'] = getattr(entity, '__ff_version')
-                except AttributeError:
-                    ret['version'] = 1
-            elif inspect.isclass(f.type) and issubclass(f.type, ffd.AggregateRoot):
-                try:
-                    ret[f.name] = getattr(entity, f.name).id_value()
-                except AttributeError:
-                    if f.is_required:
-                        raise ffd.RepositoryError(f"{f.name} is a required field, but no value is present.")
-                    ret[f.name] = None
-            elif ffd.is_type_hint(f.type):
-                origin = ffd.get_origin(f.type)
-                args = ffd.get_args(f.type)
-                if origin is List:
-                    if issubclass(args[0], ffd.AggregateRoot):
-                        ret[f.name] = self._serializer.serialize(
-                            list(map(lambda e: e.id_value(), getattr(entity, f.name)))
-                        )
-                    else:
-                        ret[f.name] = self._serializer.serialize(getattr(entity, f.name))
-                elif origin is Dict:
-                    if issubclass(args[1], ffd.AggregateRoot):
-                        ret[f.name] = {k: v.id_value() for k, v in getattr(entity, f.name).items()}
-                    else:
-                        ret[f.name] = self._serializer.serialize(getattr(entity, f.name))
-            elif f.type is list or f.type is dict:
-                if hasattr(entity, f.name):
-                    ret[f.name] = self._serializer.serialize(getattr(entity, f.name))
-            else:
-                ret[f.name] = getattr(entity, f.name)
-                if isinstance(ret[f.name], ffd.ValueObject):
-                    ret[f.name] = self._serializer.serialize(ret[f.name])
-        return ret
+        return self._get_mapper(entity.__class__).data_fields(entity, add_new=add_new)
+
+    def _build_mapper(self, entity: Type[ffd.Entity]) -> EntityMapper:
+        return EntityMapper(
+            entity, self._find_relationships(entity), columns=self.get_entity_columns(entity),
+            serializer=self._serializer, document=self._serialize_entity
+        )
 
     def _select_list(self, entity: Type[ffd.Entity]):
         if self._map_all:
-            return list(map(lambda c: c.name, self.get_entity_columns(entity)))
+            return list(map(lambda c: c.name, self._get_mapper(entity).columns))
         return ['document', 'version']
@@ -13,4 +13,5 @@
 #  <http://www.gnu.org/licenses/>.
 
 from .legacy_storage_interface import LegacyStorageInterface
+from .sqlite_connection_pool import SqliteConnectionPool
 from .sqlite_storage_interface import SqliteStorageInterface
@@ -14,34 +14,57 @@
 
 from __future__ import annotations
 
+import itertools
 from abc import abstractmethod, ABC
 from dataclasses import fields
 from pprint import pprint
-from typing import Type, Tuple, Union, List, get_type_hints, Dict
+from typing import Type, Tuple, Union, List, get_type_hints, Dict, Optional, Generator
 
 import firefly.domain as ffd
 from firefly.infrastructure.repository.rdb_repository import DEFAULT_LIMIT
 
+from ..in_lists import in_lists, is_conjunct, replace_values
 from ..rdb_storage_interface import RdbStorageInterface
+from ..sorting import DEFAULT_RUN_SIZE, DEFAULT_TOP_K_LIMIT, external_sort, sort_fields, sort_rows
 
 
 # noinspection PyDataclass
 class LegacyStorageInterface(RdbStorageInterface, ffd.LoggerAware, ABC):
+    # Comparison operators the dialect's templates can render. Criteria using anything else are evaluated in Python.
+    _pushdown_ops = None
+    # Rows read per round trip when criteria have to be finished in python but a limit lets the scan stop early.
+    _scan_batch_size = 500
+    # Limited queries sorted in python keep at most this many rows (offset + limit) instead of loading every match.
+    _top_k_limit = DEFAULT_TOP_K_LIMIT
+    # Rows held in memory per sorted run when a stream is sorted in python. Larger sorts spill to temporary files.
+    _sort_run_size = DEFAULT_RUN_SIZE
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._scan_batch_size = int(kwargs.get('scan_batch_size', self._scan_batch_size))
+        self._sort_run_size = int(kwargs.get('sort_run_size', self._sort_run_size))
+
+    def _queryable_fields(self, entity_type: Type[ffd.Entity]) -> List[str]:
+        """
+        Fields that criteria and sorts can reference in sql. Anything else is filtered and sorted after loading.
+        """
+        return [f.name for f in fields(entity_type) if f.metadata.get('index') is True or f.metadata.get('id') is True]
+
     def _generate_select(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None,
-                         offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, count: bool = False):
+                         offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, count: bool = False,
+                         total: bool = False, columns: List[str] = None):
         pruned_criteria = None
-        indexes = [f.name for f in fields(entity_type)
-                   if f.metadata.get('index') is True or f.metadata.get('id') is True]
+        indexes = self._queryable_fields(entity_type)
         if criteria is not None:
-            pruned_criteria = criteria.prune(indexes)
+            pruned_criteria = criteria.prune(indexes, self._pushdown_ops)
             data = {
-                'columns': self._select_list(entity_type),
+                'columns': columns or self._select_list(entity_type),
                 'criteria': pruned_criteria,
                 'count': count and (pruned_criteria == criteria),
             }
         else:
             data = {
-                'columns': self._select_list(entity_type),
+                'columns': columns or self._select_list(entity_type),
                 'count': count,
             }
 
@@ -54,70 +77,221 @@ class LegacyStorageInterface(RdbStorageInterface, ffd.LoggerAware, ABC):
             data['sort'] = sort_fields
             sorted_in_db = len(sort_fields) == len(sort)
 
-        if (not sort or sorted_in_db) and (pruned_criteria is None or criteria == pruned_criteria):
+        if (not sort or sorted_in_db) and criteria == pruned_criteria:
             if limit is not None:
                 data['limit'] = limit
 
             if offset is not None:
                 data['offset'] = offset
 
+            if total:
+                data['total'] = True
+
+        self._index_advisor.record(entity_type, criteria, pruned_criteria, sort, data.get('sort'))
         sql, params = self._generate_query(entity_type, f'{self._sql_prefix}/select.sql', data)
 
         return sql, params, pruned_criteria
 
     def _all(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None, offset: int = None,
              sort: Tuple[Union[str, Tuple[str, bool]]] = None, raw: bool = False, count: bool = False):
+        large = in_lists(criteria, self._in_list_inline_size())
+        if len(large) > 0:
+            return self._all_in(entity_type, criteria, large, limit, offset, sort, raw, count)
+
         sql, params, pruned_criteria = self._generate_select(
             entity_type, criteria, limit=limit, offset=offset, sort=sort, count=count
         )
 
+        sorted_in_db = self._pushed_down(entity_type, None, sort)
+        if limit == DEFAULT_LIMIT:
+            limit = None
+
+        if criteria != pruned_criteria and limit is not None and not count and sorted_in_db:
+            return self._scan(entity_type, criteria, pruned_criteria, sql, params, limit, offset or 0, raw=raw)
+
+        if not sorted_in_db and limit is not None and not count and (offset or 0) + limit <= self._top_k_limit:
+            # Only the first offset + limit rows are kept, so candidates are streamed rather than all loaded.
+            return sort_rows(
+                self._candidates(entity_type, criteria, pruned_criteria, sql, params, self._scan_batch_size, raw),
+                sort, limit, offset
+            )
+
         results = self._execute(sql, params)
 
-        ret = []
         if count and criteria == pruned_criteria:
             return results[0]['c']
 
-        for row in results:
-            self.debug('Result row: %s', dict(row))
-            ret.append(self._build_entity(entity_type, row, raw=raw))
+        ret = self._build_entities(entity_type, results, raw=raw)
 
         if criteria != pruned_criteria:
             if limit is not None and offset is not None and sort is not None:
                 self.warning('Paging being performed with non-indexed columns. This may lead to undesirable behavior.')
+            scanned = len(ret)
             ret = list(filter(lambda ee: criteria.matches(ee), ret))
+            self._profiler.record_scan(sql, scanned, len(ret))
             if count:
                 ret = len(ret)
 
-        indexes = [f.name for f in fields(entity_type)
-                   if f.metadata.get('index') is True or f.metadata.get('id') is True]
-        sorted_in_db = False
+        if not sorted_in_db and isinstance(ret, list):
+            return sort_rows(ret, sort, limit, offset)
+
+        return ret
+
+    def _all_in(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp, large: List[ffd.BinaryOp],
+                limit: Optional[int], offset: Optional[int], sort: Optional[Tuple[Union[str, Tuple[str, bool]]]],
+                raw: bool, count: bool):
+        """
+        Selects with IN lists too long to bind inline. A single list that is and-ed with the rest of the criteria is
+        split into chunks whose results are merged. Anything else is joined against temporary tables.
+        """
+        target = large[0]
+        values = list(dict.fromkeys(target.rhv))
+        if len(large) > 1 or self._in_list_strategy(len(values)) != 'chunk' or not is_conjunct(criteria, target):
+            with self._id_tables(entity_type, criteria, self._in_list_inline_size()) as criteria:
+                return self._all(entity_type, criteria, limit, offset, sort, raw, count)
 
+        if limit == DEFAULT_LIMIT:
+            limit = None
+        needed = None if limit is None else (offset or 0) + limit
+        ret = [] if not count else 0
+        for batch in ffd.chunk(values, self._in_list_inline_size()):
+            ret += self._all(
+                entity_type, replace_values(criteria, {id(target): batch}), limit=needed, sort=sort, raw=raw,
+                count=count
+            )
+
+        if count:
+            return ret
         if sort is not None:
-            sort_fields = []
-            for s in sort:
-                if str(s[0]) in indexes:
-                    sort_fields.append(s)
-            sorted_in_db = len(sort_fields) == len(sort)
+            return sort_rows(ret, sort, limit, offset)
 
-        if sort is not None and not sorted_in_db and isinstance(ret, list):
-            def sort_keys(x):
-                keys = []
-                for ss in sort:
-                    if len(ss) == 2 and ss[1]:
-                        keys.append(-(getattr(x, str(ss[0]))))
-                    else:
-                        keys.append(getattr(x, str(ss[0])))
-                return keys
+        return ret[(offset or 0):needed]
 
-            ret.sort(key=sort_keys)
+    def _scan(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp, pruned_criteria: Optional[ffd.BinaryOp],
+              sql: str, params: dict, limit: int, offset: int, raw: bool = False) -> list:
+        """
+        Reads the candidates for criteria that were only partly pushed down in batches, in the order the select
+        returns them, and stops as soon as offset + limit of them have matched.
+        """
+        candidates = self._candidates(entity_type, criteria, pruned_criteria, sql, params, self._scan_batch_size, raw)
+        try:
+            return list(itertools.islice(candidates, offset, offset + limit))
+        finally:
+            candidates.close()
 
-        if (sort is not None and not sorted_in_db) and offset is not None and limit is not None:
-            if limit == DEFAULT_LIMIT:
-                return ret[offset:]
-            else:
-                return ret[offset:(offset + limit)]
+    def _candidates(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp],
+                    pruned_criteria: Optional[ffd.BinaryOp], sql: str, params: dict, batch_size: int,
+                    raw: bool = False, batches: Generator = None):
+        """
+        Yields the rows of a select that match the criteria the select could not apply itself, a batch at a time.
+        """
+        scanned = matched = 0
+        if batches is None:
+            batches = self._fetch_batches(sql, params, batch_size)
+        try:
+            for rows in batches:
+                scanned += len(rows)
+                entities = self._build_entities(entity_type, rows, raw=raw)
+                if criteria != pruned_criteria:
+                    entities = [e for e in entities if criteria.matches(e)]
+                matched += len(entities)
+                yield from entities
+        finally:
+            batches.close()
+            if criteria != pruned_criteria:
+                self._profiler.record_scan(sql, scanned, matched)
+                self.debug('Scanned %s rows for %s matches: %s', scanned, matched, sql)
 
-        return ret
+    def _page(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None, limit: int = None,
+              offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None, raw: bool = False,
+              count: Union[bool, int] = True):
+        if not self._pushed_down(entity_type, criteria, sort):
+            # Every match has to be loaded to filter or sort it, so count those rather than querying again.
+            matches = self._all(entity_type, criteria, sort=sort, raw=raw)
+            total = None
+            if count is True:
+                total = len(matches)
+            elif count is not False:
+                total = min(len(matches), int(count) + 1)
+            offset = offset or 0
+            return matches[offset:None if limit is None else offset + limit], total
+
+        if count is not True or not self._window_functions:
+            return super()._page(entity_type, criteria, limit, offset, sort=sort, raw=raw, count=count)
+
+        with self._id_tables(entity_type, criteria, self._in_list_inline_size()) as criteria:
+            sql, params, _ = self._generate_select(
+                entity_type, criteria, limit=limit, offset=offset, sort=sort, total=True
+            )
+            return self._counted_page(entity_type, sql, params, criteria, offset, raw)
+
+    def _project(self, entity_type: Type[ffd.Entity], fields_: Tuple[str], criteria: ffd.BinaryOp = None,
+                 limit: int = None, offset: int = None, sort: Tuple[Union[str, Tuple[str, bool]]] = None):
+        if not self._pushed_down(entity_type, criteria, sort):
+            # Limit and offset can only be applied after filtering and sorting the documents here.
+            rows = self._all(entity_type, criteria, sort=sort, raw=True)
+            offset = offset or 0
+            rows = rows[offset:None if limit is None else offset + limit]
+            return [{name: row.get(name) for name in fields_} for row in rows]
+
+        columns = [self._projection_column(entity_type, name) for name in fields_]
+        if None in columns:
+            rows = self._all(entity_type, criteria, limit, offset, sort=sort, raw=True)
+            return [{name: row.get(name) for name in fields_} for row in rows]
+
+        with self._id_tables(entity_type, criteria, self._in_list_inline_size()) as criteria:
+            sql, params, _ = self._generate_select(entity_type, criteria, limit, offset, sort, columns=columns)
+            return self._projected_rows(entity_type, fields_, self._execute(sql, params))
+
+    def _pushed_down(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp],
+                     sort: Optional[Tuple[Union[str, Tuple[str, bool]]]]) -> bool:
+        indexes = self._queryable_fields(entity_type)
+        return (criteria is None or criteria.prune(indexes, self._pushdown_ops) == criteria) and \
+            all(str(s[0]) in indexes for s in sort or [])
+
+    def _stream(self, entity_type: Type[ffd.Entity], criteria: ffd.BinaryOp = None,
+                sort: Tuple[Union[str, Tuple[str, bool]]] = None, batch_size: int = 1000, raw: bool = False):
+        with self._id_tables(entity_type, criteria, self._in_list_inline_size()) as criteria:
+            sql, params, pruned_criteria = self._generate_select(entity_type, criteria, sort=sort)
+            if not self._pushed_down(entity_type, None, sort):
+                yield from self._sorted_stream(
+                    entity_type, criteria, pruned_criteria, sql, params, sort, batch_size, raw
+                )
+                return
+
+            yield from self._candidates(entity_type, criteria, pruned_criteria, sql, params, batch_size, raw)
+
+    def _sorted_stream(self, entity_type: Type[ffd.Entity], criteria: Optional[ffd.BinaryOp],
+                       pruned_criteria: Optional[ffd.BinaryOp], sql: str, params: dict,
+                       sort: Tuple[Union[str, Tuple[str, bool]]], batch_size: int, raw: bool = False):
+        """
+        Streams rows in an order the database can't produce. Rows are sorted on their stored values with an external
+        merge sort, so at most _sort_run_size of them are held in memory, and built into entities a batch at a time.
+        """
+        names = [name for name, _ in sort_fields(sort)]
+
+        def keyed_rows():
+            for rows in self._fetch_batches(sql, params, batch_size):
+                rows = [dict(row) for row in rows]
+                for row, data in zip(rows, self._build_entities(entity_type, [dict(r) for r in rows], raw=True)):
+                    yield {name: data.get(name) for name in names}, row
+
+        def sorted_batches():
+            ordered = external_sort(
+                keyed_rows(), sort, get=lambda item, name: item[0][name], run_size=self._sort_run_size
+            )
+            try:
+                while True:
+                    batch = [row for _, row in itertools.islice(ordered, batch_size)]
+                    if len(batch) == 0:
+                        return
+                    yield batch
+            finally:
+                ordered.close()
+
+        yield from self._candidates(
+            entity_type, criteria, pruned_criteria, sql, params, batch_size, raw, batches=sorted_batches()
+        )
 
     def _build_entity(self, entity: Type[ffd.Entity], data, raw: bool = False):
         if self._map_all is True:
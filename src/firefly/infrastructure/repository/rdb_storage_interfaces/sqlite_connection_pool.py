@@ -0,0 +1,160 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import asyncio
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Union
+
+import firefly.domain as ffd
+
+DEFAULT_POOL_SIZE = 5
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SYNCHRONOUS_MODES = ('off', 'normal', 'full', 'extra', '0', '1', '2', '3')
+TRANSACTION_MODES = ('deferred', 'immediate', 'exclusive')
+
+
+class SqliteConnectionPool:
+    """
+    Hands each thread, and each asyncio task, its own connection. The holder keeps the connection it acquired until
+    it releases it, and released connections are kept open for reuse (along with their pragmas and prepared
+    statement cache). Tasks inherit the connection their parent held when they were created, but only the holder
+    that acquired a connection can release it.
+
+    In-memory databases only exist for the lifetime of a single connection, so they get a pool of exactly one
+    connection that threads take turns using.
+    """
+
+    def __init__(self, host: str, pool_size: int = DEFAULT_POOL_SIZE, journal_mode: Optional[str] = 'wal',
+                 synchronous: Optional[Union[str, int]] = 'normal', mmap_size: int = None, cache_size: int = None,
+                 cached_statements: int = 128, timeout: float = 5.0):
+        self._host = host
+        self._in_memory = host == ':memory:' or 'mode=memory' in host
+        self._size = 1 if self._in_memory else int(pool_size)
+        self._journal_mode = self._validate(journal_mode, JOURNAL_MODES, 'journal_mode')
+        self._synchronous = self._validate(synchronous, SYNCHRONOUS_MODES, 'synchronous')
+        self._mmap_size = int(mmap_size) if mmap_size is not None else None
+        self._cache_size = int(cache_size) if cache_size is not None else None
+        self._cached_statements = int(cached_statements)
+        self._timeout = float(timeout)
+
+        if self._size < 1:
+            raise ffd.ConfigurationError('pool_size must be at least 1')
+
+        self._connections = []
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._held = ContextVar('sqlite_connection', default=None)
+
+    @contextmanager
+    def connection(self):
+        if self.held() is not None:
+            yield self.held()
+            return
+
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release()
+
+    def held(self) -> Optional[sqlite3.Connection]:
+        held = self._held.get()
+        return held[0] if held is not None else None
+
+    def acquire(self) -> sqlite3.Connection:
+        connection = self.held()
+        if connection is not None:
+            return connection
+
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._connections) < self._size:
+                    connection = self._connect()
+                    self._connections.append(connection)
+
+        if connection is None:
+            try:
+                connection = self._idle.get(timeout=self._timeout)
+            except queue.Empty:
+                raise ffd.RepositoryError(f'Timed out waiting for a connection to {self._host}')
+
+        self._held.set((connection, self._owner()))
+        return connection
+
+    def release(self):
+        held = self._held.get()
+        if held is None or held[1] != self._owner():
+            return
+
+        connection = held[0]
+        self._held.set(None)
+        with self._lock:
+            if connection in self._connections:
+                self._idle.put(connection)
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._idle = queue.LifoQueue()
+        self._held = ContextVar('sqlite_connection', default=None)
+
+    @staticmethod
+    def _owner():
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        return threading.get_ident(), task
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self._host,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=self._cached_statements,
+            timeout=self._timeout,
+            isolation_level=None,
+            uri=self._host.startswith('file:')
+        )
+        connection.row_factory = sqlite3.Row
+
+        if self._journal_mode is not None and not self._in_memory:
+            connection.execute(f'pragma journal_mode = {self._journal_mode}')
+        if self._synchronous is not None:
+            connection.execute(f'pragma synchronous = {self._synchronous}')
+        if self._mmap_size is not None:
+            connection.execute(f'pragma mmap_size = {self._mmap_size}')
+        if self._cache_size is not None:
+            connection.execute(f'pragma cache_size = {self._cache_size}')
+
+        return connection
+
+    @staticmethod
+    def _validate(value, allowed: tuple, name: str):
+        if value is None:
+            return None
+        value = str(value).lower()
+        if value not in allowed:
+            raise ffd.ConfigurationError(f'{name} must be one of: {", ".join(allowed)}')
+        return value
@@ -14,34 +14,107 @@
 
 from __future__ import annotations
 
+import itertools
+import json
+import re
 import sqlite3
-from typing import Type, Optional, Union
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import fields
+from typing import Type, Optional, Union, List, Tuple, get_type_hints
 
 import firefly.domain as ffd
 import inflection
+from firefly.infrastructure.repository.document_patch import diff_documents
+from firefly.infrastructure.repository.query_cache import Placeholder
 from firefly.infrastructure.repository.rdb_repository import Column, Index
 
 from .legacy_storage_interface import LegacyStorageInterface
+from .sqlite_connection_pool import SqliteConnectionPool, DEFAULT_POOL_SIZE, TRANSACTION_MODES
+
+# SQLITE_MAX_VARIABLE_NUMBER for SQLite builds older than 3.32, used when the runtime limit can't be queried.
+DEFAULT_MAX_VARIABLES = 999
+MAX_ROWS_PER_INSERT = 500
+MAX_ROWS_PER_UPDATE = 100
+# Document fields of these types come back from json_extract() in the same form they are bound in, so comparisons and
+# sorts on them give the same results in sql as in python.
+JSON_SCALAR_TYPES = (str, int, float, bool)
+# Documents smaller than this are always rewritten whole, which keeps them in the batched update statements.
+DEFAULT_PATCH_MIN_SIZE = 1024
+# A patch is only used while its values add up to no more than this fraction of the document.
+DEFAULT_PATCH_THRESHOLD = 0.5
 
 
 class SqliteStorageInterface(LegacyStorageInterface, ffd.LoggerAware):
     _serializer: ffd.Serializer = None
     _sql_prefix = 'sqlite'
     _map_indexes = True
+    _pushdown_ops = ('==', '!=', '>', '<', '>=', '<=', 'is', 'is not', 'in', 'not in')
+    _window_functions = sqlite3.sqlite_version_info >= (3, 25, 0)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self._config = kwargs
-        self._connection: Optional[sqlite3.Connection] = None
+        self._pool: Optional[SqliteConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        self._unit_of_work = ContextVar('sqlite_unit_of_work', default=False)
+        self._max_variables = kwargs.get('max_variables')
+        self._statements = {}
+        self._document_fields = {}
+        self._json1 = None
+        self._patch_min_size = int(kwargs.get('document_patch_min_size', DEFAULT_PATCH_MIN_SIZE))
+        self._patch_threshold = float(kwargs.get('document_patch_threshold', DEFAULT_PATCH_THRESHOLD))
+        self._transaction_mode = str(kwargs.get('transaction_mode', 'deferred')).lower()
+        if self._transaction_mode not in TRANSACTION_MODES:
+            raise ffd.ConfigurationError(
+                f"Invalid transaction_mode '{self._transaction_mode}'. Expected one of {TRANSACTION_MODES}"
+            )
+
+    def _begin(self):
+        self._unit_of_work.set(True)
+
+    def _commit(self):
+        self._end_transaction('commit')
+
+    def _rollback(self):
+        self._end_transaction('rollback')
+
+    def _in_unit_of_work(self):
+        return self._unit_of_work.get()
+
+    def _end_transaction(self, statement: str):
+        self._unit_of_work.set(False)
+        if self._pool is None:
+            return
+
+        connection = self._pool.held()
+        if connection is None:
+            return
+
+        try:
+            if connection.in_transaction:
+                self.debug(statement)
+                connection.execute(statement)
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                connection.rollback()
+            if isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e)):
+                raise ffd.ConcurrentUpdateDetected()
+            raise
+        finally:
+            self._pool.release()
 
     def _disconnect(self):
-        if self._connection is not None:
-            self._connection.close()
-            self._connection = None
-            self._tables_checked = []
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+                self._tables_checked = []
 
     def _ensure_connected(self):
-        if self._connection is not None:
+        if self._pool is not None:
             return
 
         try:
@@ -49,20 +122,114 @@ class SqliteStorageInterface(LegacyStorageInterface, ffd.LoggerAware):
         except KeyError:
             raise ffd.ConfigurationError(f'host is required in sqlite_storage_interface')
 
-        self._connection = sqlite3.connect(host, detect_types=sqlite3.PARSE_DECLTYPES)
-        self._connection.row_factory = sqlite3.Row
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = SqliteConnectionPool(
+                    host,
+                    pool_size=self._config.get('pool_size', DEFAULT_POOL_SIZE),
+                    journal_mode=self._config.get('journal_mode', 'wal'),
+                    synchronous=self._config.get('synchronous', 'normal'),
+                    mmap_size=self._config.get('mmap_size'),
+                    cache_size=self._config.get('cache_size'),
+                    cached_statements=self._config.get('cached_statements', 128),
+                    timeout=self._config.get('timeout', 5.0)
+                )
 
     @staticmethod
     def _fqtn(entity: Type[ffd.Entity]):
         return inflection.tableize(entity.get_fqn()).replace('.', '_')
 
     def _build_entity(self, entity: Type[ffd.Entity], data, raw: bool = False):
+        return self._build_entities(entity, [data], raw=raw)[0]
+
+    def _build_entities(self, entity: Type[ffd.Entity], rows: list, raw: bool = False):
+        documents = [self._serializer.deserialize(row['document']) for row in rows]
         if raw:
-            return self._serializer.deserialize(data['document'])
-        ret = entity.from_dict(self._load_relationships(entity, self._serializer.deserialize(data['document'])))
-        setattr(ret, '__ff_version', data['version'])
+            return documents
+
+        # References are registered by find_many() in _load_relationships_batch(). Registering them again, as
+        # _register_aggregate_references() would, resets the hashes of checked out aggregates and hides their changes.
+        ret = []
+        for row, data in zip(rows, self._load_relationships_batch(entity, documents)):
+            e = entity.from_dict(data)
+            setattr(e, '__ff_version', row['version'])
+            # What is stored, so an update can write just the parts of the document that changed.
+            setattr(e, '__ff_document', row['document'])
+            ret.append(e)
+
         return ret
 
+    def _queryable_fields(self, entity_type: Type[ffd.Entity]) -> List[str]:
+        return super()._queryable_fields(entity_type) + self._get_document_fields(entity_type)
+
+    def _get_document_fields(self, entity_type: Type[ffd.Entity]) -> List[str]:
+        """
+        Non-indexed fields that criteria and sorts can reach inside the document with json_extract().
+        """
+        if entity_type not in self._document_fields:
+            ret = []
+            if self._has_json1():
+                types = get_type_hints(entity_type)
+                for f in fields(entity_type):
+                    if f.name.startswith('_') or f.metadata.get('index') is True or f.metadata.get('id') is True:
+                        continue
+                    t = types[f.name]
+                    if ffd.get_origin(t) is Union:
+                        args = [a for a in ffd.get_args(t) if a is not type(None)]
+                        t = args[0] if len(args) == 1 else None
+                    if t in JSON_SCALAR_TYPES:
+                        ret.append(f.name)
+            self._document_fields[entity_type] = ret
+
+        return self._document_fields[entity_type]
+
+    def _field_expression(self, entity_type: Type[ffd.Entity], name: str) -> Optional[str]:
+        if name in self._get_document_fields(entity_type):
+            return f"json_extract(document, '$.{name}')"
+        return super()._field_expression(entity_type, name)
+
+    def _projected_rows(self, entity_type: Type[ffd.Entity], fields_: Tuple[str], rows: list) -> List[dict]:
+        ret = super()._projected_rows(entity_type, fields_, rows)
+        # json_extract() returns JSON booleans as 0 and 1.
+        types = get_type_hints(entity_type)
+        flags = [name for name in fields_ if name in self._get_document_fields(entity_type)
+                 and bool in (types[name],) + tuple(ffd.get_args(types[name]) or ())]
+        for row in ret:
+            for name in flags:
+                if row[name] is not None:
+                    row[name] = bool(row[name])
+
+        return ret
+
+    def _has_json1(self):
+        if self._json1 is None:
+            self._ensure_connected()
+            with self._pool.connection() as connection:
+                try:
+                    connection.execute("select json_extract('{}', '$.a')")
+                    self._json1 = True
+                except sqlite3.OperationalError:
+                    self.warning('SQLite was built without JSON1. Non-indexed fields will be filtered in python.')
+                    self._json1 = False
+
+        return self._json1
+
+    def get_entity_indexes(self, entity: Type[ffd.Entity]):
+        ret = super().get_entity_indexes(entity)
+        table = self._fqtn(entity)
+        document_fields = self._get_document_fields(entity)
+        for field_ in fields(entity):
+            if field_.metadata.get('queryable') is True and field_.name in document_fields:
+                ret.append(Index(table=table, columns=[field_.name]))
+
+        return ret
+
+    def _render_query(self, entity: Type[ffd.Entity], template: str, params: dict):
+        params = params.copy()
+        params['document_fields'] = self._get_document_fields(entity)
+
+        return super()._render_query(entity, template, params)
+
     def _get_table_columns(self, entity: Type[ffd.Entity]):
         ret = []
         results = self._execute(*self._generate_query(entity, f'{self._sql_prefix}/get_columns.sql'))
@@ -85,18 +252,236 @@ class SqliteStorageInterface(LegacyStorageInterface, ffd.LoggerAware):
 
         return ret
 
+    def _add(self, entity: Union[ffd.Entity, List[ffd.Entity]]):
+        entities = entity
+        if not isinstance(entity, list):
+            entities = [entity]
+        if len(entities) == 0:
+            return 0
+
+        entity_type = entities[0].__class__
+        columns = self._get_mapper(entity_type).written_columns
+        rows_per_statement = max(1, min(self._variable_limit() // len(columns), MAX_ROWS_PER_INSERT))
+        template = f'{self._sql_prefix}/insert.sql'
+
+        def params(batches, slots):
+            for batch in batches:
+                values = self._row_values(batch, columns)
+                yield [values[slot] for slot in slots]
+
+        ret = 0
+        full = len(entities) - (len(entities) % rows_per_statement)
+        if full > 0:
+            sql, slots = self._prepare_statement(template, entity_type, columns, rows_per_statement)
+            ret += self._execute_many(sql, params(ffd.chunk(entities[:full], rows_per_statement), slots))
+        if full < len(entities):
+            sql, slots = self._prepare_statement(template, entity_type, columns, len(entities) - full, cache=False)
+            ret += self._execute_many(sql, params([entities[full:]], slots))
+
+        return ret
+
+    def _update_many(self, entities: List[ffd.Entity]) -> List[str]:
+        # The batched statement relies on "returning" (SQLite 3.35+) to tell which rows passed the version check.
+        versioned = [e for e in entities if hasattr(e, '__ff_version')]
+        if sqlite3.sqlite_version_info < (3, 35, 0) or isinstance(entities[0].id_name(), list) or not versioned:
+            return super()._update_many(entities)
+
+        # Large documents are written one statement each, so that they can be patched rather than rewritten.
+        lost = super()._update_many([e for e in entities if not hasattr(e, '__ff_version') or self._patchable(e)])
+        versioned = [e for e in versioned if not self._patchable(e)]
+        if not versioned:
+            return lost
+
+        entity_type = entities[0].__class__
+        columns = self._get_mapper(entity_type).written_columns
+        rows_per_statement = max(1, min(self._variable_limit() // (2 * len(columns) - 1), MAX_ROWS_PER_UPDATE))
+        template = f'{self._sql_prefix}/update_many.sql'
+
+        for batch in ffd.chunk(versioned, rows_per_statement):
+            sql, slots = self._prepare_statement(
+                template, entity_type, columns, len(batch), cache=len(batch) == rows_per_statement
+            )
+            values = self._row_values(batch, columns)
+            params = [values[slot] for slot in slots]
+            with self._cursor() as cursor:
+                self.debug(sql)
+                with self._profile(sql, params):
+                    cursor.execute(sql, params)
+                    written = set(row[0] for row in cursor.fetchall())
+            lost.extend(e.id_value() for e in batch if e.id_value() not in written)
+            if 'document' in columns:
+                document = columns.index('document')
+                for i, e in enumerate(batch):
+                    if e.id_value() in written and hasattr(e, '__ff_document'):
+                        setattr(e, '__ff_document', values[i * len(columns) + document])
+
+        return lost
+
+    def _update_in_sql(self) -> bool:
+        return self._has_json1()
+
+    def _max_ids_per_statement(self) -> int:
+        # Leaves room for the few other parameters a delete statement binds.
+        return max(1, self._variable_limit() - 10)
+
+    @contextmanager
+    def _session(self):
+        with self._cursor():
+            yield
+
+    def _create_id_table(self, entity_type: Type[ffd.Entity], name: str, values: list):
+        self._execute(*self._generate_query(entity_type, f'{self._sql_prefix}/drop_id_table.sql', {'name': name}))
+        self._execute(*self._generate_query(entity_type, f'{self._sql_prefix}/create_id_table.sql', {'name': name}))
+        self._execute_many(f'insert into "{name}" (value) values (?)', ((v,) for v in values))
+
+    def _patchable(self, entity: ffd.Entity) -> bool:
+        document = getattr(entity, '__ff_document', None)
+        return document is not None and len(document) >= self._patch_min_size and self._has_json1()
+
+    def _document_patch(self, entity: ffd.Entity, data: dict) -> Optional[dict]:
+        if not self._patchable(entity) or not isinstance(data.get('document'), str):
+            return None
+
+        sets, removes = diff_documents(json.loads(getattr(entity, '__ff_document')), json.loads(data['document']))
+        sets = [(self._json_path(path), json.dumps(value)) for path, value in sets]
+        removes = [self._json_path(path) for path in removes]
+        if None in removes or any(path is None for path, _ in sets):
+            return None
+
+        size = sum(len(path) + len(value) for path, value in sets) + sum(len(path) for path in removes)
+        if size > len(data['document']) * self._patch_threshold:
+            return None
+
+        return {'sets': sets, 'removes': removes}
+
+    @staticmethod
+    def _json_path(path: tuple) -> Optional[str]:
+        ret = '$'
+        for part in path:
+            if isinstance(part, int):
+                ret += f'[{part}]'
+            elif '"' in part:
+                return None
+            else:
+                ret += f'."{part}"'
+
+        return ret
+
+    def _row_values(self, entities: List[ffd.Entity], columns: Tuple[str]):
+        ret = []
+        for entity in entities:
+            data = self._data_fields(entity, add_new=True)
+            ret.extend(data.get(column) for column in columns)
+
+        return ret
+
+    def _prepare_statement(self, template: str, entity_type: Type[ffd.Entity], columns: Tuple[str], rows: int,
+                           cache: bool = True):
+        """
+        Renders a multi-row template for a fixed number of rows, with positional parameters in place of the values.
+        Returns the sql and, for each parameter, its index into the row values flattened in column order.
+        """
+        key = (template, entity_type, columns, rows)
+        if key in self._statements:
+            return self._statements[key]
+
+        data = []
+        for row in range(rows):
+            data.append({column: Placeholder(row * len(columns) + i) for i, column in enumerate(columns)})
+        sql, params = self._render_query(entity_type, template, {'data': data})
+
+        slots = []
+
+        def positional(match):
+            # Only the names the renderer bound are parameters; any other ":word" (in a literal, say) is left alone.
+            if match.group(1) not in params:
+                return match.group(0)
+            slots.append(params[match.group(1)].slot)
+            return '?'
+
+        ret = re.sub(r':(\w+)', positional, sql), slots
+        if cache:
+            self._statements[key] = ret
+
+        return ret
+
+    def _variable_limit(self):
+        if self._max_variables is None:
+            self._ensure_connected()
+            with self._pool.connection() as connection:
+                try:
+                    self._max_variables = connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+                except AttributeError:
+                    self._max_variables = DEFAULT_MAX_VARIABLES
+
+        return int(self._max_variables)
+
     def _execute(self, sql: str, params: dict = None):
-        self._ensure_connected()
-        cursor = self._connection.cursor()
-        self.info(sql)
-        self.info(params)
-        cursor.execute(sql, params)
-        self._connection.commit()
+        with self._cursor() as cursor:
+            self.debug(sql)
+            self.debug(params)
+            with self._profile(sql, params):
+                cursor.execute(sql, params or {})
+
+                if sql.startswith(('update ', 'insert ', 'delete ')):
+                    ret = cursor.rowcount
+                else:
+                    ret = cursor.fetchall()
+
+            return ret
+
+    def _fetch_batches(self, sql: str, params: dict, batch_size: int):
+        with self._cursor() as cursor:
+            self.debug(sql)
+            self.debug(params)
+            start = time.perf_counter()
+            cursor.execute(sql, params or {})
+            duration = time.perf_counter() - start
+            try:
+                while True:
+                    start = time.perf_counter()
+                    rows = cursor.fetchmany(batch_size)
+                    duration += time.perf_counter() - start
+                    if len(rows) == 0:
+                        break
+                    yield rows
+            finally:
+                # Readers that stop early close the generator, which still counts as one execution.
+                self._record(sql, params, duration)
+
+    def _execute_many(self, sql: str, params):
+        with self._cursor() as cursor:
+            self.debug(sql)
+            rows = iter(params)
+            first = next(rows, None)
+            with self._profile(sql, first):
+                cursor.executemany(sql, rows if first is None else itertools.chain([first], rows))
 
-        if sql.startswith('update ') or sql.startswith('insert '):
             return cursor.rowcount
 
-        return cursor.fetchall()
+    def _explain(self, sql: str, params: dict = None) -> Optional[List[str]]:
+        with self._cursor() as cursor:
+            try:
+                cursor.execute(f'explain query plan {sql}', params or {})
+            except sqlite3.Error:
+                return None
+            return [row[-1] for row in cursor.fetchall()]
+
+    @contextmanager
+    def _cursor(self):
+        self._ensure_connected()
+        if self._in_unit_of_work() and self._pool.held() is None:
+            # Hold one connection and one transaction for the rest of the unit of work. It is released when the
+            # transaction handling middleware commits or rolls back.
+            self._pool.acquire().execute(f'begin {self._transaction_mode}')
+
+        with self._pool.connection() as connection:
+            try:
+                yield connection.cursor()
+            except sqlite3.OperationalError as e:
+                if connection.in_transaction and 'locked' in str(e):
+                    raise ffd.ConcurrentUpdateDetected()
+                raise
 
     def create_schema(self, entity_type: Type[ffd.Entity]):
         return True
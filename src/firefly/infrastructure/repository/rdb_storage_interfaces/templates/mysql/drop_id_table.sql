@@ -0,0 +1 @@
+drop temporary table if exists {{ _q | sqlsafe }}{{ name | sqlsafe }}{{ _q | sqlsafe }}
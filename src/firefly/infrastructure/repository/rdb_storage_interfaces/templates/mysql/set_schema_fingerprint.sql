@@ -0,0 +1,2 @@
+{% extends 'sql/set_schema_fingerprint.sql' %}
+{% block upsert %}on duplicate key update fingerprint = values(fingerprint){% endblock %}
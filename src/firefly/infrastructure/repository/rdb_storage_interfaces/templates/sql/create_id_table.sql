@@ -0,0 +1 @@
+create temporary table {{ _q | sqlsafe }}{{ name | sqlsafe }}{{ _q | sqlsafe }} ({% block value_column %}value varchar(255){% endblock %} primary key)
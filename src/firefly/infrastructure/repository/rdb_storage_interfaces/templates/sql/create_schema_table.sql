@@ -0,0 +1,5 @@
+create table if not exists {{ _q | sqlsafe }}{{ schema_table | sqlsafe }}{{ _q | sqlsafe }} (
+    {{ _q | sqlsafe }}table_name{{ _q | sqlsafe }} varchar(255) not null,
+    fingerprint varchar(32) not null,
+    primary key ({{ _q | sqlsafe }}table_name{{ _q | sqlsafe }})
+)
@@ -0,0 +1 @@
+delete from {{ _q | sqlsafe }}{{ schema_table | sqlsafe }}{{ _q | sqlsafe }} where {{ _q | sqlsafe }}table_name{{ _q | sqlsafe }} = {{ table_name }}
@@ -0,0 +1 @@
+drop table if exists {{ _q | sqlsafe }}{{ name | sqlsafe }}{{ _q | sqlsafe }}
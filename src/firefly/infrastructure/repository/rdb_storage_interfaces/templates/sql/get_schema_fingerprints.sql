@@ -0,0 +1 @@
+select {{ _q | sqlsafe }}table_name{{ _q | sqlsafe }}, fingerprint from {{ _q | sqlsafe }}{{ schema_table | sqlsafe }}{{ _q | sqlsafe }}
@@ -0,0 +1,4 @@
+insert into {{ _q | sqlsafe }}{{ name | sqlsafe }}{{ _q | sqlsafe }} (value) values
+{% for v in values %}
+    ({{ v }}){% if not loop.last %},{% endif %}
+{% endfor %}
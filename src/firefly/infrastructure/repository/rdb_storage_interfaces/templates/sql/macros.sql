@@ -1,7 +1,7 @@
 {% macro where_clause(c, attribute_macro, value_macro, ids, field_types, other_hand) %}
     {% set attribute_macro = attribute_macro | default(default_attribute_macro) %}
     {% set value_macro = value_macro | default(default_value_macro) %}
-    {% if (c is criteria and c.lhv == 1 and c.rhv == 1 and c.op == '==') %}
+    {% if (c is criteria and c.lhv is not attribute and c.rhv is not attribute and c.lhv == 1 and c.rhv == 1 and c.op == '==') %}
         1=1
     {% else %}
         {%- if c is criteria -%}
@@ -39,6 +39,8 @@
         {% if c is not criteria %}
             {% if c is attribute %}
                 {{ attribute_macro(c, ids, other_hand, field_types) }}
+            {% elif c is id_table %}
+                (select value from {{ c.name | sqlsafe }})
             {% elif c is iterable and c is not string %}
             (
                 {% for i in c %}
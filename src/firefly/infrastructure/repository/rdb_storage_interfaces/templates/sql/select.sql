@@ -1,3 +1,7 @@
+{% if count_up_to %}
+    select count(1) as c from (
+{% endif %}
+
 select
 
 {% if count is true %}
@@ -5,7 +9,7 @@ select
 {% else %}
     {% for column in columns %}
         {% if ' as ' in column %}
-            {{ column | sqlsafe }}
+            {{ column | sqlsafe }}{% if not loop.last %},{% endif %}
         {% elif column == 'document' %}
             {% block document %}
                 {% import "sql/macros.sql" as macros %}
@@ -15,6 +19,9 @@ select
             {{ _q | sqlsafe }}{{ column | sqlsafe }}{{ _q | sqlsafe }}{% if not loop.last %},{% endif %}
         {% endif %}
     {% endfor %}
+    {% if total %}
+        , count(1) over () as {{ _q | sqlsafe }}__ff_total{{ _q | sqlsafe }}
+    {% endif %}
 {% endif %}
 
 from {% block fqtn %}{{ fqtn | sqlsafe }}{% endblock %} _0
@@ -25,6 +32,10 @@ from {% block fqtn %}{{ fqtn | sqlsafe }}{% endblock %} _0
     {% block where_clause scoped %}{{ macros.where_clause(criteria, macros.default_attribute_macro, macros.default_value_macro, ids, field_types) }}{% endblock %}
 {% endif %}
 
+{% if group_by %}
+    group by {% for expression in group_by %}{{ expression | sqlsafe }}{% if not loop.last %},{% endif %}{% endfor %}
+{% endif %}
+
 {% if count is false %}
     {% if sort %}
         order by
@@ -34,10 +45,14 @@ from {% block fqtn %}{{ fqtn | sqlsafe }}{% endblock %} _0
     {% endif %}
 
     {% if limit %}
-        limit {{ limit | sqlsafe }}
+        limit {{ limit }}
     {% endif %}
 
     {% if offset %}
-        offset {{ offset | sqlsafe }}
+        offset {{ offset }}
     {% endif %}
-{% endif %}
\ No newline at end of file
+{% endif %}
+
+{% if count_up_to %}
+    ) _ff_count
+{% endif %}
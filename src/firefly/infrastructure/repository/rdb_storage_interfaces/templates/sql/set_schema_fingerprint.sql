@@ -0,0 +1,5 @@
+insert into {{ _q | sqlsafe }}{{ schema_table | sqlsafe }}{{ _q | sqlsafe }} ({{ _q | sqlsafe }}table_name{{ _q | sqlsafe }}, fingerprint)
+values ({{ table_name }}, {{ fingerprint }})
+{% block upsert %}
+on conflict ({{ _q | sqlsafe }}table_name{{ _q | sqlsafe }}) do update set fingerprint = excluded.fingerprint
+{% endblock %}
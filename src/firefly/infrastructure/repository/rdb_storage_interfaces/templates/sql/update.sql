@@ -6,7 +6,7 @@
             {% if k not in ids %}
                 {{ _q | sqlsafe }}{{ k | sqlsafe }}{{ _q | sqlsafe }}=
                 {% if k == 'version' %}
-                    {{ v + 1 }}
+                    {{ _q | sqlsafe }}version{{ _q | sqlsafe }} + 1
                 {% else %}
                     {%- block update_value scoped %}{{ v }}{% endblock %}
                 {% endif %}
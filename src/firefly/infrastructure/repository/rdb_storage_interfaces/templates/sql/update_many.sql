@@ -0,0 +1,32 @@
+{%- block update -%}
+    update {% block fqtn %}{{ fqtn | sqlsafe }} {% endblock %} set
+
+    {% block columns %}
+        {%- for column in data[0].keys() if column not in ids -%}
+            {{ _q | sqlsafe }}{{ column | sqlsafe }}{{ _q | sqlsafe }}=
+            {% if column == 'version' %}
+                {{ _q | sqlsafe }}version{{ _q | sqlsafe }} + 1
+            {% else %}
+                case {{ _q | sqlsafe }}{{ ids[0] | sqlsafe }}{{ _q | sqlsafe }}
+                {% for item in data %}
+                    when {{ item[ids[0]] }} then {% block update_value scoped %}{{ item[column] }}{% endblock %}
+                {% endfor %}
+                end
+            {% endif %}
+            {% if not loop.last %},{% endif %}
+        {%- endfor -%}
+    {% endblock %}
+
+    where {{ _q | sqlsafe }}{{ ids[0] | sqlsafe }}{{ _q | sqlsafe }} in (
+        {%- for item in data -%}
+            {{ item[ids[0]] }}{% if not loop.last %},{% endif %}
+        {%- endfor -%}
+    )
+    and {{ _q | sqlsafe }}version{{ _q | sqlsafe }} = case {{ _q | sqlsafe }}{{ ids[0] | sqlsafe }}{{ _q | sqlsafe }}
+        {% for item in data %}
+            when {{ item[ids[0]] }} then {{ item['version'] }}
+        {% endfor %}
+    end
+
+    returning {{ _q | sqlsafe }}{{ ids[0] | sqlsafe }}{{ _q | sqlsafe }}
+{%- endblock -%}
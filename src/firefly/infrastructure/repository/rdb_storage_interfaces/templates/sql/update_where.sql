@@ -0,0 +1,15 @@
+{%- block update -%}
+    update {% block fqtn %}{{ fqtn | sqlsafe }}{% endblock %} set
+
+    {% block columns %}
+        {% for k, v in values.items() %}
+            {{ _q | sqlsafe }}{{ k | sqlsafe }}{{ _q | sqlsafe }} = {{ v }}{% if not loop.last %},{% endif %}
+        {% endfor %}
+    {% endblock %}
+
+    {% if criteria %}
+        where
+        {% import "sql/macros.sql" as macros %}
+        {% block where_clause scoped %}{{ macros.where_clause(criteria, macros.default_attribute_macro, macros.default_value_macro, ids, field_types) }}{% endblock %}
+    {% endif %}
+{%- endblock -%}
@@ -1,2 +1,8 @@
 {% extends 'sql/add_index.sql' %}
-    {% block fqtn %}{{ fqtn.replace('.', '_') | sqlsafe }}{% endblock %}
\ No newline at end of file
+{% import 'sqlite/macros.sql' as sqlite_macros with context %}
+    {% block fqtn %}{{ fqtn.replace('.', '_') | sqlsafe }}{% endblock %}
+    {% block index_fields %}
+        {% for column in index.columns %}
+            {{ sqlite_macros.column(column) }}{% if not loop.last %},{% endif %}
+        {% endfor %}
+    {% endblock %}
\ No newline at end of file
@@ -0,0 +1,3 @@
+{% extends 'sql/create_id_table.sql' %}
+    {#- Without a declared type the values keep their own, so they compare equal to what is in the table. -#}
+    {% block value_column %}value{% endblock %}
@@ -0,0 +1,17 @@
+{% macro attribute(c, ids, other_hand, field_types) %}
+    {% if c.has_modifiers() %}
+        {% for modifier in c.get_modifiers() %}{{ modifier | sqlsafe }}({% endfor %}
+    {% endif %}
+    {{ column(c | string) }}
+    {% if c.has_modifiers() %}
+        {% for modifier in c.get_modifiers() %}){% endfor %}
+    {% endif %}
+{% endmacro %}
+
+{% macro column(name) %}
+    {% if name in document_fields | default([]) %}
+        json_extract(document, '$.{{ name | sqlsafe }}')
+    {% else %}
+        {{ _q | sqlsafe }}{{ name | sqlsafe }}{{ _q | sqlsafe }}
+    {% endif %}
+{% endmacro %}
\ No newline at end of file
@@ -1,2 +1,5 @@
 {% extends 'sql/select.sql' %}
-    {% block fqtn %}{{ fqtn.replace('.', '_') | sqlsafe }}{% endblock %}
\ No newline at end of file
+{% import 'sqlite/macros.sql' as sqlite_macros with context %}
+    {% block fqtn %}{{ fqtn.replace('.', '_') | sqlsafe }}{% endblock %}
+    {% block where_clause %}{{ macros.where_clause(criteria, sqlite_macros.attribute, macros.default_value_macro, ids, field_types) }}{% endblock %}
+    {% block sort_column %}{{ sqlite_macros.column(column[0] | string) }}{% endblock %}
\ No newline at end of file
@@ -0,0 +1,21 @@
+{% extends 'sqlite/update.sql' %}
+    {% block columns %}
+        document =
+        {% if sets %}json_set({% endif %}
+        {% if removes %}json_remove({% endif %}
+        document
+        {% for path in removes %}, {{ path }}{% endfor %}
+        {% if removes %}){% endif %}
+        {% for path, value in sets %}, {{ path }}, json({{ value }}){% endfor %}
+        {% if sets %}){% endif %}
+        {%- for k, v in data.items() -%}
+            {% if k not in ids and k != 'document' %}
+                , {{ _q | sqlsafe }}{{ k | sqlsafe }}{{ _q | sqlsafe }} =
+                {% if k == 'version' %}
+                    {{ _q | sqlsafe }}version{{ _q | sqlsafe }} + 1
+                {% else %}
+                    {{ v }}
+                {% endif %}
+            {% endif %}
+        {%- endfor -%}
+    {% endblock %}
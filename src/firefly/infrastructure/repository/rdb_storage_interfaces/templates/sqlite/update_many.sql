@@ -0,0 +1,2 @@
+{% extends 'sql/update_many.sql' %}
+    {% block fqtn %}{{ fqtn.replace('.', '_') | sqlsafe }}{% endblock %}
\ No newline at end of file
@@ -0,0 +1,17 @@
+{% extends 'sql/update_where.sql' %}
+{% import 'sqlite/macros.sql' as sqlite_macros with context %}
+    {% block fqtn %}{{ fqtn.replace('.', '_') | sqlsafe }}{% endblock %}
+    {% block columns %}
+        document = json_set(
+            document
+            {% for k, v in serialized_values.items() %}
+                {% set path = '$."' ~ k ~ '"' %}
+                , {{ path }}, json({{ v }})
+            {% endfor %}
+        )
+        {% for k, v in values.items() %}
+            , {{ _q | sqlsafe }}{{ k | sqlsafe }}{{ _q | sqlsafe }} = {{ v }}
+        {% endfor %}
+        , {{ _q | sqlsafe }}version{{ _q | sqlsafe }} = {{ _q | sqlsafe }}version{{ _q | sqlsafe }} + 1
+    {% endblock %}
+    {% block where_clause %}{{ macros.where_clause(criteria, sqlite_macros.attribute, macros.default_value_macro, ids, field_types) }}{% endblock %}
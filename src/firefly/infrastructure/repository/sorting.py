@@ -0,0 +1,141 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import pickle
+import tempfile
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Up to this many rows (offset + limit) are kept in a bounded heap instead of sorting everything.
+DEFAULT_TOP_K_LIMIT = 10000
+# Rows held in memory per sorted run before an external sort spills to a temporary file.
+DEFAULT_RUN_SIZE = 50000
+
+Sort = Tuple[Union[str, Tuple[str, bool]], ...]
+
+
+def sort_fields(sort: Sort) -> List[Tuple[str, bool]]:
+    """
+    Normalizes a sort to (field, descending) pairs.
+    """
+    ret = []
+    for s in sort:
+        if isinstance(s, (tuple, list)):
+            ret.append((str(s[0]), len(s) == 2 and bool(s[1])))
+        else:
+            ret.append((str(s), False))
+
+    return ret
+
+
+def get_value(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+class SortKey:
+    """
+    Orders by several values, each ascending or descending, without needing to negate them, so strings, dates and
+    anything else that supports < sort the same way in either direction. None sorts first, as in SQL ascending.
+    """
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values: tuple, descending: tuple):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other: SortKey) -> bool:
+        for a, b, descending in zip(self.values, other.values, self.descending):
+            if descending:
+                a, b = b, a
+            if a is None or b is None:
+                if a is None and b is None:
+                    continue
+                return a is None
+            if a < b:
+                return True
+            if b < a:
+                return False
+
+        return False
+
+    def __eq__(self, other: SortKey) -> bool:
+        # heapq breaks ties on insertion order only once keys compare equal, which keeps its results stable.
+        return not (self < other or other < self)
+
+    __hash__ = None
+
+
+def sort_key(sort: Sort, get: Callable[[Any, str], Any] = get_value) -> Callable[[Any], SortKey]:
+    fields_ = sort_fields(sort)
+    descending = tuple(d for _, d in fields_)
+
+    def key(item):
+        return SortKey(tuple(get(item, name) for name, _ in fields_), descending)
+
+    return key
+
+
+def sort_rows(rows: Iterable, sort: Sort, limit: int = None, offset: int = None,
+              get: Callable[[Any, str], Any] = get_value, top_k_limit: int = DEFAULT_TOP_K_LIMIT) -> list:
+    """
+    Sorts in memory and applies offset and limit. When offset + limit is small only that many rows are kept, in a
+    bounded heap, so the rest of the input is never sorted or held.
+    """
+    key = sort_key(sort, get)
+    offset = offset or 0
+    if limit is not None and offset + limit <= top_k_limit:
+        return heapq.nsmallest(offset + limit, rows, key=key)[offset:]
+
+    ret = sorted(rows, key=key)
+    return ret[offset:] if limit is None else ret[offset:offset + limit]
+
+
+def external_sort(rows: Iterable, sort: Sort, get: Callable[[Any, str], Any] = get_value,
+                  run_size: int = DEFAULT_RUN_SIZE) -> Iterator:
+    """
+    Sorts rows of any number, holding at most run_size of them in memory. Sorted runs are pickled to temporary files
+    and merged lazily, so rows must be picklable. Inputs that fit in one run never touch the disk.
+    """
+    key = sort_key(sort, get)
+    rows = iter(rows)
+    runs = []
+    try:
+        while True:
+            run = sorted(itertools.islice(rows, run_size), key=key)
+            if len(runs) == 0 and len(run) < run_size:
+                yield from run
+                return
+            if len(run) == 0:
+                break
+            fp = tempfile.TemporaryFile()
+            runs.append(fp)
+            for row in run:
+                pickle.dump(row, fp, pickle.HIGHEST_PROTOCOL)
+            fp.seek(0)
+
+        yield from heapq.merge(*[_read_run(fp) for fp in runs], key=key)
+    finally:
+        for fp in runs:
+            fp.close()
+
+
+def _read_run(fp) -> Iterator:
+    while True:
+        try:
+            yield pickle.load(fp)
+        except EOFError:
+            return
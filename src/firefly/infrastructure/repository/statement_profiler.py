@@ -0,0 +1,164 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import json
+import math
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, List, Optional
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_PROFILER_SAMPLES = 1000
+DEFAULT_SLOW_QUERY_LOG_SIZE = 100
+
+# JSON paths ('$.field') are part of the query, not values.
+_STRING = re.compile(r"'(?!\$)(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r':[A-Za-z_]\w*|%\(\w+\)s|%s|\?')
+_NUMBER = re.compile(r'(?<![\w.$])\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_REPEATED_GROUP = re.compile(r'(\([^()]*\))(?:\s*,\s*\1)+')
+
+
+def fingerprint(sql: str) -> str:
+    """
+    The statement with its literals and bound values replaced by ?, lists of values collapsed to (?+) and repeated
+    rows (multi-row inserts) collapsed to one, so every execution of the same query shares a fingerprint.
+    """
+    ret = _STRING.sub('?', sql)
+    ret = _PLACEHOLDER.sub('?', ret)
+    ret = _NUMBER.sub('?', ret)
+    ret = _LIST.sub('(?+)', ret)
+    ret = _REPEATED_GROUP.sub(r'\1', ret)
+
+    return ' '.join(ret.split())
+
+
+class StatementStats:
+    def __init__(self, max_samples: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=max_samples)
+        self.rows_scanned = 0
+        self.rows_matched = 0
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.samples.append(duration)
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        # Nearest rank
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class StatementProfiler:
+    """
+    Times statements per fingerprint. Percentiles are taken over the most recent max_samples executions of each
+    statement. Statements that take at least slow_query_threshold seconds also go to a bounded slow query log, along
+    with their query plan when the storage interface can provide one.
+
+    Queries whose criteria are partly evaluated in python also report how many rows they read and how many of those
+    matched, so predicates that can't use an index stand out.
+    """
+
+    def __init__(self, slow_query_threshold: float = DEFAULT_SLOW_QUERY_MS / 1000,
+                 max_samples: int = DEFAULT_PROFILER_SAMPLES, slow_query_log_size: int = DEFAULT_SLOW_QUERY_LOG_SIZE):
+        self.slow_query_threshold = slow_query_threshold
+        self.max_samples = max_samples
+        self._statements = {}
+        self._slow_queries = deque(maxlen=slow_query_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, duration: float) -> bool:
+        """
+        Adds one execution. Returns True when it was slow enough to be logged with log_slow_query().
+        """
+        key = fingerprint(sql)
+        with self._lock:
+            if key not in self._statements:
+                self._statements[key] = StatementStats(self.max_samples)
+            self._statements[key].add(duration)
+
+        return self.slow_query_threshold is not None and duration >= self.slow_query_threshold
+
+    def record_scan(self, sql: str, scanned: int, matched: int):
+        key = fingerprint(sql)
+        with self._lock:
+            if key not in self._statements:
+                self._statements[key] = StatementStats(self.max_samples)
+            self._statements[key].rows_scanned += scanned
+            self._statements[key].rows_matched += matched
+
+    def log_slow_query(self, sql: str, params: Any, duration: float, plan: Optional[List[str]] = None):
+        with self._lock:
+            self._slow_queries.append({
+                'fingerprint': fingerprint(sql),
+                'sql': sql,
+                'params': params,
+                'duration_ms': duration * 1000,
+                'plan': plan,
+                'at': datetime.now().isoformat(),
+            })
+
+    def stats(self, limit: int = None) -> List[dict]:
+        """
+        Per-fingerprint timings in milliseconds, the statements with the most total time first.
+        """
+        with self._lock:
+            statements = list(self._statements.items())
+
+        ret = []
+        for key, s in sorted(statements, key=lambda i: i[1].total, reverse=True)[:limit]:
+            ret.append({
+                'fingerprint': key,
+                'count': s.count,
+                'total_ms': s.total * 1000,
+                'mean_ms': s.total / s.count * 1000 if s.count else 0.0,
+                'p50_ms': s.percentile(50) * 1000,
+                'p95_ms': s.percentile(95) * 1000,
+                'p99_ms': s.percentile(99) * 1000,
+                'max_ms': s.max * 1000,
+                'rows_scanned': s.rows_scanned,
+                'rows_matched': s.rows_matched,
+            })
+
+        return ret
+
+    def slow_queries(self) -> List[dict]:
+        with self._lock:
+            return list(self._slow_queries)
+
+    def snapshot(self) -> dict:
+        return {'statements': self.stats(), 'slow_queries': self.slow_queries()}
+
+    def save(self, path: str, **extra):
+        """
+        Writes the snapshot, along with anything in extra, as json.
+        """
+        with open(path, 'w') as fp:
+            json.dump(dict(self.snapshot(), **extra), fp, default=str)
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow_queries.clear()
@@ -17,6 +17,8 @@ from datetime import datetime
 from multiprocessing import Pool
 from pprint import pprint
 
+import firefly as ff
+import pytest
 from firefly_test.iam import Scope, Role, User
 from firefly_test.todo import TodoList, User as TodoUser, Task
 
@@ -92,13 +94,13 @@ def test_aggregate_associations(users):
 
 
 def test_pagination(users):
-    test = users.sort(lambda u: u.name)[0:1]
+    test = users.sort(lambda u: u.name)[0:2]
 
     assert len(test) == 2
     assert test[0].name == 'Bob Loblaw'
     assert test[1].name == 'Davante Adams'
 
-    test = users.sort(lambda u: u.name)[1:2]
+    test = users.sort(lambda u: u.name)[1:3]
 
     assert len(test) == 2
     assert test[0].name == 'Davante Adams'
@@ -109,6 +111,139 @@ def test_pagination(users):
     assert test[1].name == 'David Johnson'
 
 
+def test_keyset_pagination(users):
+    page = users.sort(lambda u: u.name)[:2]
+    assert [u.name for u in page] == ['Bob Loblaw', 'Davante Adams']
+
+    page = users.after(page[-1]).sort(lambda u: u.name)[:2]
+    assert [u.name for u in page] == ['David Johnson', 'John Doe']
+
+    seen = []
+    page = users.sort(lambda u: ((u.name, True),))[:3]
+    while page:
+        seen.extend(page)
+        page = users.after(page[-1]).sort(lambda u: ((u.name, True),))[:3]
+    assert [u.name for u in seen] == ['John Doe', 'David Johnson', 'Davante Adams', 'Bob Loblaw']
+
+    cursor = users.sort(lambda u: ((u.name, True),)).cursor(seen[1])
+    page = users.after(cursor).sort(lambda u: ((u.name, True),))[:2]
+    assert [u.name for u in page] == ['Davante Adams', 'Bob Loblaw']
+
+
+def test_find_many(users):
+    ids = {row['name']: row['id'] for row in users.only('id', 'name')}
+    bob = users.find(ids['Bob Loblaw'])
+
+    found = users.find_many([ids['John Doe'], 'missing', ids['Bob Loblaw'], ids['Davante Adams'], ids['John Doe']])
+    assert [u.name for u in found] == ['John Doe', 'Bob Loblaw', 'Davante Adams', 'John Doe']
+    assert found[1] is bob and found[0] is found[3]
+
+    again = users.find_many([ids['Davante Adams'], ids['Bob Loblaw']])
+    assert again[0] is found[2] and again[1] is bob
+
+
+def test_page(users):
+    page, total = users.filter(lambda u: u.name != 'John Doe').sort(lambda u: u.name).page(1, 2)
+    assert [u.name for u in page] == ['Davante Adams', 'David Johnson']
+    assert total == 3
+
+    page, total = users.filter(lambda u: u.email.startswith('d')).sort(lambda u: u.name).page(1, 5)
+    assert [u.name for u in page] == ['David Johnson']
+    assert total == 2
+
+    page, total = users.page(10, 2)
+    assert page == [] and total == 4
+
+    page, total = users.page(0, 2, count=False)
+    assert len(page) == 2 and total is None
+
+    page, total = users.page(0, 2, count=2)
+    assert len(page) == 2 and total == 3
+
+
+def test_stream(users):
+    read_only = list(users.stream(read_only=True))
+    assert sorted(u.name for u in read_only) == ['Bob Loblaw', 'Davante Adams', 'David Johnson', 'John Doe']
+
+    bob = users.find(lambda u: u.name == 'Bob Loblaw')
+    streamed = list(users.stream(batch_size=3))
+    assert len(streamed) == 4
+    assert any(u is bob for u in streamed)
+    assert all(users.find(u.id) is u for u in streamed)
+    assert all(users.find(u.id) is not u for u in read_only)
+
+
+def test_projections(users):
+    rows = users.filter(lambda u: u.name != 'John Doe').sort(lambda u: ((u.name, True),)).only('name', 'email')[:2]
+    assert rows == [
+        {'name': 'David Johnson', 'email': 'david@johnson.com'},
+        {'name': 'Davante Adams', 'email': 'davante@adams.com'},
+    ]
+
+    rows = list(users.filter(lambda u: u.email.startswith('d')).only('id', 'email'))
+    assert sorted(row['email'] for row in rows) == ['davante@adams.com', 'david@johnson.com']
+
+    with pytest.raises(ff.InvalidArgument):
+        list(users.only('weight'))
+
+
+def test_aggregates(users):
+    assert users.aggregate(n=ff.Count(), first=ff.Min('name'), last=ff.Max('name')) == {
+        'n': 4, 'first': 'Bob Loblaw', 'last': 'John Doe'
+    }
+
+    rows = users.filter(lambda u: u.name != 'John Doe').aggregate(group_by=['email'], n=ff.Count())
+    assert sorted(rows, key=lambda r: r['email']) == [
+        {'email': 'bob@loblaw.com', 'n': 1},
+        {'email': 'davante@adams.com', 'n': 1},
+        {'email': 'david@johnson.com', 'n': 1},
+    ]
+
+    rows = users.filter(lambda u: u.email.startswith('d')).aggregate(group_by=['email'], first=ff.Min('name'))
+    assert sorted(rows, key=lambda r: r['email']) == [
+        {'email': 'davante@adams.com', 'first': 'Davante Adams'},
+        {'email': 'david@johnson.com', 'first': 'David Johnson'},
+    ]
+
+
+def test_update_and_delete_where(users):
+    john = users.find(lambda u: u.name == 'John Doe')
+    bob = users.find(lambda u: u.name == 'Bob Loblaw')
+
+    assert users.update_where(lambda u: u.name.is_in(('John Doe', 'David Johnson')), {'email': 'x@y.com'}) == 2
+    assert users.find(bob.id) is bob
+    reloaded = users.find(john.id)
+    assert reloaded is not john and reloaded.email == 'x@y.com'
+    assert len(users.filter(lambda u: u.email == 'x@y.com')) == 2
+
+    assert users.delete_where(lambda u: u.email == 'x@y.com') == 2
+    assert len(users) == 2
+
+    with pytest.raises(ff.InvalidArgument):
+        users.update_where(lambda u: u.name == 'Bob Loblaw', {'id': 'x'})
+    with pytest.raises(ff.InvalidArgument):
+        users.update_where(lambda u: u.name == 'Bob Loblaw', {'weight': 1})
+
+
+def test_destroyed_tables_forget_checked_out_entities(users):
+    bob = users.find(lambda u: u.name == 'Bob Loblaw')
+
+    users.destroy()
+    users.migrate_schema()
+    users.append(User(id=bob.id, name='Bob Loblaw', email='bob@loblaw.com'))
+    users.commit()
+    assert len(users) == 1
+
+
+def test_migration_is_skipped_when_the_schema_is_unchanged(users):
+    assert users.migrate_schema() is False
+    assert users.migrate_schema(force=True) is True
+
+    users.destroy()
+    assert users.migrate_schema() is True
+    assert users.migrate_schema() is False
+
+
 def test_list_expansion(users):
     my_users = users.filter(lambda u: u.name.is_in(['Bob Loblaw', 'Davante Adams']))
 
@@ -75,3 +75,129 @@ def test_list_expansion(registry):
     tests.iam_fixtures(users, roles, scopes)
 
     tests.test_list_expansion(users)
+
+
+def test_keyset_pagination(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_keyset_pagination(users)
+
+
+def test_find_many(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_find_many(users)
+
+
+def test_page(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_page(users)
+
+
+def test_stream(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_stream(users)
+
+
+def test_projections(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_projections(users)
+
+
+def test_aggregates(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_aggregates(users)
+
+
+def test_update_and_delete_where(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_update_and_delete_where(users)
+
+
+def test_destroyed_tables_forget_checked_out_entities(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_destroyed_tables_forget_checked_out_entities(users)
+
+
+def test_migration_is_skipped_when_the_schema_is_unchanged(registry):
+    users = registry(User)
+    roles = registry(Role)
+    scopes = registry(Scope)
+
+    users.migrate_schema()
+    roles.migrate_schema()
+    scopes.migrate_schema()
+
+    tests.iam_fixtures(users, roles, scopes)
+
+    tests.test_migration_is_skipped_when_the_schema_is_unchanged(users)
@@ -0,0 +1,50 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import firefly as ff
+import pytest
+
+from firefly_test.iam.domain import User
+
+
+def test_pages_by_cursor(container):
+    class Users(ff.QueryService[User]):
+        pass
+
+    service = container.build(Users)
+
+    assert len(service(limit=2)) == 5
+    assert service(limit=0, cursor=None)['next_cursor'] is None
+
+    names, cursor = [], ''
+    while cursor is not None:
+        page = service(limit=2, cursor=cursor, sort=[['name', True]])
+        names.extend(u['name'] for u in page['data'])
+        cursor = page['next_cursor']
+    assert names == [f'user {i}' for i in reversed(range(5))]
+
+
+def test_rejects_invalid_cursors(container):
+    class Users(ff.QueryService[User]):
+        pass
+
+    with pytest.raises(ff.InvalidArgument):
+        container.build(Users)(limit=2, cursor='not a cursor')
+
+
+@pytest.fixture(autouse=True)
+def fixture_data(registry):
+    users = registry(User)
+    users.append([User(name=f'user {i}', email=f'user{i}@example.com') for i in range(5)])
+    users.commit()
+    users.reset()
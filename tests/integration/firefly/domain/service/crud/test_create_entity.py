@@ -0,0 +1,40 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import firefly as ff
+import pytest
+
+from firefly_test.iam.domain import Role, Scope
+
+
+def test_references_are_loaded_together(container, registry, monkeypatch):
+    class CreateRole(ff.CreateEntity[Role]):
+        pass
+
+    loaded = []
+    scopes = registry(Scope)
+    find_many = scopes.find_many
+    monkeypatch.setattr(scopes, 'find_many', lambda ids: loaded.append(list(ids)) or find_many(ids))
+
+    role = container.build(CreateRole)(name='Regular User', scopes=['firefly.read', 'firefly.write'])
+
+    assert loaded == [['firefly.read', 'firefly.write']]
+    assert [s.id for s in role.scopes] == ['firefly.read', 'firefly.write']
+
+
+@pytest.fixture(autouse=True)
+def fixture_data(registry):
+    scopes = registry(Scope)
+    scopes.append([Scope(id='firefly.admin'), Scope(id='firefly.read'), Scope(id='firefly.write')])
+    scopes.commit()
+    scopes.reset()
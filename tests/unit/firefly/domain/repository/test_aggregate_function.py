@@ -0,0 +1,37 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+import firefly as ff
+
+
+class Order(ff.AggregateRoot):
+    id: str = ff.id_()
+    status: str = ff.optional()
+    amount: int = ff.optional()
+
+
+def test_evaluate_aggregates():
+    orders = [Order(status='open', amount=5), Order(status='open', amount=None), Order(status='paid', amount=7)]
+    functions = {'total': ff.Sum('amount'), 'n': ff.Count(), 'priced': ff.Count('amount'), 'avg': ff.Avg('amount'),
+                 'low': ff.Min('amount'), 'high': ff.Max('amount')}
+
+    assert ff.evaluate_aggregates(orders, functions) == [
+        {'total': 12, 'n': 3, 'priced': 2, 'avg': 6.0, 'low': 5, 'high': 7}
+    ]
+    assert ff.evaluate_aggregates([o.to_dict() for o in orders], {'n': ff.Count()}, ['status']) == [
+        {'status': 'open', 'n': 2}, {'status': 'paid', 'n': 1}
+    ]
+    assert ff.evaluate_aggregates([], functions) == [
+        {'total': None, 'n': 0, 'priced': 0, 'avg': None, 'low': None, 'high': None}
+    ]
@@ -0,0 +1,37 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+import firefly as ff
+
+
+class Widget(ff.AggregateRoot):
+    id: str = ff.id_()
+    name: str = ff.optional()
+
+
+def test_identity_map():
+    a, b, c = Widget(id='a'), Widget(id='b'), Widget(id='c')
+    sut = ff.IdentityMap([b, a])
+    sut.append(c)
+    sut.append(Widget(id='a', name='duplicate'))
+
+    assert list(sut) == [b, a, c]
+    assert sut.get('a') is a
+    assert Widget(id='c') in sut
+    assert sut[-1] is c
+    assert sut[0:2] == [b, a]
+
+    sut.remove(a)
+    assert a not in sut
+    assert len(sut) == 2
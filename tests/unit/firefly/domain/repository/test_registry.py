@@ -0,0 +1,54 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import threading
+
+import firefly as ff
+
+
+class Widget(ff.AggregateRoot):
+    id: str = ff.id_()
+
+
+class Repository:
+    def __init__(self):
+        self.transactions = 0
+
+    def begin_transaction(self):
+        self.transactions += 1
+
+
+def test_transactions_are_not_shared_between_threads():
+    repository = Repository()
+    sut = ff.Registry()
+    sut.register_factory(ff.AggregateRoot, lambda entity: repository)
+
+    sut.begin_transaction()
+    thread = threading.Thread(target=sut, args=(Widget,))
+    thread.start()
+    thread.join()
+
+    assert sut(Widget) is repository
+    assert repository.transactions == 0
+
+
+def test_repositories_created_in_a_transaction_are_begun_once():
+    repository = Repository()
+    sut = ff.Registry()
+    sut.register_factory(ff.AggregateRoot, lambda entity: repository)
+
+    sut.begin_transaction()
+    for _ in range(3):
+        assert sut(Widget) is repository
+
+    assert repository.transactions == 1
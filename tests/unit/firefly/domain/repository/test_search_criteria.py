@@ -46,6 +46,25 @@ def test_is_not_none(spy):
     assert 'null_var is not null' in c.to_sql()[0]
 
 
+def test_prune_drops_or_with_unindexed_side(spy):
+    c = (spy.a == 1) & ((spy.b == 2) | (spy.a == 3))
+    assert c.prune(['a']) == (ff.Attr('a') == 1)
+
+    c = (spy.a == 1) | (spy.a == 3)
+    assert c.prune(['a']) == c
+
+
+def test_prune_drops_unsupported_ops(spy):
+    c = (spy.a == 1) & spy.b.startswith('x')
+    assert c.prune(['a', 'b'], ['==']) == (ff.Attr('a') == 1)
+    assert c.prune(['a', 'b']) == c
+
+
+def test_attributes(spy):
+    c = ((spy.a == 1) & spy.b.lower().startswith('x')) | (spy.a > 3)
+    assert c.attributes() == [('a', '=='), ('b', 'startswith'), ('a', '>')]
+
+
 @pytest.fixture()
 def spy():
     return ff.EntityAttributeSpy()
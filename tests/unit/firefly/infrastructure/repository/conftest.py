@@ -0,0 +1,36 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import firefly.infrastructure as ffi
+import pytest
+
+
+@pytest.fixture()
+def sqlite(container, tmp_path):
+    """
+    Builds SqliteStorageInterfaces on the test's own database file, with whatever settings are passed in, and
+    disconnects them when the test is done.
+    """
+    built = []
+
+    def build(**kwargs):
+        # The container hands the arguments of its first build to every later one, so it only wires up the class's
+        # dependencies here and each interface is constructed with its own settings.
+        container.build(ffi.SqliteStorageInterface)
+        ret = ffi.SqliteStorageInterface(**dict({'host': str(tmp_path / 'db.sqlite')}, **kwargs))
+        built.append(ret)
+        return ret
+
+    yield build
+    for interface in built:
+        interface.disconnect()
@@ -0,0 +1,74 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+from typing import List
+
+import firefly.domain as ffd
+import pytest
+
+
+class Dimensions(ffd.ValueObject):
+    width: int = ffd.optional()
+    height: int = ffd.optional()
+
+
+class Widget(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.required(index=True)
+    dimensions: Dimensions = ffd.optional()
+    variants: List[Dimensions] = ffd.list_()
+    tags: List[str] = ffd.list_()
+    secret: str = ffd.optional(internal=True)
+
+
+class Labelled(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    label: str = ffd.optional()
+
+    def to_dict(self, skip: list = None, force_all: bool = False):
+        ret = super().to_dict(skip=skip, force_all=force_all)
+        ret['label'] = ret['label'].upper()
+        return ret
+
+
+def test_mapper_matches_to_dict(sut):
+    widget = Widget(name='foo', dimensions=Dimensions(width=1, height=2), variants=[Dimensions(width=3)],
+                    tags=['a'], secret='shh')
+    mapper = sut._get_mapper(Widget)
+
+    assert mapper.to_dict(widget) == widget.to_dict(force_all=True)
+    assert sut._get_mapper(Widget) is mapper
+    assert list(sut._data_fields(widget).keys()) == ['id', 'document', 'version', 'name']
+    assert mapper.written_columns == ('id', 'document', 'version', 'name')
+    assert sut._serializer.deserialize(sut._data_fields(widget)['document']) == widget.to_dict(force_all=True)
+
+
+def test_mapper_uses_overridden_to_dict(sut):
+    assert sut._get_mapper(Labelled).to_dict(Labelled(label='foo'))['label'] == 'FOO'
+
+
+def test_columns_are_worked_out_once_per_type(sut, monkeypatch):
+    sut.create_table(Widget)
+    sut.add([Widget(name=f'widget {i}') for i in range(3)])
+    built = []
+    get_entity_columns = sut.get_entity_columns
+    monkeypatch.setattr(sut, 'get_entity_columns', lambda e: built.append(e) or get_entity_columns(e))
+
+    assert sut.project(Widget, ('name',), sort=('name',)) == [{'name': f'widget {i}'} for i in range(3)]
+    assert sut.update_where(Widget, ffd.Attr('name') == 'widget 0', {'name': 'renamed'}) == 1
+    assert built == []
+
+
+@pytest.fixture()
+def sut(sqlite):
+    return sqlite()
@@ -0,0 +1,70 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+from typing import List
+
+import firefly.domain as ffd
+import firefly.infrastructure as ffi
+import pytest
+
+
+class Widget(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.required(index=True)
+    size: int = ffd.optional(default=0)
+    tags: List[str] = ffd.list_()
+
+
+def test_usage_is_recorded_per_field(sut):
+    sut.all(Widget, (ffd.Attr('name') == 'foo') & ffd.Attr('tags').contains('x'), sort=(('size', True),))
+
+    usage = sut.index_advisor.usage(Widget)
+    assert usage['queries'] == 1 and usage['in_python'] == 1
+    assert usage['fields']['name'] == {'filter': 1, 'sort': 0, 'in_python': 0}
+    assert usage['fields']['tags'] == {'filter': 1, 'sort': 0, 'in_python': 1}
+    assert usage['fields']['size'] == {'filter': 0, 'sort': 1, 'in_python': 0}
+
+
+def test_suggestions_are_applied_and_kept_by_migrate_schema(sut, repository):
+    for _ in range(3):
+        sut.all(Widget, (ffd.Attr('size') > 1) & ffd.Attr('tags').contains('x'))
+        sut.all(Widget, ffd.Attr('name') == 'foo')
+
+    suggestions = sut.suggest_indexes(Widget, min_uses=3)
+    assert [(s['field'], s['action']) for s in suggestions] == [('tags', 'declare'), ('size', 'create')]
+    assert sut.suggest_indexes(Widget, min_uses=4) == []
+
+    index = suggestions[1]['index']
+    sut.create_index(Widget, index)
+    sql, params, _ = sut._generate_select(Widget, ffd.Attr('size') > 1)
+    plan = ' '.join(row[-1] for row in sut._execute(f'explain query plan {sql}', params))
+    assert index.name in plan
+
+    repository.migrate_schema()
+    assert index in sut.get_table_indexes(Widget)
+
+
+@pytest.fixture()
+def sut(sqlite):
+    ret = sqlite()
+    ret.create_table(Widget)
+    return ret
+
+
+@pytest.fixture()
+def repository(container, sut):
+    class WidgetRepository(ffi.RdbRepository[Widget]):
+        def __init__(self):
+            super().__init__(interface=sut)
+
+    return container.build(WidgetRepository)
@@ -0,0 +1,58 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+
+import firefly.domain as ffd
+import firefly.infrastructure as ffi
+import pytest
+
+
+class Widget(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.optional()
+    size: int = ffd.optional(default=0)
+    deleted_on: datetime = ffd.optional()
+
+
+def test_filtered_repositories_aggregate(sut):
+    for i in range(6):
+        sut.append(Widget(name='small' if i < 4 else 'large', size=i))
+
+    assert sut.filter(lambda w: w.size > 1).aggregate(n=ffd.Count(), total=ffd.Sum('size')) == {'n': 4, 'total': 14}
+    assert sut.filter(lambda w: w.size > 1).aggregate(group_by=['name'], n=ffd.Count()) == [
+        {'name': 'small', 'n': 2},
+        {'name': 'large', 'n': 2},
+    ]
+    assert len(sut) == 6
+
+
+def test_query_service_pages_without_deleted_entities(container, sut):
+    class Widgets(ffd.QueryService[Widget]):
+        pass
+
+    service = container.build(Widgets)
+    for i in range(5):
+        sut.append(Widget(name=f'widget {i}', deleted_on=datetime.now() if i == 2 else None))
+
+    page = service(offset=1, limit=2, sort=[['name', True]])
+    assert page['count'] == 4
+    assert [w['name'] for w in page['data']] == ['widget 3', 'widget 1']
+    assert service(offset=0, limit=2, max_count=1)['count_capped'] is True
+
+
+@pytest.fixture()
+def sut(registry):
+    registry.register_factory(Widget, ffi.MemoryRepositoryFactory())
+    return registry(Widget)
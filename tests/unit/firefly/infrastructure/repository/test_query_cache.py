@@ -0,0 +1,90 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import firefly.domain as ffd
+import pytest
+
+
+class Widget(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.required(index=True)
+    size: int = ffd.optional()
+
+
+def test_repeated_queries_hit_the_cache(sut):
+    sql, params = sut._generate_query(Widget, 'sqlite/select.sql', {
+        'columns': ['document', 'version'],
+        'criteria': ffd.Attr('name') == 'foo',
+        'count': False,
+        'limit': 10,
+    })
+    assert sut.query_cache.stats()['misses'] == 1
+
+    cached_sql, cached_params = sut._generate_query(Widget, 'sqlite/select.sql', {
+        'columns': ['document', 'version'],
+        'criteria': ffd.Attr('name') == 'bar',
+        'count': False,
+        'limit': 20,
+    })
+    assert sut.query_cache.stats()['hits'] == 1
+    assert cached_sql == sql
+    assert 'limit' in sql
+    assert sorted(cached_params.values(), key=str) == [20, 'bar']
+
+
+def test_shape_changes_are_cache_misses(sut):
+    sut._generate_query(Widget, 'sqlite/select.sql', {'criteria': ffd.Attr('name').is_in(['a', 'b'])})
+    sql, params = sut._generate_query(Widget, 'sqlite/select.sql', {'criteria': ffd.Attr('name').is_in(['a', 'b', 'c'])})
+    assert sut.query_cache.stats()['misses'] == 2
+    assert len(params) == 3
+
+    sut._generate_query(Widget, 'sqlite/select.sql', {'criteria': ffd.Attr('name').is_none()})
+    sql, params = sut._generate_query(Widget, 'sqlite/select.sql', {'criteria': ffd.Attr('name').is_true()})
+    assert sut.query_cache.stats()['misses'] == 4
+    assert 'is true' in sql
+
+
+def test_criteria_attributes_are_read_once_per_shape(sut, monkeypatch):
+    walks = []
+    attributes = ffd.BinaryOp.attributes
+    monkeypatch.setattr(ffd.BinaryOp, 'attributes', lambda self: walks.append(self) or attributes(self))
+
+    for name in ('foo', 'bar'):
+        assert sut.query_cache.attributes((ffd.Attr('name') == name) & (ffd.Attr('size') > 1)) == ('name', 'size')
+    assert sut.query_cache.attributes(ffd.Attr('size') > 1) == ('size',)
+    assert sut.query_cache.attributes(None) == ()
+    assert len(walks) == 2
+
+
+def test_cache_size_is_capped(sut):
+    sut.query_cache.max_size = 2
+    for i in range(1, 5):
+        sut._generate_query(Widget, 'sqlite/select.sql', {'criteria': ffd.Attr('name').is_in(['a'] * i)})
+
+    assert sut.query_cache.stats()['size'] == 2
+
+
+def test_cached_statements_round_trip(sut):
+    sut.create_table(Widget)
+    for i in range(3):
+        sut.add(Widget(name=f'widget {i}', size=i))
+
+    for i in range(3):
+        assert sut.all(Widget, ffd.Attr('name') == f'widget {i}')[0].size == i
+
+    assert sut.query_cache.stats()['hits'] >= 2
+
+
+@pytest.fixture()
+def sut(sqlite):
+    return sqlite()
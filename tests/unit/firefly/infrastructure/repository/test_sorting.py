@@ -0,0 +1,44 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from firefly.infrastructure.repository.sorting import external_sort, sort_rows
+
+ROWS = [
+    {'name': 'b', 'size': 2},
+    {'name': 'a', 'size': 2},
+    {'name': None, 'size': 1},
+    {'name': 'c', 'size': 1},
+    {'name': 'a', 'size': None},
+]
+
+
+def test_mixed_directions_sort_any_orderable_type():
+    ret = sort_rows(ROWS, (('size', True), 'name'))
+    assert [(r['size'], r['name']) for r in ret] == [(2, 'a'), (2, 'b'), (1, None), (1, 'c'), (None, 'a')]
+
+    ret = sort_rows(ROWS, (('name', True), ('size', False)))
+    assert [(r['name'], r['size']) for r in ret] == [('c', 1), ('b', 2), ('a', None), ('a', 2), (None, 1)]
+
+
+def test_limits_are_applied_with_or_without_a_heap():
+    expected = sort_rows(ROWS, (('name', True),))[1:3]
+    assert sort_rows(iter(ROWS), (('name', True),), limit=2, offset=1) == expected
+    assert sort_rows(ROWS, (('name', True),), limit=2, offset=1, top_k_limit=0) == expected
+
+
+def test_external_sort_merges_runs_spilled_to_disk():
+    rows = [{'id': i, 'key': f'{(i * 7919) % 1000:03}'} for i in range(1000)]
+
+    ret = list(external_sort(rows, (('key', True),), run_size=64))
+    assert ret == sorted(rows, key=lambda r: r['key'], reverse=True)
@@ -0,0 +1,129 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import asyncio
+import threading
+
+import firefly.domain as ffd
+import pytest
+from firefly.infrastructure import SqliteConnectionPool
+
+
+def test_each_thread_gets_its_own_connection(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / 'test.db'), pool_size=2)
+    connections = []
+    acquired = threading.Barrier(2)
+
+    def work():
+        with pool.connection() as connection:
+            connections.append(connection)
+            acquired.wait(timeout=5)
+
+    threads = [threading.Thread(target=work) for _ in range(2)]
+    list(map(lambda t: t.start(), threads))
+    list(map(lambda t: t.join(), threads))
+
+    assert len(connections) == 2
+    assert connections[0] is not connections[1]
+
+
+def test_each_task_gets_its_own_connection(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / 'test.db'), pool_size=2)
+
+    async def work():
+        connection = pool.acquire()
+        await asyncio.sleep(0)
+        assert pool.held() is connection
+        pool.release()
+        return connection
+
+    async def main():
+        return await asyncio.gather(work(), work())
+
+    connections = asyncio.run(main())
+    assert connections[0] is not connections[1]
+
+
+def test_only_the_holder_releases_a_connection(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / 'test.db'), pool_size=2)
+
+    async def child():
+        connection = pool.held()
+        pool.release()
+        return connection
+
+    def elsewhere():
+        with pool.connection() as c:
+            return c
+
+    async def main():
+        connection = pool.acquire()
+        assert await asyncio.create_task(child()) is connection
+        assert pool.held() is connection
+        # Had the child put it back, another thread would be handed the same connection.
+        assert await asyncio.get_event_loop().run_in_executor(None, elsewhere) is not connection
+        pool.release()
+        return connection
+
+    connection = asyncio.run(main())
+    with pool.connection() as again:
+        assert again is connection
+
+
+def test_connections_are_reused(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / 'test.db'))
+    with pool.connection() as connection:
+        with pool.connection() as nested:
+            assert nested is connection
+    with pool.connection() as again:
+        assert again is connection
+
+
+def test_pragmas(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / 'test.db'), synchronous='full', cache_size=-4000)
+    with pool.connection() as connection:
+        assert connection.execute('pragma journal_mode').fetchone()[0] == 'wal'
+        assert connection.execute('pragma synchronous').fetchone()[0] == 2
+        assert connection.execute('pragma cache_size').fetchone()[0] == -4000
+
+
+def test_in_memory_databases_share_one_connection():
+    pool = SqliteConnectionPool(':memory:', pool_size=5)
+    with pool.connection() as connection:
+        connection.execute('create table foo (bar text)')
+
+    def work():
+        with pool.connection() as c:
+            c.execute("insert into foo values ('baz')")
+
+    t = threading.Thread(target=work)
+    t.start()
+    t.join()
+
+    with pool.connection() as connection:
+        assert connection.execute('select count(*) from foo').fetchone()[0] == 1
+
+
+def test_invalid_configuration():
+    with pytest.raises(ffd.ConfigurationError):
+        SqliteConnectionPool(':memory:', journal_mode='sideways')
+
+
+def test_close(tmp_path):
+    pool = SqliteConnectionPool(str(tmp_path / 'test.db'))
+    with pool.connection():
+        pass
+    pool.close()
+
+    with pool.connection() as connection:
+        assert connection.execute('select 1').fetchone()[0] == 1
@@ -0,0 +1,453 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import sqlite3
+from datetime import datetime
+from typing import List
+
+import firefly.domain as ffd
+import firefly.infrastructure as ffi
+import pytest
+from firefly.infrastructure.repository.query_cache import Placeholder
+
+
+class Widget(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.required(index=True)
+    size: int = ffd.optional(default=0)
+    color: str = ffd.optional(queryable=True)
+
+
+class Part(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.optional()
+
+
+class Gadget(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    main: Part = ffd.optional()
+    parts: List[Part] = ffd.list_()
+
+
+class Note(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    text: str = ffd.optional()
+    deleted_on: datetime = ffd.optional()
+
+
+class Crate(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    parts: List[Part] = ffd.list_(on_delete='cascade')
+
+
+class Reading(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    taken_on: datetime = ffd.optional()
+    size: int = ffd.optional(default=0)
+
+
+class Catalog(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.optional()
+    items: List[str] = ffd.list_()
+    attributes: dict = ffd.dict_()
+
+
+def test_unit_of_work_is_committed_once(sut, reader):
+    sut.begin()
+    sut.add(Widget(name='foo'))
+    sut.add(Widget(name='bar'))
+    assert len(reader.all(Widget)) == 0
+
+    sut.commit()
+    assert len(reader.all(Widget)) == 2
+
+
+def test_unit_of_work_is_rolled_back(sut, reader):
+    sut.begin()
+    sut.add(Widget(name='foo'))
+    sut.rollback()
+
+    assert len(reader.all(Widget)) == 0
+    assert len(sut.all(Widget)) == 0
+
+
+def test_lock_at_commit_is_a_concurrent_update(sqlite, tmp_path):
+    sut = sqlite(journal_mode='delete', timeout=0.1)
+    sut.create_table(Widget)
+    sut.begin()
+    sut.add(Widget(name='foo'))
+
+    other = sqlite3.connect(str(tmp_path / 'db.sqlite'))
+    other.execute('begin')
+    other.execute('select * from sqlite_master').fetchall()
+    try:
+        with pytest.raises(ffd.ConcurrentUpdateDetected):
+            sut.commit()
+    finally:
+        other.close()
+
+    # The unit of work is over, so the next statement commits on its own.
+    sut.add(Widget(name='bar'))
+    assert [w.name for w in sut.all(Widget)] == ['bar']
+
+
+def test_statements_outside_a_unit_of_work_are_committed(sut, reader):
+    sut.add(Widget(name='foo'))
+    assert len(reader.all(Widget)) == 1
+
+
+def test_bulk_insert_is_chunked_by_the_variable_limit(sqlite, reader):
+    sut = sqlite(max_variables=20)
+    sut.create_table(Widget)
+    widgets = [Widget(name=f'widget {i}') for i in range(103)]
+    sut.profiler.clear()
+
+    assert sut.add(widgets) == 103
+    # Each row binds four values, so five fit in a statement. The full chunks run as one prepared statement, the
+    # three rows left over as another.
+    assert len([q for q in _statements(sut) if q.startswith('insert')]) == 2
+    assert len(reader.all(Widget)) == 103
+    assert reader.all(Widget, ffd.Attr('name') == 'widget 102')[0].id == widgets[-1].id
+
+
+def test_prepared_statements_only_replace_bound_parameters(sut, monkeypatch):
+    rendered = "insert into t (a, b) values (:a_0, json_extract(:b_0, '$.x:y')), (:a_1, ':b_1 :c')"
+    params = {'a_0': Placeholder(0), 'b_0': Placeholder(1), 'a_1': Placeholder(2)}
+    monkeypatch.setattr(sut, '_render_query', lambda *args: (rendered, params))
+
+    sql, slots = sut._prepare_statement('sqlite/insert.sql', Widget, ('a', 'b'), 2, cache=False)
+    assert sql == "insert into t (a, b) values (?, json_extract(?, '$.x:y')), (?, ':b_1 :c')"
+    assert slots == [0, 1, 2]
+
+
+def test_update_many_reports_ids_that_lost_the_version_check(sqlite, reader):
+    sut = sqlite(max_variables=20)
+    sut.create_table(Widget)
+    sut.add([Widget(name=f'widget {i}') for i in range(7)])
+    widgets = sut.all(Widget)
+
+    winner = reader.all(Widget, ffd.Attr('name') == 'widget 3')[0]
+    winner.name = 'winner'
+    assert reader.update(winner) == 1
+
+    for widget in widgets:
+        widget.name = widget.name.upper()
+    assert sut.update_many(widgets) == [winner.id]
+
+    names = sorted(w.name for w in reader.all(Widget))
+    assert names == ['WIDGET 0', 'WIDGET 1', 'WIDGET 2', 'WIDGET 4', 'WIDGET 5', 'WIDGET 6', 'winner']
+    assert sut.update_many([w for w in widgets if w.id != winner.id]) == []
+    assert any(s['fingerprint'].startswith('update') and 'returning' in s['fingerprint']
+               for s in sut.profiler.stats())
+
+
+def test_stream_reads_in_batches(sut):
+    sut.add([Widget(name=f'widget {i:02}', size=i % 3) for i in range(25)])
+
+    stream = sut.stream(Widget, ffd.Attr('size') == 0, sort=(('name', True),), batch_size=4)
+    assert [w.name for w in stream] == [f'widget {i:02}' for i in reversed(range(0, 25, 3))]
+
+
+def test_document_fields_are_queried_in_sql(sut):
+    sut.add([Widget(name=f'widget {i}', size=i, color='red' if i % 2 else 'blue') for i in range(6)])
+    criteria = (ffd.Attr('size') > 1) & (ffd.Attr('color') == 'red')
+
+    sql, _, pruned = sut._generate_select(Widget, criteria, sort=(('size', True),), limit=1, offset=1)
+    assert pruned == criteria
+    assert "order by json_extract(document, '$.size') desc" in sql
+    assert [w.size for w in sut.all(Widget, criteria, sort=(('size', True),), limit=1, offset=1)] == [3]
+    assert sut.all(Widget, criteria, count=True) == 2
+
+    criteria = ffd.Attr('color').startswith('r')
+    assert sut._generate_select(Widget, criteria)[2] is None
+    assert len(sut.all(Widget, criteria)) == 3
+
+
+def test_queryable_fields_get_expression_indexes(sut):
+    for index in sut.get_entity_indexes(Widget):
+        sut.create_index(Widget, index)
+
+    sql, params, _ = sut._generate_select(Widget, ffd.Attr('color') == 'red')
+    plan = ' '.join(row[-1] for row in sut._execute(f'explain query plan {sql}', params))
+    assert 'USING INDEX' in plan and plan.endswith('widgets_color (<expr>=?)')
+
+
+def test_relationships_are_loaded_once_per_page(registry, sut):
+    sut.create_table(Part)
+    sut.create_table(Gadget)
+    parts = [Part(name=f'part {i}') for i in range(6)]
+    sut.add(parts)
+    sut.add([Gadget(main=parts[i], parts=[parts[(i + 2) % 6], parts[i]]) for i in range(6)])
+    registry(Part).reset()
+    checked_out = registry(Part).find(parts[0].id)
+
+    sut.profiler.clear()
+    gadgets = sut.all(Gadget)
+
+    assert len(_statements(sut)) == 2
+    assert [g.main.name for g in gadgets] == [f'part {i}' for i in range(6)]
+    assert [p.name for p in gadgets[1].parts] == ['part 3', 'part 1']
+    assert gadgets[0].main is checked_out
+
+
+def test_loading_relationships_keeps_changes_to_checked_out_aggregates(registry, sut, reader):
+    sut.create_table(Part)
+    sut.create_table(Gadget)
+    changed, referenced = Part(name='changed'), Part(name='referenced')
+    sut.add([changed, referenced])
+    sut.add([Gadget(main=referenced, parts=[changed, referenced])])
+    registry(Part).reset()
+
+    registry(Part).find(changed.id).name = 'CHANGED'
+    assert [p.name for p in sut.all(Gadget)[0].parts] == ['CHANGED', 'referenced']
+    registry(Part).commit()
+
+    assert sorted(p.name for p in reader.all(Part)) == ['CHANGED', 'referenced']
+
+
+def test_references_are_checked_once_per_target_type(registry, sut, reader):
+    sut.create_table(Part)
+    sut.create_table(Gadget)
+    parts = [Part(name=f'part {i}') for i in range(6)]
+    sut.add(parts)
+    new_part = Part(name='new')
+
+    sut.profiler.clear()
+    sut.begin()
+    gadgets = [Gadget(main=parts[i], parts=[parts[(i + 1) % 6], new_part]) for i in range(6)]
+    sut.add(gadgets)
+    for gadget in gadgets:
+        gadget.main = parts[0]
+    sut.update_many(gadgets)
+    sut.commit()
+
+    selects = [q for q in _statements(sut) if q.startswith('select')]
+    assert len(selects) == 1
+    assert 'document' not in selects[0]
+
+    # The part that wasn't stored yet is added along with the next commit.
+    registry(Part).commit()
+    assert [p.id for p in reader.all(Part, ffd.Attr('name') == 'new')] == [new_part.id]
+
+
+def test_references_are_checked_once_in_a_registry_transaction(registry, sut):
+    sut.create_table(Part)
+    sut.create_table(Gadget)
+    parts = [Part(name=f'part {i}') for i in range(6)]
+    sut.add(parts)
+
+    sut.profiler.clear()
+    registry.begin_transaction()
+    registry(Gadget).append([Gadget(main=parts[i], parts=[parts[(i + 1) % 6]]) for i in range(6)])
+    registry(Gadget).commit()
+    registry.commit_transaction()
+
+    assert len([q for q in _statements(sut) if q.startswith('select')]) == 1
+
+
+def test_limited_queries_stop_scanning_once_enough_rows_match(sqlite):
+    sut = sqlite(scan_batch_size=5)
+    sut.create_table(Widget)
+    sut.add([Widget(name=f'widget {i:02}', size=i, color='red' if i % 2 else 'blue') for i in range(50)])
+    criteria = ffd.Attr('color').startswith('r')
+
+    widgets = sut.all(Widget, criteria, limit=3, offset=1, sort=(('name', True),))
+    assert [w.size for w in widgets] == [47, 45, 43]
+
+    scans = [s for s in sut.profiler.stats() if s['rows_scanned'] > 0]
+    assert [(s['rows_scanned'], s['rows_matched']) for s in scans] == [(10, 5)]
+
+    sut.profiler.clear()
+    assert len(sut.all(Widget, criteria, limit=100)) == 25
+    assert [s['rows_scanned'] for s in sut.profiler.stats()] == [50]
+
+
+def test_non_indexed_sorts_keep_only_the_rows_they_return(sqlite):
+    # Dates aren't json scalars, so sorting on one happens in python.
+    sut = sqlite(sort_run_size=4)
+    sut.create_table(Reading)
+    sut.add([Reading(taken_on=datetime(2020, 1, 1 + i % 7), size=i) for i in range(20)])
+    sort = (('taken_on', True), ('size', False))
+
+    readings = sut.all(Reading, limit=3, offset=2, sort=sort)
+    assert [r.size for r in readings] == [5, 12, 19]
+
+    stream = sut.stream(Reading, ffd.Attr('size') > 4, sort=sort, batch_size=3)
+    assert [w.size for w in stream] == [6, 13, 5, 12, 19, 11, 18, 10, 17, 9, 16, 8, 15, 7, 14]
+
+
+def test_deletes_are_set_based(sqlite, reader):
+    sut = sqlite(max_variables=30)
+    sut.create_table(Note)
+    sut.add([Note(text=f'note {i}') for i in range(40)])
+    notes = sut.all(Note)
+
+    sut.profiler.clear()
+    sut.remove(notes[:25])
+    assert [q.split()[0] for q in _statements(sut)] == ['update', 'update']
+    assert len([n for n in reader.all(Note) if n.deleted_on is not None]) == 25
+    assert all(getattr(n, '__ff_version') == 2 for n in notes[:25])
+
+    sut.profiler.clear()
+    sut.remove(notes, force=True)
+    assert [q.split()[0] for q in _statements(sut)] == ['delete', 'delete']
+    assert len(reader.all(Note)) == 0
+
+
+def test_cascades_are_removed_once_per_target_type(registry, sut, reader):
+    sut.create_table(Part)
+    sut.create_table(Crate)
+    parts = [Part(name=f'part {i}') for i in range(6)]
+    sut.add(parts)
+    sut.add([Crate(parts=parts[i:i + 3]) for i in range(0, 6, 3)])
+    crates = sut.all(Crate)
+
+    sut.profiler.clear()
+    sut.remove(crates)
+
+    assert [q.split()[0] for q in _statements(sut)] == ['delete', 'delete']
+    assert len(reader.all(Part)) == 0 and len(sut.all(Crate)) == 0
+
+
+def test_soft_deletes_keep_the_version_check(sut, reader):
+    sut.create_table(Note)
+    sut.add([Note(text=f'note {i}') for i in range(3)])
+    notes = sut.all(Note)
+    stale = reader.all(Note, ffd.Attr('text') == 'note 1')[0]
+    stale.text = 'changed'
+    assert reader.update(stale) == 1
+
+    sut.remove([n for n in notes if n.text != 'note 1'])
+    assert [getattr(n, '__ff_version') for n in notes] == [2, 1, 2]
+    with pytest.raises(ffd.ConcurrentUpdateDetected):
+        sut.remove([n for n in notes if n.text == 'note 1'])
+
+    assert getattr(notes[1], '__ff_version') == 1
+    assert [n.text for n in reader.all(Note) if n.deleted_on is None] == ['changed']
+
+
+def test_delete_by_criteria_soft_deletes(sut, reader):
+    sut.create_table(Note)
+    sut.add([Note(text=f'note {i}') for i in range(4)])
+
+    assert sut.delete_where(Note, ffd.Attr('text') == 'note 1') == 1
+    assert [n.text for n in reader.all(Note) if n.deleted_on is not None] == ['note 1']
+    assert sut.delete_where(Note, ffd.Attr('text') != 'note 1', force=True) == 3
+    assert len(reader.all(Note)) == 1
+
+
+def test_long_in_lists_are_chunked_or_joined_against_a_temporary_table(sqlite):
+    sut = sqlite(in_list_chunk_size=5, in_list_table_size=20)
+    sut.create_table(Widget)
+    widgets = [Widget(name=f'widget {i:02}', size=i % 4) for i in range(40)]
+    sut.add(widgets)
+    ids = [w.id for w in widgets]
+    sut.profiler.clear()
+
+    criteria = ffd.Attr('id').is_in(ids[:12]) & (ffd.Attr('size') > 0)
+    assert [w.name for w in sut.all(Widget, criteria, sort=(('name', True),), limit=3, offset=1)] == \
+        ['widget 10', 'widget 09', 'widget 07']
+    assert sut.all(Widget, criteria, count=True) == 9
+    assert len(_statements(sut)) == 6
+
+    sut.profiler.clear()
+    criteria = ffd.Attr('id').is_in(ids[:30]) | (ffd.Attr('name') == 'widget 39')
+    assert len(sut.all(Widget, criteria)) == 31
+    assert any('(select value from __ff_ids_0)' in q for q in _statements(sut))
+    assert sut.all(Widget, ffd.Attr('id').is_in(ids[5:35]) & (ffd.Attr('size') == 0), count=True) == 7
+
+    assert sut.delete_where(Widget, ffd.Attr('id').is_in(ids[:25])) == 25
+    assert len(sut.all(Widget)) == 15
+    assert sut._execute("select name from sqlite_temp_master where type = 'table'") == []
+
+
+def test_small_changes_to_large_documents_are_patched(sqlite, reader):
+    # Every statement goes to the slow query log, which keeps the parameters it was run with.
+    sut = sqlite(slow_query_ms=0)
+    sut.create_table(Catalog)
+    sut.add(Catalog(name='catalog', items=[f'item {i}' for i in range(200)], attributes={'a': 1, 'b': 2}))
+    catalog = sut.all(Catalog)[0]
+
+    catalog.items[5] = 'changed'
+    del catalog.attributes['a']
+    assert sut.update_many([catalog]) == []
+
+    update = _last_update(sut)
+    assert 'json_set' in update['sql'] and 'json_remove' in update['sql']
+    assert sum(len(str(v)) for v in update['params'].values()) < 200
+    stored = reader.all(Catalog)[0]
+    assert stored.items == catalog.items and stored.attributes == {'b': 2} and stored.name == 'catalog'
+
+    catalog.name = 'renamed'
+    assert sut.update_many([catalog]) == []
+    assert 'json_set' in _last_update(sut)['sql']
+    assert reader.all(Catalog)[0].name == 'renamed'
+
+    catalog.items = [f'other {i}' for i in range(200)]
+    assert sut.update_many([catalog]) == []
+    assert 'json_set' not in _last_update(sut)['sql']
+    assert reader.all(Catalog)[0].items == catalog.items
+
+
+def test_invalid_transaction_mode(sqlite):
+    with pytest.raises(ffd.ConfigurationError):
+        sqlite(transaction_mode='eventually')
+
+
+@pytest.fixture()
+def sut(sqlite):
+    ret = sqlite()
+    ret.create_table(Widget)
+    return ret
+
+
+@pytest.fixture()
+def reader(sqlite):
+    return sqlite()
+
+
+@pytest.fixture()
+def registry(registry, container, sut):
+    # sut was built with the container's registry. Its repositories for the aggregates here use this test's sut.
+    factory.container = container
+    factory.interface = sut
+    for entity in (Widget, Part, Gadget, Note, Crate, Catalog):
+        registry.register_factory(entity, factory)
+    return registry
+
+
+class Factory(ffd.RepositoryFactory):
+    container = None
+    interface = None
+
+    def __call__(self, entity):
+        interface = self.interface
+
+        class Repository(ffi.RdbRepository[entity]):
+            def __init__(self):
+                super().__init__(interface=interface)
+
+        return self.container.build(Repository)
+
+
+factory = Factory()
+
+
+def _statements(interface):
+    # The fingerprint of every statement run since the profiler was last cleared, once per execution.
+    return [s['fingerprint'] for s in interface.profiler.stats() for _ in range(s['count'])]
+
+
+def _last_update(interface):
+    return [q for q in interface.profiler.slow_queries() if q['sql'].startswith('update')][-1]
@@ -0,0 +1,82 @@
+#  Copyright (c) 2019 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+import sqlite3
+
+import firefly.domain as ffd
+import firefly.infrastructure as ffi
+import pytest
+from firefly.infrastructure.repository.statement_profiler import fingerprint
+
+
+class Widget(ffd.AggregateRoot):
+    id: str = ffd.id_()
+    name: str = ffd.required(index=True)
+    size: int = ffd.optional()
+
+
+def test_fingerprint_normalises_values():
+    assert fingerprint("select * from t where a = :v_1 and b in (:v_2, :v_3) and c = 'x' limit 10") == \
+        fingerprint("select * from t where a = :v_9 and b in (:v_4) and c = 'y' limit 20")
+    assert fingerprint('insert into t (a, b) values (:a_0, :b_0), (:a_1, :b_1)') == \
+        'insert into t (a, b) values (?+)'
+    assert fingerprint("select json_extract(document, '$.size') from t") != \
+        fingerprint("select json_extract(document, '$.name') from t")
+
+
+def test_profiler_keeps_per_statement_stats():
+    sut = ffi.StatementProfiler(slow_query_threshold=0.5, max_samples=10)
+    for i in range(20):
+        assert sut.record(f'select * from t where id = :id_{i}', (i + 1) / 100) is False
+    assert sut.record('select * from u', 1.0) is True
+
+    stats = sut.stats()
+    assert [s['fingerprint'] for s in stats] == ['select * from t where id = ?', 'select * from u']
+    assert stats[0]['count'] == 20
+    assert stats[0]['max_ms'] == pytest.approx(200)
+    assert stats[0]['p50_ms'] == pytest.approx(150)
+    assert stats[0]['p95_ms'] == pytest.approx(200)
+
+
+def test_slow_statements_are_logged_with_their_plan(sut):
+    sut.profiler.slow_query_threshold = 0
+    sut.all(Widget, ffd.Attr('name') == 'foo')
+
+    slow = [q for q in sut.profiler.slow_queries() if q['sql'].startswith('select')]
+    assert slow[0]['params'] is not None
+    assert any('SCAN' in step for step in slow[0]['plan'])
+    assert any(s['fingerprint'].startswith('select') for s in sut.profiler.stats())
+
+
+def test_failed_statements_are_recorded(sut):
+    sut.profiler.slow_query_threshold = 0
+    with pytest.raises(sqlite3.OperationalError):
+        sut._execute('select * from missing')
+
+    assert [s['fingerprint'] for s in sut.profiler.stats()][-1] == 'select * from missing'
+    assert sut.profiler.slow_queries()[-1]['sql'] == 'select * from missing'
+
+
+def test_profile_is_saved_on_disconnect(sqlite, tmp_path):
+    sut = sqlite(profile_file=str(tmp_path / 'profile.json'))
+    sut.create_table(Widget)
+    sut.disconnect()
+
+    assert (tmp_path / 'profile.json').read_text().startswith('{"statements": [')
+
+
+@pytest.fixture()
+def sut(sqlite):
+    ret = sqlite()
+    ret.create_table(Widget)
+    return ret